@@ -0,0 +1,79 @@
+"""
+Local multi-node benchmark: propagation latency percentiles across a cluster of Clients on loopback
+
+    python -m benchmarks.bench_cluster [nodes] [blocks]
+"""
+import sys
+import time
+
+import numpy
+
+from core import Client, Seed
+
+from .common import Probe, free_port, make_chain, quiet_workdir, start_daemon
+
+
+def bench_cluster(n_nodes=16, n_blocks=200, transport='asyncio', relay='blocks', interval=0.01, timeout=60):
+    """
+    Inject blocks at one node and time their first arrival at a probe peer attached to every node
+    :return: dict of results
+    """
+    blocks = make_chain(n_blocks)
+    with quiet_workdir():
+        seed_port = free_port()
+        seed = Seed('127.0.0.1', seed_port)
+        start_daemon(seed.start)
+        ports = []
+        for i in range(n_nodes):
+            port = free_port()
+            client = Client('127.0.0.1', port, '127.0.0.1', seed_port, 0.1, 600, i, transport=transport, relay=relay)
+            start_daemon(client.start)
+            ports.append(port)
+            # let it register before the next one fetches the client-list
+            time.sleep(0.05)
+        time.sleep(0.5)
+        probes = [Probe(('127.0.0.1', port), 'probe%d' % i) for i, port in enumerate(ports)]
+        feeder = Probe(('127.0.0.1', ports[0]), 'feeder')
+        time.sleep(0.2)
+        sent = {}
+        for block in blocks:
+            sent[block] = time.perf_counter()
+            feeder.send_blocks([block])
+            time.sleep(interval)
+        deadline = time.time() + timeout
+        for probe in probes:
+            probe.wait_for(n_blocks, max(0.0, deadline - time.time()))
+        feeder.close()
+        for probe in probes:
+            probe.close()
+    # the injecting node forwards to its probe too, so every probe should see every block
+    latencies = numpy.array([probe.arrivals[block] - sent[block]
+                             for probe in probes for block in blocks if block in probe.arrivals]) * 1000
+    full = [max(probe.arrivals[block] for probe in probes) - sent[block]
+            for block in blocks if all(block in probe.arrivals for probe in probes)]
+    return {
+        'nodes': n_nodes,
+        'blocks': n_blocks,
+        'transport': transport,
+        'relay': relay,
+        'delivered': float(len(latencies)) / (n_nodes * n_blocks),
+        'latency_ms_p50': float(numpy.percentile(latencies, 50)) if len(latencies) else None,
+        'latency_ms_p90': float(numpy.percentile(latencies, 90)) if len(latencies) else None,
+        'latency_ms_p99': float(numpy.percentile(latencies, 99)) if len(latencies) else None,
+        'full_propagation_ms_p50': float(numpy.percentile(full, 50)) * 1000 if full else None,
+    }
+
+
+def main(n_nodes=16, n_blocks=200):
+    results = []
+    for relay in ('blocks', 'inv'):
+        result = bench_cluster(n_nodes, n_blocks, relay=relay)
+        print("%-6s p50 %.2f ms  p90 %.2f ms  p99 %.2f ms  delivered %.1f%%" % (
+            relay, result['latency_ms_p50'] or -1, result['latency_ms_p90'] or -1, result['latency_ms_p99'] or -1,
+            result['delivered'] * 100))
+        results.append(result)
+    return results
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,46 @@
+"""
+Micro-benchmark for block hashing: old hexdigest/int conversion vs raw digest bytes vs memoized digests
+
+    python -m benchmarks.bench_hashing [blocks] [rounds]
+"""
+import hashlib
+import struct
+import sys
+import time
+import timeit
+
+from core.blockchain import BLOCK_FORMAT, Blockhain
+
+
+def hexdigest_sha256(message):
+    # hashing as done before digests were cached
+    return int(hashlib.sha256(message).hexdigest(), 16) & 0xffff
+
+
+def hashes_per_second(function, blocks, rounds):
+    seconds = min(timeit.repeat(lambda: [function(block) for block in blocks], number=1, repeat=rounds))
+    return len(blocks) / seconds
+
+
+def main(n_blocks=100000, rounds=5):
+    now = int(time.time())
+    blocks = [struct.pack(BLOCK_FORMAT, i & 0xffff, (i * 7) & 0xffff, now, 0) for i in range(n_blocks)]
+    block_chain = Blockhain()
+    for block in blocks:
+        block_chain.add_block(block, 0, 0)
+    assert all(hexdigest_sha256(block) == block_chain.get_sha256(block) for block in blocks[:1000])
+
+    results = [
+        {'method': "hexdigest", 'hashes_per_second': hashes_per_second(hexdigest_sha256, blocks, rounds)},
+        {'method': "digest", 'hashes_per_second': hashes_per_second(Blockhain.sha256, blocks, rounds)},
+        {'method': "memoized", 'hashes_per_second': hashes_per_second(block_chain.get_sha256, blocks, rounds)},
+    ]
+    base = results[0]['hashes_per_second']
+    for result in results:
+        print("%-10s %12.0f hashes/s  x%.2f" % (result['method'], result['hashes_per_second'],
+                                                 result['hashes_per_second'] / base))
+    return results
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,51 @@
+"""
+Micro-benchmark for Blockhain.verify_and_add_block at several chain sizes
+
+    python -m benchmarks.bench_ingest [chain sizes...]
+"""
+import sys
+import time
+
+from core.blockchain import Blockhain
+
+from .common import make_chain
+
+CHAIN_SIZES = (10**3, 10**5, 10**6)
+
+
+def bench_ingest(chain_size, n_blocks=10000, rounds=3):
+    """
+    Blocks per second accepted on top of a chain of chain_size blocks, one in ten is a fork
+    :return: dict of results
+    """
+    best = None
+    blocks = make_chain(chain_size + n_blocks, fork_every=10)
+    for _ in range(rounds):
+        block_chain = Blockhain()
+        for block in blocks[:chain_size]:
+            block_chain.verify_and_add_block(block)
+        start = time.perf_counter()
+        for block in blocks[chain_size:]:
+            block_chain.verify_and_add_block(block)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return {
+        'chain_size': chain_size,
+        'blocks': n_blocks,
+        'seconds': best,
+        'blocks_per_second': n_blocks / best,
+        'us_per_block': best / n_blocks * 1e6,
+    }
+
+
+def main(chain_sizes=CHAIN_SIZES):
+    results = []
+    for chain_size in chain_sizes:
+        result = bench_ingest(chain_size)
+        print("chain %8d: %10.0f blocks/s  %.2f us/block" % (chain_size, result['blocks_per_second'], result['us_per_block']))
+        results.append(result)
+    return results
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or CHAIN_SIZES)
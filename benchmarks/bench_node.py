@@ -0,0 +1,58 @@
+"""
+Single node benchmark: blocks per second a Client receives, verifies and forwards over loopback
+
+    python -m benchmarks.bench_node [threads|asyncio] [blocks]
+"""
+import sys
+import time
+
+from core import Client, Seed
+
+from .common import Probe, free_port, make_chain, quiet_workdir, start_daemon
+
+
+def bench_node(transport='threads', n_blocks=20000, timeout=120):
+    """
+    A feeder peer sends n_blocks valid blocks to one node and a sink peer waits for all of them to be forwarded
+    :return: dict of results
+    """
+    blocks = make_chain(n_blocks)
+    with quiet_workdir():
+        seed_port, port = free_port(), free_port()
+        seed = Seed('127.0.0.1', seed_port)
+        start_daemon(seed.start)
+        client = Client('127.0.0.1', port, '127.0.0.1', seed_port, 0.1, 600, 0, transport=transport)
+        start_daemon(client.start)
+        time.sleep(0.5)
+        sink = Probe(('127.0.0.1', port), 'sink')
+        feeder = Probe(('127.0.0.1', port), 'feeder')
+        time.sleep(0.2)
+        start = time.perf_counter()
+        feeder.send_blocks(blocks)
+        completed = sink.wait_for(n_blocks, timeout)
+        elapsed = time.perf_counter() - start
+        feeder.close()
+        sink.close()
+    return {
+        'transport': transport,
+        'blocks': n_blocks,
+        'forwarded': sink.received,
+        'completed': completed,
+        'seconds': elapsed,
+        'messages_per_second': sink.received / elapsed,
+    }
+
+
+def main(transports=('threads', 'asyncio'), n_blocks=20000):
+    results = []
+    for transport in transports:
+        result = bench_node(transport, n_blocks)
+        print("%-8s %10.0f msgs/s (%d/%d forwarded)" % (transport, result['messages_per_second'], result['forwarded'], n_blocks))
+        results.append(result)
+    return results
+
+
+if __name__ == '__main__':
+    transports = [arg for arg in sys.argv[1:] if not arg.isdigit()] or ('threads', 'asyncio')
+    counts = [int(arg) for arg in sys.argv[1:] if arg.isdigit()]
+    main(transports, *counts)
@@ -0,0 +1,68 @@
+"""
+Benchmark of the proof of work nonce search: hashes per second and per core for a growing number of workers, and
+how long a search takes to stop once cancelled
+
+    python -m benchmarks.bench_pow [seconds] [max workers]
+"""
+import os
+import sys
+import time
+from threading import Condition, Thread
+
+from core.blockchain import Blockhain
+from core.pow import ProofOfWork
+
+# out of reach in a benchmark's time, searches only end when cancelled
+DIFFICULTY = 48
+
+
+def bench_pow(workers, seconds):
+    """
+    Search for seconds on workers processes, then cancel
+    :return: dict of results
+    """
+    # workers time their own ranges, starting them is not measured
+    proof_of_work = ProofOfWork(DIFFICULTY, workers)
+    cond = Condition()
+    cancelled = []
+
+    def cancel():
+        time.sleep(seconds)
+        with cond:
+            cancelled.append(time.perf_counter())
+            cond.notify_all()
+
+    thread = Thread(target=cancel)
+    thread.start()
+    proof_of_work.search(Blockhain().block_header(), cond, lambda: bool(cancelled))
+    latency = time.perf_counter() - cancelled[0]
+    thread.join()
+    proof_of_work.close()
+    stats = proof_of_work.stats()
+    return {
+        'workers': workers,
+        'hashes_per_second': stats['hashrate'],
+        'hashes_per_second_per_core': {core: totals['hashrate'] for core, totals in stats['per_core'].items()},
+        'cancel_ms': latency * 1e3,
+    }
+
+
+def main(seconds=3.0, max_workers=None):
+    if max_workers is None:
+        max_workers = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+    results = []
+    workers = 1
+    while True:
+        result = bench_pow(workers, seconds)
+        results.append(result)
+        print("%3d workers %12.0f hashes/s  cancelled in %.2f ms" % (workers, result['hashes_per_second'],
+                                                                      result['cancel_ms']))
+        if workers >= max_workers:
+            break
+        workers = min(workers * 2, max_workers)
+    return results
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    main(float(args[0]) if args else 3.0, int(args[1]) if len(args) > 1 else None)
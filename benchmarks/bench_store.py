@@ -0,0 +1,71 @@
+"""
+Benchmark of node restart from a ChainStore against replaying every block through verify_and_add_block
+
+    python -m benchmarks.bench_store [chain sizes...]
+"""
+import shutil
+import sys
+import tempfile
+import time
+
+from core.blockchain import Blockhain
+from core.store import ChainStore
+
+from .common import make_chain
+
+CHAIN_SIZES = (10**3, 10**5, 10**6)
+
+
+def bench_store(chain_size, tail=1000):
+    """
+    Seconds to reopen a stored chain of chain_size blocks with a snapshot and tail blocks logged after it
+    :return: dict of results
+    """
+    blocks = make_chain(chain_size + tail, fork_every=10)
+    directory = tempfile.mkdtemp(prefix='bench_store_')
+    try:
+        block_chain = Blockhain()
+        store = ChainStore(directory, snapshot_interval=chain_size + tail + 1)
+        store.open(block_chain)
+        for block in blocks[:chain_size]:
+            block_chain.verify_and_add_block(block)
+        store.snapshot()
+        for block in blocks[chain_size:]:
+            block_chain.verify_and_add_block(block)
+        store.close()
+
+        start = time.perf_counter()
+        restored = Blockhain()
+        reopened = ChainStore(directory)
+        reopened.open(restored)
+        elapsed = time.perf_counter() - start
+        reopened.close()
+        assert len(restored.blocks) == len(block_chain.blocks)
+
+        start = time.perf_counter()
+        replayed = Blockhain()
+        for block in blocks:
+            replayed.verify_and_add_block(block)
+        replay = time.perf_counter() - start
+    finally:
+        shutil.rmtree(directory)
+    return {
+        'chain_size': chain_size,
+        'seconds': elapsed,
+        'replay_seconds': replay,
+        'us_per_block': elapsed / (chain_size + tail) * 1e6,
+    }
+
+
+def main(chain_sizes=CHAIN_SIZES):
+    results = []
+    for chain_size in chain_sizes:
+        result = bench_store(chain_size)
+        print("chain %8d: open %.3f s  (%.2f us/block)  replay %.3f s" % (
+            chain_size, result['seconds'], result['us_per_block'], result['replay_seconds']))
+        results.append(result)
+    return results
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or CHAIN_SIZES)
@@ -0,0 +1,111 @@
+"""
+Helpers shared by benchmarks: chains of valid blocks, loopback nodes and probe peers
+"""
+import contextlib
+import os
+import socket
+import struct
+import tempfile
+import threading
+import time
+
+from core.blockchain import BLOCK_FORMAT, BLOCK_SIZE, Blockhain
+from core.framing import FRAME_BLOCKS, FRAME_GETDATA, FRAME_HELLO, FRAME_INV, FrameReader, encode_frame, sendmsg_all
+
+
+def make_chain(n_blocks, fork_every=0, prev_block_hash=0x9e1c):
+    """
+    Build n_blocks valid blocks, each child of the previous one, all unique
+    :param n_blocks: number of blocks
+    :param fork_every: if set, every fork_every-th block is a sibling of the previous one instead
+    :param prev_block_hash: parent of the first block, genesis by default
+    :return: list of blocks
+    """
+    now = int(time.time())
+    blocks = []
+    parent = prev_block_hash
+    for i in range(n_blocks):
+        block = struct.pack(BLOCK_FORMAT, parent, i & 0xffff, now + (i >> 16), 0)
+        blocks.append(block)
+        if not fork_every or i % fork_every:
+            parent = Blockhain.sha256(block)
+    return blocks
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@contextlib.contextmanager
+def quiet_workdir():
+    """
+    Run nodes in a scratch directory with their per message prints discarded
+    """
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as workdir, open(os.devnull, 'w') as devnull:
+        os.chdir(workdir)
+        try:
+            with contextlib.redirect_stdout(devnull):
+                yield workdir
+        finally:
+            os.chdir(cwd)
+
+
+def start_daemon(target, *args):
+    thread = threading.Thread(target=target, args=args)
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+class Probe:
+    def __init__(self, address, name='probe'):
+        """
+        A bare peer connected to a node that records when each block first reaches it
+        :param address: (ip, port) of node
+        :param name: peer id sent in hello frame
+        """
+        self.sock = socket.create_connection(address)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sendmsg_all(self.sock, encode_frame(FRAME_HELLO, [bytes('%s:0' % name, 'utf-8')]))
+        # block -> perf_counter time of arrival
+        self.arrivals = {}
+        self.received = 0
+        self.done = threading.Condition()
+        start_daemon(self.receive)
+
+    def receive(self):
+        reader = FrameReader()
+        try:
+            while reader.recv_into(self.sock):
+                now = time.perf_counter()
+                for frame_type, payload in reader.frames():
+                    if frame_type == FRAME_INV:
+                        # fetch everything announced
+                        sendmsg_all(self.sock, encode_frame(FRAME_GETDATA, [bytes(payload)]))
+                    if frame_type != FRAME_BLOCKS:
+                        continue
+                    for offset in range(0, len(payload), BLOCK_SIZE):
+                        self.arrivals.setdefault(bytes(payload[offset:offset + BLOCK_SIZE]), now)
+                with self.done:
+                    self.received = len(self.arrivals)
+                    self.done.notify_all()
+        except OSError:
+            pass
+
+    def send_blocks(self, blocks, batch=100):
+        for start in range(0, len(blocks), batch):
+            sendmsg_all(self.sock, encode_frame(FRAME_BLOCKS, blocks[start:start + batch]))
+
+    def wait_for(self, count, timeout):
+        """
+        Wait until count distinct blocks arrived
+        :return: true if they did before timeout
+        """
+        with self.done:
+            return self.done.wait_for(lambda: self.received >= count, timeout)
+
+    def close(self):
+        self.sock.close()
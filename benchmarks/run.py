@@ -0,0 +1,84 @@
+"""
+Run the benchmark suite and write machine readable results, or compare two result files
+
+    python -m benchmarks.run [--quick] [--out results.json]
+    python -m benchmarks.run --compare old.json new.json
+"""
+import argparse
+import json
+import platform
+import subprocess
+import time
+
+from . import bench_cluster, bench_hashing, bench_ingest, bench_node, bench_pow, bench_store
+
+# metric compared between runs for each benchmark, and whether higher is better
+METRICS = {
+    'hashing': ('hashes_per_second', True),
+    'ingest': ('blocks_per_second', True),
+    'node': ('messages_per_second', True),
+    'cluster': ('latency_ms_p50', False),
+    'store': ('seconds', False),
+    'pow': ('hashes_per_second', True),
+}
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(quick=False):
+    return {
+        'commit': git_commit(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'quick': quick,
+        'results': {
+            'hashing': bench_hashing.main(10000 if quick else 100000),
+            'ingest': bench_ingest.main((10**3, 10**4) if quick else bench_ingest.CHAIN_SIZES),
+            'node': bench_node.main(n_blocks=2000 if quick else 20000),
+            'store': bench_store.main((10**3, 10**4) if quick else bench_store.CHAIN_SIZES),
+            'cluster': bench_cluster.main(*((4, 50) if quick else (16, 200))),
+            'pow': bench_pow.main(1.0 if quick else 5.0),
+        },
+    }
+
+
+def compare(old_path, new_path):
+    """
+    Print the main metric of every benchmark case of two result files side by side
+    """
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print("%s -> %s" % (old.get('commit'), new.get('commit')))
+    for name, (metric, higher_is_better) in METRICS.items():
+        for old_case, new_case in zip(old['results'].get(name, []), new['results'].get(name, [])):
+            label = ", ".join("%s=%s" % (key, value) for key, value in new_case.items()
+                              if isinstance(value, str) or key in ('chain_size', 'nodes', 'workers'))
+            before, after = old_case.get(metric), new_case.get(metric)
+            if not before or after is None:
+                continue
+            change = after / before if higher_is_better else before / after
+            print("%-8s %-40s %-20s %14.2f %14.2f  x%.2f%s" % (
+                name, label, metric, before, after, change, "  REGRESSION" if change < 0.9 else ""))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Gossip protocol benchmark suite")
+    parser.add_argument('--quick', action='store_true', help="smaller sizes for a fast check")
+    parser.add_argument('--out', default='bench_results.json')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'))
+    args = parser.parse_args()
+    if args.compare:
+        compare(*args.compare)
+    else:
+        results = run(args.quick)
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+        print("Results written to %s" % args.out)
@@ -1,3 +1,4 @@
 from .blockchain import Blockhain
 from .client import Client
-from .seed import Seed
\ No newline at end of file
+from .seed import Seed
+from .seen import SeenCache, StripedSeenCache
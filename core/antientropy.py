@@ -0,0 +1,143 @@
+import logging
+import random
+import struct
+import time
+from threading import Thread
+
+from .framing import FRAME_MISSING, FRAME_SKETCH, FRAME_TIP
+from .sketch import Sketch, digest
+
+# tip summary: height of tip (-1 for an empty chain), tip hash, digest and count of blocks in the window of heights
+# ending at the tip, window size
+TIP = struct.Struct('!iHQIH')
+# sketch header: lowest and highest height covered, cells follow
+SKETCH_HEADER = struct.Struct('!ii')
+
+
+class AntiEntropy:
+    def __init__(self, client, interval=10.0, window=64, min_cells=24, max_cells=512, max_batch=256):
+        """
+        Periodic reconciliation of a client's recent chain with one random neighbor at a time, recovers blocks lost
+        to connection resets, evicted orphans or the timestamp filter. Every interval the client sends its tip
+        summary; a neighbor that is ahead sends the blocks above it, a neighbor whose window differs sends a sketch of
+        its window, and the difference decoded from the sketch is exactly the blocks each side lacks. An exchange
+        costs at most one sketch of max_cells and two batches of max_batch blocks.
+        :param client: Client
+        :param interval: seconds between exchanges
+        :param window: heights below the tip compared
+        :param min_cells: smallest sketch sent
+        :param max_cells: largest sketch sent, a bigger difference is retried on a narrower window
+        :param max_batch: max blocks sent in reply to one summary or sketch
+        """
+        self.client = client
+        self.interval = interval
+        self.window = window
+        self.min_cells = min_cells
+        self.max_cells = max_cells
+        self.max_batch = max_batch
+        self.exchanges = 0
+        self.in_sync = 0
+        self.sketches = 0
+        self.decode_failures = 0
+        self.blocks_sent = 0
+        self.blocks_decoded = 0
+
+    def start(self):
+        thread = Thread(target=self.run)
+        thread.daemon = True
+        thread.start()
+
+    def run(self):
+        client = self.client
+        while True:
+            time.sleep(self.interval)
+            neighbors = [connection for connection in list(client.connections) if not connection.closed]
+            if neighbors:
+                self.exchanges += 1
+                client.transport.send(FRAME_TIP, [self.tip(self.window)], None, [random.choice(neighbors)])
+
+    def tip(self, window):
+        """
+        :param window: heights below the tip summarised
+        :return: TIP payload of this node
+        """
+        block_chain = self.client.block_chain
+        with block_chain.lock:
+            height = len(block_chain.block_chain) - 1
+            blocks = block_chain.blocks_between(height - window + 1, height)
+            tip_hash = block_chain.tip_hash
+        return TIP.pack(height, tip_hash, digest(blocks), len(blocks), window)
+
+    def on_tip(self, payload, origin):
+        """
+        A neighbor's tip summary: send it the blocks above its tip and a sketch of its window if that differs here
+        :param payload: TIP payload
+        :param origin: connection of neighbor
+        :return:
+        """
+        height, tip_hash, their_digest, count, window = TIP.unpack(payload)
+        block_chain = self.client.block_chain
+        low = max(0, height - window + 1)
+        with block_chain.lock:
+            own_height = len(block_chain.block_chain) - 1
+            above = block_chain.blocks_between(height + 1, own_height)[:self.max_batch]
+            blocks = block_chain.blocks_between(low, height)
+        if own_height < height:
+            # behind, let the neighbor do the sending
+            self.client.transport.send_to(origin, FRAME_TIP, [self.tip(window)])
+            return
+        if above:
+            self.send_missing(above, origin)
+        if len(blocks) == count and digest(blocks) == their_digest:
+            self.in_sync += 1
+            return
+        # the count difference is a lower bound of the blocks that differ
+        cells = min(self.max_cells, self.min_cells + 3 * abs(len(blocks) - count))
+        self.sketches += 1
+        self.client.transport.send_to(origin, FRAME_SKETCH, [SKETCH_HEADER.pack(low, height),
+                                                             Sketch.of(blocks, cells).encode()])
+
+    def on_sketch(self, payload, origin):
+        """
+        A neighbor's sketch of a window: add the blocks only it has and send it the blocks only this node has
+        :param payload: SKETCH_HEADER and sketch cells
+        :param origin: connection of neighbor
+        :return:
+        """
+        low, high = SKETCH_HEADER.unpack_from(payload)
+        theirs = Sketch.decode(payload[SKETCH_HEADER.size:])
+        block_chain = self.client.block_chain
+        with block_chain.lock:
+            blocks = block_chain.blocks_between(low, high)
+        difference = theirs.subtract(Sketch.of(blocks, len(theirs.counts))).peel()
+        if difference is None:
+            self.decode_failures += 1
+            window = (high - low + 1) // 2
+            logging.info("%s: sketch from %s did not decode, retrying with window %d" % (self.client, origin, window))
+            if window >= 1:
+                self.client.transport.send_to(origin, FRAME_TIP, [self.tip(window)])
+            return
+        missing, extra = difference
+        for block in missing:
+            if self.client.handle(origin.peer_id, block, origin, recovered=True):
+                self.blocks_decoded += 1
+        if extra:
+            self.send_missing(extra[:self.max_batch], origin)
+
+    def send_missing(self, blocks, origin):
+        self.blocks_sent += len(blocks)
+        self.client.transport.send_to(origin, FRAME_MISSING, blocks)
+        self.client.metrics.inc('blocks_sent', len(blocks))
+
+    def stats(self):
+        """
+        :return: dict of exchange counters
+        """
+        return {
+            'exchanges': self.exchanges,
+            'in_sync': self.in_sync,
+            'sketches': self.sketches,
+            'decode_failures': self.decode_failures,
+            'blocks_sent': self.blocks_sent,
+            'blocks_decoded': self.blocks_decoded,
+        }
@@ -2,104 +2,357 @@ import hashlib
 import struct
 import time
 import numpy
-import matplotlib.pyplot as plt
-from networkx import nx_agraph, draw
+
+from .locks import InstrumentedLock
+from .orphans import OrphanPool
+
+# block: prev block hash, merkel root, timestamp, nonce
+BLOCK_FORMAT = 'HHII'
+BLOCK_SIZE = struct.calcsize(BLOCK_FORMAT)
+# block without its nonce, what proof of work hashes a nonce onto
+HEADER_FORMAT = 'HHI'
+NONCE_FORMAT = 'I'
+
+
+def target_of(difficulty):
+    """
+    :param difficulty: leading zero bits
+    :return: 32 bytes, sha256 digests below it have difficulty leading zero bits
+    """
+    return (1 << (256 - difficulty)).to_bytes(32, 'big')
 
 
 class Blockhain:
-    def __init__(self):
+    def __init__(self, clock=time.time, rng=numpy.random, store=None, orphans=None, difficulty=0):
         """
         Create a block-chain with a genesis block with hash 0x9e1c
+        :param clock: time source for block timestamps, e.g. a simulator's virtual clock
+        :param rng: numpy random generator used for merkel roots
+        :param store: store.ChainStore every added block is appended to, None to keep the chain in memory only
+        :param orphans: orphans.OrphanPool holding blocks that arrive before their parent, a default one if None
+        :param difficulty: leading zero bits the sha256 digest of a received block must have, 0 for none
         """
+        self.clock = clock
+        self.difficulty = difficulty
+        self.target = target_of(difficulty) if difficulty else None
+        self.rng = rng
         self.genesis_hash = 0x9e1c
         self.block_chain = []
+        # block hash -> highest stored block with that hash, used to find parents
+        self.block_index = {}
+        # fork tree: block -> (digest, height, parent block) of every stored block, parent is None after genesis,
+        # used to detect duplicates, memoize hashes and walk chains
+        self.blocks = {}
+        # blocks with at least one child, None stands for genesis
+        self.extended = set()
+        # best tip: first block seen at the highest height, and its hash
+        self.tip = None
+        self.tip_hash = self.genesis_hash
+        # blocks added to a parent that already had a child, each one starts a branch off another chain
+        self.forks = 0
+        # guards block-chain mutation, held only for index lookups and inserts
+        self.lock = InstrumentedLock()
+        self.store = store
+        self.orphans = orphans if orphans is not None else OrphanPool(clock=clock)
+
+    @staticmethod
+    def sha256(message):
+        """
+        Generate sha256 hash of message and return last 16 bits, read straight from the digest bytes
+        :param message: bytes or buffer
+        :return: sha256 last 16 bits
+        """
+        return int.from_bytes(hashlib.sha256(message).digest()[-2:], 'big')
+
+    def checked_sha256(self, message, digest=None):
+        """
+        Hash a received block once for both the difficulty check and its 16 bit id
+        :param message: block
+        :param digest: sha256 digest of message if already computed
+        :return: sha256 last 16 bits, None if the block's digest has fewer than difficulty leading zero bits
+        """
+        if digest is None:
+            if self.target is None:
+                return self.get_sha256(message)
+            digest = hashlib.sha256(message).digest()
+        if self.target is not None and digest >= self.target:
+            return None
+        return int.from_bytes(digest[-2:], 'big')
 
     def get_sha256(self, message):
         """
-        Generate sha256 hash of message and return last 16 bits
-        :param message: string or buffer
+        Return the hash of a stored block from cache, hash any other message
+        :param message: bytes or buffer
         :return: sha256 last 16 bits
         """
-        return int(hashlib.sha256(message).hexdigest(), 16) & 0xffff
+        stored = self.blocks.get(message)
+        if stored is not None:
+            return stored[0]
+        return self.sha256(message)
 
     def get_prev_block_hash(self):
         """
         It returns the hash of latest block user should mine on
         :return: sha256 hash
         """
-        if len(self.block_chain) == 0:
-            prev_block_hash = self.genesis_hash
+        return self.tip_hash
+
+    def add_block(self, block, parent, height, block_hash=None):
+        """
+        Store a block at given height and index it by its hash, caller holds lock
+        :param block: block to store
+        :param parent: stored parent block, None for a block after genesis
+        :param height: index into block_chain
+        :param block_hash: hash of block if already computed
+        :return: true if block starts a new height
+        """
+        if block_hash is None:
+            block_hash = self.get_sha256(block)
+        self.blocks[block] = (block_hash, height, parent)
+        # on a 16 bit hash collision keep the highest block, same as a top-down scan would find
+        indexed = self.block_index.get(block_hash)
+        if indexed is None or self.blocks[indexed][1] < height:
+            self.block_index[block_hash] = block
+        if parent in self.extended:
+            self.forks += 1
         else:
-            prev_block = self.block_chain[-1][0]
-            prev_block_hash = self.get_sha256(prev_block)
-        return prev_block_hash
+            self.extended.add(parent)
+        if self.store is not None:
+            self.store.append(block, height)
+        if height < len(self.block_chain):
+            self.block_chain[height].append(block)
+            return False
+        self.block_chain.append([block])
+        self.tip = block
+        self.tip_hash = block_hash
+        return True
+
+    def flush(self):
+        """
+        Write the blocks logged to the store while lock was held, caller doesn't hold lock
+        :return:
+        """
+        if self.store is not None:
+            self.store.flush()
+
+    def main_chain(self):
+        """
+        Walk parent pointers from the best tip down to genesis, caller holds lock
+        :return: generator of blocks, tip first
+        """
+        block = self.tip
+        while block is not None:
+            yield block
+            block = self.blocks[block][2]
+
+    def blocks_between(self, low, high):
+        """
+        Blocks stored at heights low to high, both included, caller holds lock
+        :return: list of blocks in height order
+        """
+        return [block for level in self.block_chain[max(0, low):max(0, high + 1)] for block in level]
+
+    def stats(self):
+        """
+        Chain statistics kept up to date by add_block, O(1)
+        :return: dict of counters
+        """
+        total_blocks = len(self.blocks)
+        # every block has its parent one height below, so the best tip's chain holds one block per height
+        main_chain_length = len(self.block_chain)
+        return {
+            'total_blocks': total_blocks,
+            'main_chain_length': main_chain_length,
+            'stale_blocks': total_blocks - main_chain_length,
+            'orphaned_branches': self.forks,
+            'tip_hash': self.tip_hash,
+        }
+
+    def export(self):
+        """
+        Every stored block in height order, caller holds lock
+        :return: (list of blocks, list of heights, list of hashes)
+        """
+        blocks = [block for level in self.block_chain for block in level]
+        heights = [height for height, level in enumerate(self.block_chain) for _ in level]
+        return blocks, heights, [self.blocks[block][0] for block in blocks]
+
+    def restore(self, blocks, block_chain, extended, block_index, forks):
+        """
+        Replace the chain with indexes loaded by a store, e.g. store.StoredBlocks and store.StoredLevels, views of a
+        memory mapped snapshot that look blocks up on access instead of loading each one
+        :param blocks: mapping like self.blocks
+        :param block_chain: sequence of height levels like self.block_chain
+        :param extended: set like self.extended
+        :param block_index: dict like self.block_index
+        :param forks: branch count of the restored blocks
+        :return:
+        """
+        self.blocks = blocks
+        self.block_chain = block_chain
+        self.extended = extended
+        self.block_index = block_index
+        self.forks = forks
+        if len(block_chain):
+            self.tip = block_chain[-1][0]
+            self.tip_hash = blocks[self.tip][0]
+        else:
+            self.tip, self.tip_hash = None, self.genesis_hash
 
     def generate_block(self):
         """
         Generate a block after longest chain
         :return: block
         """
-        prev_block_hash = self.get_prev_block_hash()
-        merkel_root = numpy.random.randint(0, 0xffff)
-        timestamp = int(time.time())
-        # print prev_block_hash, merkel_root, timestamp
-        block = struct.pack('HHI', prev_block_hash, merkel_root, timestamp)
-        self.block_chain.append([block])
+        merkel_root = self.rng.randint(0, 0xffff)
+        timestamp = int(self.clock())
+        with self.lock:
+            prev_block_hash = self.get_prev_block_hash()
+            # print prev_block_hash, merkel_root, timestamp
+            block = struct.pack(BLOCK_FORMAT, prev_block_hash, merkel_root, timestamp, 0)
+            self.add_block(block, self.tip, len(self.block_chain))
+        self.flush()
         return block
 
-    def verify_and_add_block(self, message):
+    def block_header(self):
+        """
+        Fields of a new block after longest chain without its nonce, proof of work searches a nonce for it
+        :return: packed HEADER_FORMAT
+        """
+        merkel_root = self.rng.randint(0, 0xffff)
+        timestamp = int(self.clock())
+        with self.lock:
+            prev_block_hash = self.get_prev_block_hash()
+        return struct.pack(HEADER_FORMAT, prev_block_hash, merkel_root, timestamp)
+
+    def verify_and_add_block(self, message, connected=None, check_timestamp=True, digest=None):
         """
-        Verify and append a received block at appropriate place in block-chain
+        Verify and append a received block at appropriate place in block-chain. A block whose parent is unknown is
+        kept in the orphan pool and added once its parent is.
         :param message: received block
-        :return: true if added successfully
+        :param connected: if a list, orphans added after message are appended to it
+        :param check_timestamp: false to accept a block more than an hour old, e.g. one a peer already has in its
+            chain
+        :param digest: sha256 digest of message if already computed, e.g. for its inventory id
+        :return: (true if added successfully, true if message or a connected orphan starts a new height)
         """
         valid_block, new_block = False, False
         try:
-            block = struct.unpack('HHI', message)
-            # check block timestamp
-            if abs(int(time.time() - block[2])) > 3600:
-                print ("block timestamp very old!")
+            block = struct.unpack(BLOCK_FORMAT, message)
+        except (struct.error, TypeError):
+            print("Bad block: failed to unpack")
+            return valid_block, new_block
+        # check block timestamp
+        if check_timestamp and abs(int(self.clock() - block[2])) > 3600:
+            print ("block timestamp very old!")
+            return valid_block, new_block
+        block_hash = self.checked_sha256(message, digest)
+        if block_hash is None:
+            print ("block below difficulty!")
+            return valid_block, new_block
+        with self.lock:
+            # ignore a block already in block-chain
+            if message in self.blocks:
                 return valid_block, new_block
             # find previous block
-            for j in range(len(self.block_chain) - 1, -1, -1):
-                for k in range(0, len(self.block_chain[j])):
-                    # print self.get_sha256(self.block_chain[j][k]), block[0]
-                    if self.get_sha256(self.block_chain[j][k]) == block[0]:
-                        valid_block = True
-                        if j + 1 < len(self.block_chain):
-                            self.block_chain[j+1].append(message)
-                        else:
-                            self.block_chain.append([message])
-                            new_block = True
-                        return valid_block, new_block
-            # check if it's just after genesis block
-            if self.genesis_hash == block[0]:
-                valid_block = True
-                if len(self.block_chain) == 0:
-                    self.block_chain.append([message])
-                    new_block = True
-                else:
-                    self.block_chain[0].append(message)
+            parent = self.block_index.get(block[0])
+            if parent is not None:
+                height = self.blocks[parent][1] + 1
+            elif self.genesis_hash == block[0]:
+                # it's just after genesis block
+                height = 0
+            else:
+                self.orphans.add(message, block[0])
                 return valid_block, new_block
-        except:
-            print("Bad block: failed to unpack")
+            valid_block = True
+            new_block = self.add_block(message, parent, height, block_hash)
+            if self.orphans.by_parent:
+                new_block = self.connect_orphans(message, block_hash, height, connected) or new_block
+        self.flush()
         return valid_block, new_block
 
+    def add_range(self, records, connected=None):
+        """
+        Validate and add blocks of consecutive heights fetched from a peer, hashing them first and then linking all of
+        them in one lock hold. A block is valid if its parent is stored one height below it, old timestamps are fine.
+        :param records: list of (height, block) in height order
+        :param connected: if a list, orphans added after a block of the range are appended to it
+        :return: (blocks added, blocks rejected)
+        """
+        hashed = []
+        for height, block in records:
+            block_hash = self.checked_sha256(block)
+            if block_hash is not None:
+                hashed.append((height, block, block_hash, struct.unpack_from(BLOCK_FORMAT, block)[0]))
+        rejected = len(records) - len(hashed)
+        added = 0
+        with self.lock:
+            for height, block, block_hash, prev_hash in hashed:
+                # a block is stored once, at the height it was first added, as verify_and_add_block does
+                if block in self.blocks:
+                    continue
+                if height == 0:
+                    parent = None
+                    valid = prev_hash == self.genesis_hash
+                else:
+                    # the parent's height is known, so a 16 bit hash collision elsewhere in the chain doesn't matter
+                    level = self.block_chain[height - 1] if height - 1 < len(self.block_chain) else ()
+                    parent = next((block for block in level if self.blocks[block][0] == prev_hash), None)
+                    valid = parent is not None
+                if not valid:
+                    rejected += 1
+                    continue
+                self.add_block(block, parent, height, block_hash)
+                added += 1
+                if self.orphans.by_parent:
+                    self.connect_orphans(block, block_hash, height, connected)
+        self.flush()
+        return added, rejected
+
+    def connect_orphans(self, block, block_hash, height, connected=None):
+        """
+        Add the orphans waiting for a block just added, and their own waiting descendants, caller holds lock
+        :param block: block just added
+        :param block_hash: its hash
+        :param height: its height
+        :param connected: if a list, added orphans are appended to it
+        :return: true if an orphan starts a new height
+        """
+        new_block = False
+        pending = [(block, block_hash, height)]
+        while pending:
+            parent, parent_hash, parent_height = pending.pop()
+            for child in self.orphans.pop_children(parent_hash):
+                if child in self.blocks:
+                    continue
+                child_hash = self.get_sha256(child)
+                new_block = self.add_block(child, parent, parent_height + 1, child_hash) or new_block
+                pending.append((child, child_hash, parent_height + 1))
+                if connected is not None:
+                    connected.append(child)
+        return new_block
+
     def tree(self):
-        graph = nx_agraph.Graph()
-        node_pos = {}
-        for j in range(len(self.block_chain) - 1, 0, -1):
-            for k in range(0, len(self.block_chain[j])):
-                vertex1 = self.block_chain[j][k]
-                for l in range(0, len(self.block_chain[j - 1])):
-                    vertex2 = self.block_chain[j - 1][l]
-                    if struct.unpack('HHI', vertex1)[0] == self.get_sha256(vertex2):
-                        graph.add_edge("%d_%d" % (j, l), "%d_%d" % (j + 1, k))
-                        node_pos["%d_%d" % (j, l)] = (j, l)
-                        node_pos["%d_%d" % (j + 1, k)] = (j + 1, k)
-        for i in range(len(self.block_chain[0])):
-            graph.add_edge('genesis', "%d_%d" % (1, i))
-            node_pos["genesis"] = (0, 0)
-            node_pos["%d_%d" % (1, i)] = (1, i)
+        """
+        Draw the fork tree with matplotlib, for small chains, see forktree.write_tree to export large ones
+        :return:
+        """
+        import matplotlib.pyplot as plt
+        from networkx import Graph, draw
+
+        graph = Graph()
+        node_pos = {'genesis': (0, 0)}
+        with self.lock:
+            # position of each block of the previous level
+            positions = {}
+            for height, level in enumerate(self.block_chain):
+                for k, block in enumerate(level):
+                    node_pos["%d_%d" % (height + 1, k)] = (height + 1, k)
+                    parent = self.blocks[block][2]
+                    if parent is None:
+                        graph.add_edge('genesis', "%d_%d" % (height + 1, k))
+                    else:
+                        graph.add_edge("%d_%d" % (height, positions[parent]), "%d_%d" % (height + 1, k))
+                positions = {block: k for k, block in enumerate(level)}
         draw(graph, with_labels=True, pos=node_pos)
         plt.show()
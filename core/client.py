@@ -1,174 +1,502 @@
+import hashlib
 import logging
-import pickle
-import random
 import numpy
 import socket
+import struct
 import time
-from collections import defaultdict
-from threading import Condition, Lock, Thread
+from threading import Condition, Event, Lock, Thread
+from time import perf_counter
 
-from .blockchain import Blockhain
+from .blockchain import BLOCK_FORMAT, BLOCK_SIZE, NONCE_FORMAT, Blockhain
+from .antientropy import AntiEntropy
+from .dissemination import Dissemination
+from .framing import (FRAME_BLOCKS, FRAME_GET_RANGE, FRAME_GET_STATUS, FRAME_GETDATA, FRAME_INV, FRAME_KNOWN,
+                      FRAME_MISSING, FRAME_RANGE, FRAME_RUMOR, FRAME_SKETCH, FRAME_START_MN, FRAME_STATUS,
+                      FRAME_SUMMARY, FRAME_TIP)
+from .eventlog import FORWARDED, GENERATED, RECEIVED, REJECTED, EventLog
+from .inventory import Inventory, inv_ids
+from .metrics import Metrics
+from .orphans import OrphanPool
+from .peer import OVERFLOW_POLICIES
+from .pow import ProofOfWork
+from .seen import StripedSeenCache
+from .store import ChainStore
+from .sync import ChainSync
+from .topology import Topology
+from .transport import AsyncioTransport, ThreadTransport
+
+START_MN = b'START-MN'
+# how blocks are relayed: pushed in full, or announced by id and fetched on demand
+RELAYS = ('blocks', 'inv')
+
+TRANSPORTS = {
+    'threads': ThreadTransport,
+    'asyncio': AsyncioTransport,
+}
 
 
 class Client:
-    def __init__(self, ip, port, seed_ip, seed_port, hash_power, inter_arrival_time, random_seed):
+    def __init__(self, ip, port, seed_ip, seed_port, hash_power, inter_arrival_time, random_seed, transport='threads',
+                 seen_cache=None, relay='blocks', peer_queue=1000, overflow='drop-oldest',
+                 stats_port=None, stats_interval=None, data_dir=None, snapshot_interval=10000,
+                 connect_timeout=3.0, heartbeat_interval=10.0, topology='random', out_degree=2, max_in_degree=None,
+                 dissemination='flood', fanout=3, stop_probability=0.25, gossip_interval=1.0, active_rounds=10,
+                 anti_entropy_interval=10.0, anti_entropy_window=64, sync=True, pow_difficulty=None,
+                 pow_workers=None):
         """
         Create a client node
         :param ip: client ip address
         :param port: client port number
         :param seed_ip: seed node ip address
         :param seed_port: seed node port number
+        :param transport: 'threads' for a thread per peer connection or 'asyncio' for one event loop per node
+        :param seen_cache: thread safe cache used to drop duplicate messages, a default StripedSeenCache if None
+        :param relay: 'blocks' to push blocks to peers or 'inv' to announce them and let peers fetch unknown ones
+        :param peer_queue: max messages queued for a peer before the overflow policy applies
+        :param overflow: 'drop-oldest' or 'disconnect', what to do when a peer's queue is full
+        :param stats_port: if set, serve metrics as json on http://127.0.0.1:<stats_port>/
+        :param stats_interval: if set, write metrics to stats_<port>.json every stats_interval seconds
+        :param data_dir: if set, persist the block-chain there and reload it on restart
+        :param snapshot_interval: blocks logged between chain snapshots in data_dir
+        :param connect_timeout: seconds to wait for the seed or a peer to accept a connection
+        :param heartbeat_interval: seconds between lease renewals sent to the seed, well below the seed's lease
+        :param topology: 'random', 'random-regular' or 'small-world', how peers to dial are picked
+        :param out_degree: outbound connections kept open, dropped ones are re-dialed in the background
+        :param max_in_degree: max inbound connections, see Topology
+        :param dissemination: 'flood', 'push', 'rumor' or 'push-pull', which neighbors get a new block, see
+            Dissemination
+        :param fanout: neighbors a block is pushed to at a time by 'push' and 'rumor'
+        :param stop_probability: chance that 'rumor' stops spreading a block when a neighbor already had it
+        :param gossip_interval: seconds between rounds of 'rumor' and 'push-pull'
+        :param active_rounds: rounds 'push-pull' keeps sending summaries after the node's last new block
+        :param anti_entropy_interval: seconds between chain reconciliations with a random neighbor, None to disable
+        :param anti_entropy_window: heights below the tip reconciled
+        :param sync: fetch the chain from neighbors on start and mine only once caught up
+        :param pow_difficulty: if set, mine by searching nonces whose block digest has pow_difficulty leading zero
+            bits on all cores instead of waiting out the mining timer, and reject received blocks that don't. Every
+            node of a network needs the same difficulty.
+        :param pow_workers: processes searching nonces, one per usable core if None
         """
+        if transport not in TRANSPORTS:
+            raise ValueError("Unknown transport %r, expected one of %s" % (transport, ", ".join(TRANSPORTS)))
+        if relay not in RELAYS:
+            raise ValueError("Unknown relay %r, expected one of %s" % (relay, ", ".join(RELAYS)))
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError("Unknown overflow policy %r, expected one of %s"
+                             % (overflow, ", ".join(OVERFLOW_POLICIES)))
         self.ip = ip
         self.port = int(port)
+        # "ip:port" as the seed lists it and as peers know this node from its hello frame
+        self.peer_id = "%s:%d" % (socket.gethostbyname(ip), self.port)
         self.seed_ip = seed_ip
         self.seed_port = int(seed_port)
         self.client_lambda = hash_power*(1.0/inter_arrival_time)
         self.connections = []
-        self.messages = defaultdict(bool)
-        self.messages_lock = Lock()
+        self.messages = seen_cache if seen_cache is not None else StripedSeenCache()
+        self.mining = False
+        self.miner_started = False
+        self.miner_lock = Lock()
+        self.relay = relay
+        self.inventory = Inventory()
+        self.peer_queue = peer_queue
+        self.connect_timeout = connect_timeout
+        self.heartbeat_interval = heartbeat_interval
+        self.overflow = overflow
         self.new_block_received_cond = Condition()
         self.new_block_received = False
-        self.block_chain = Blockhain()
+        # set once peers are dialed and incoming connections are accepted
+        self.ready = Event()
+        self.block_chain = Blockhain(orphans=OrphanPool(on_evict=self.messages.discard),
+                                     difficulty=pow_difficulty or 0)
+        self.pow = ProofOfWork(pow_difficulty, pow_workers) if pow_difficulty else None
+        self.store = None
+        if data_dir is not None:
+            self.store = ChainStore(data_dir, snapshot_interval)
+            self.store.open(self.block_chain)
         self.output_file = open("outputfile_%d.txt" % self.port, 'w')
+        self.event_log = EventLog("events_%d.bin" % self.port)
         self.listening_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.listening_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.listening_socket.bind((self.ip, self.port))
         numpy.random.seed(random_seed)
+        self.transport = TRANSPORTS[transport](self)
+        self.topology = Topology(self, topology, out_degree, max_in_degree)
+        self.dissemination = Dissemination(dissemination, fanout, stop_probability, gossip_interval,
+                                           active_rounds=active_rounds)
+        self.sync = ChainSync(self) if sync else None
+        self.anti_entropy = None
+        if anti_entropy_interval:
+            self.anti_entropy = AntiEntropy(self, anti_entropy_interval, anti_entropy_window)
+        self.stats_port = stats_port
+        self.stats_interval = stats_interval
+        self.metrics = Metrics({'node': str(self), 'transport': transport, 'relay': relay})
+        self.metrics.gauge('peers', lambda: len(self.connections))
+        self.metrics.gauge('queue_depth', lambda: sum(peer['depth'] for peer in self.peer_stats()))
+        self.metrics.gauge('queue_depth_max', lambda: max([peer['max_depth'] for peer in self.peer_stats()] or [0]))
+        self.metrics.gauge('queue_dropped', lambda: sum(peer['dropped'] for peer in self.peer_stats()))
+        self.metrics.gauge('blocks', lambda: len(self.block_chain.blocks))
+        self.metrics.gauge('longest_chain', lambda: len(self.block_chain.block_chain))
+        self.metrics.gauge('chain', self.block_chain.stats)
+        self.metrics.gauge('orphans', self.block_chain.orphans.stats)
+        self.metrics.gauge('seen', self.messages.stats)
+        self.metrics.gauge('lock_wait', self.lock_stats)
+        self.metrics.gauge('topology', self.topology.stats)
+        self.metrics.gauge('dissemination', self.dissemination.stats)
+        if self.anti_entropy is not None:
+            self.metrics.gauge('anti_entropy', self.anti_entropy.stats)
+        if self.sync is not None:
+            self.metrics.gauge('sync', self.sync.stats)
+        if self.pow is not None:
+            self.metrics.gauge('pow', self.pow.stats)
 
     def start(self):
         """
         Start a client node at address <ip:port> connect to seed node fetch client-list and start tcp connection from some
         :return:
         """
-        # fetch client-list from seed
-        client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        client_socket.connect((self.seed_ip, self.seed_port))
-        client_socket.send(bytes(self.__str__(), 'utf-8'))
-        peers = pickle.loads(client_socket.recv(4096))
+        if self.stats_port is not None:
+            self.metrics.serve(self.stats_port)
+        if self.stats_interval:
+            self.metrics.write_periodically("stats_%d.json" % self.port, self.stats_interval)
+        if self.dissemination.periodic:
+            thread = Thread(target=self.gossip)
+            thread.daemon = True
+            thread.start()
+        if self.anti_entropy is not None:
+            self.anti_entropy.start()
+        self.transport.start()
+
+    def choose_peers(self, peers):
+        """
+        Record client-list fetched from seed and hand it to the topology
+        :param peers: dict of peer_id -> (ip, port)
+        :return: list of (peer_id, (ip, port)) in the order the topology dials them
+        """
         # print and write to file the client list
         print ("Client List")
         print ("\n".join(peers.keys()))
         self.output_file.write("\n".join(peers.keys()))
         self.output_file.write("\n")
+        self.topology.update(peers)
+        return self.topology.rank()
 
-        # connect two random peers
-        for peer_id, peer in random.sample(peers.items(), k=min(2, len(peers))):
-            peer_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            peer_socket.connect(peer)
-            peer_socket.sendall(bytes(self.__str__(), 'utf-8'))
-            receive_thread = Thread(target=self.receive, args=(peer_id, peer_socket, ))
-            receive_thread.daemon = True
-            receive_thread.start()
-            logging.info("%s -> %s" % (self, peer_id))
-            self.connections.append(peer_socket)
-
-        # listen for peers want to connect
-        self.listening_socket.listen(5)
-        while True:
-            peer_socket, address = self.listening_socket.accept()
-            peer = peer_socket.recv(4096).decode('utf-8')
-            receive_thread = Thread(target=self.receive, args=(peer, peer_socket, ))
-            receive_thread.daemon = True
-            receive_thread.start()
-            self.connections.append(peer_socket)
-
-    def receive(self, peer, peer_socket):
+    def handle_frame(self, peer, frame_type, payload, origin):
         """
-        Receive message from peer node and if is not already present in Message List forward it all adjacent nodes
+        Handle a frame received from peer node
         :param peer: peer_id
-        :param peer_socket: socket object of peer
+        :param frame_type: one of framing.FRAME_*
+        :param payload: memoryview of frame payload
+        :param origin: connection of peer
         :return:
         """
-        while True:
-            # receive start
-            size_to_receive = 8
-            message = bytearray()
-            while True:
-                message.extend(peer_socket.recv(size_to_receive))
-                if len(message) == 8:
-                    break
-                else:
-                    size_to_receive = 8 - len(message)
-            message = bytes(message)
-            # receive end
-            self.messages_lock.acquire()
-            if not self.messages[message]:
-                # print message & mark it true
-                print ("Received: %d:%s->%s" % (int(time.time()), peer, message))
-                self.messages[message] = True
-                if message == "START-MN":
-                    # start mining: happen only once
-                    mine_thread = Thread(target=self.mine)
-                    mine_thread.daemon = True
-                    mine_thread.start()
-                    self.send(message, peer_socket)
-                    self.messages_lock.release()
-                else:
-                    # a block received
-                    valid_block, new_block = self.block_chain.verify_and_add_block(message)
-                    self.messages_lock.release()
-                    # if new block received reset miner
-                    if new_block:
-                        with self.new_block_received_cond:
-                            self.new_block_received = True
-                            self.new_block_received_cond.notify()
-                    # if valid block send it to all peers
-                    if valid_block:
-                        self.send(message, peer_socket)
-                self.output_file.write("%f:%s->%s\n" % (time.time(), peer, message))
+        if frame_type == FRAME_BLOCKS:
+            for offset in range(0, len(payload) - BLOCK_SIZE + 1, BLOCK_SIZE):
+                self.handle(peer, bytes(payload[offset:offset + BLOCK_SIZE]), origin)
+        elif frame_type == FRAME_RUMOR:
+            # tell the sender which blocks it spreads are not news here
+            known = []
+            for offset in range(0, len(payload) - BLOCK_SIZE + 1, BLOCK_SIZE):
+                block = bytes(payload[offset:offset + BLOCK_SIZE])
+                if not self.handle(peer, block, origin):
+                    self.dissemination.has(block, origin)
+                    known.append(block)
+            if known:
+                self.transport.send_to(origin, FRAME_KNOWN, known)
+                self.metrics.inc('control_sent')
+        elif frame_type == FRAME_KNOWN:
+            for offset in range(0, len(payload) - BLOCK_SIZE + 1, BLOCK_SIZE):
+                self.dissemination.known(bytes(payload[offset:offset + BLOCK_SIZE]), origin)
+        elif frame_type == FRAME_SUMMARY:
+            # push-pull: fetch what the sender has and announce what it lacks
+            ids = inv_ids(payload)
+            wanted = self.inventory.want(ids)
+            if wanted:
+                self.transport.send_to(origin, FRAME_GETDATA, wanted)
+                self.metrics.inc('control_sent')
+            listed = set(ids)
+            missing = [inv_id for inv_id in self.inventory.recent(self.dissemination.window) if inv_id not in listed]
+            if missing:
+                self.transport.send_to(origin, FRAME_INV, missing)
+                self.metrics.inc('control_sent')
+        elif frame_type == FRAME_TIP and self.anti_entropy is not None:
+            self.anti_entropy.on_tip(payload, origin)
+        elif frame_type == FRAME_SKETCH and self.anti_entropy is not None:
+            self.anti_entropy.on_sketch(payload, origin)
+        elif frame_type == FRAME_MISSING:
+            for offset in range(0, len(payload) - BLOCK_SIZE + 1, BLOCK_SIZE):
+                self.handle(peer, bytes(payload[offset:offset + BLOCK_SIZE]), origin, recovered=True)
+        elif frame_type == FRAME_GET_STATUS and self.sync is not None:
+            self.sync.on_get_status(origin)
+        elif frame_type == FRAME_STATUS and self.sync is not None:
+            self.sync.on_status(payload, origin)
+        elif frame_type == FRAME_GET_RANGE and self.sync is not None:
+            self.sync.on_get_range(payload, origin)
+        elif frame_type == FRAME_RANGE and self.sync is not None:
+            self.sync.on_range(payload, origin)
+        elif frame_type == FRAME_START_MN:
+            self.handle(peer, START_MN, origin)
+        elif frame_type == FRAME_INV:
+            # fetch announced blocks we don't know from the announcing peer
+            wanted = self.inventory.want(inv_ids(payload))
+            if wanted:
+                self.transport.send_to(origin, FRAME_GETDATA, wanted)
+                self.metrics.inc('control_sent')
+        elif frame_type == FRAME_GETDATA:
+            blocks = [block for block in map(self.inventory.get, inv_ids(payload)) if block is not None]
+            if blocks:
+                self.transport.send_to(origin, FRAME_BLOCKS, blocks)
+                self.metrics.inc('blocks_sent', len(blocks))
+        else:
+            logging.warning("%s: unknown frame type %d from %s" % (self, frame_type, peer))
+
+    def handle(self, peer, message, origin, recovered=False):
+        """
+        Handle message received from peer node and if is not already present in Message List forward it all adjacent
+        nodes
+        :param peer: peer_id
+        :param message: received message
+        :param origin: connection of peer, it is not forwarded back there
+        :param recovered: true for a block anti-entropy found missing here, it may have been seen and rejected as too
+            old before
+        :return: false if message was seen before
+        """
+        self.metrics.inc('messages_received')
+        if not self.messages.add(message) and not (recovered and message not in self.block_chain.blocks):
+            self.metrics.inc('duplicates_dropped')
+            return False
+        # log message, it is marked seen
+        self.event_log.log(RECEIVED, peer, message)
+        if message == START_MN:
+            # start mining: happen only once
+            if not self.mining:
+                self.mining = True
+                self.start_miner()
+            self.send(message, origin)
+        else:
+            # a block received
+            start = perf_counter()
+            connected = []
+            # hashed once, for the chain's checks and the inventory id
+            digest = hashlib.sha256(message).digest()
+            valid_block, new_block = self.block_chain.verify_and_add_block(message, connected,
+                                                                           check_timestamp=not recovered, digest=digest)
+            self.metrics.observe('verify_time', perf_counter() - start)
+            if valid_block:
+                # served to push-pull partners and inv peers
+                self.inventory.add(message, digest=digest)
+                # first to deliver it, the topology keeps peers that often are
+                if origin is not None:
+                    origin.deliveries += 1
+                # block timestamps have one second resolution
+                timestamp = struct.unpack_from(BLOCK_FORMAT, message)[2]
+                self.metrics.observe('propagation_delay', max(0.0, time.time() - timestamp))
+                if not new_block:
+                    self.metrics.inc('fork_events')
+                if recovered:
+                    self.metrics.inc('blocks_recovered')
+            elif message in self.block_chain.orphans:
+                # stays seen while it waits for its parent, the pool forgets it on eviction
+                self.metrics.inc('orphan_blocks')
+            elif message in self.block_chain.blocks:
+                # fetched by sync before gossip brought it
+                self.metrics.inc('duplicates_dropped')
             else:
-                self.messages_lock.release()
+                self.metrics.inc('invalid_blocks')
+                self.event_log.log(REJECTED, peer, message)
+            # if new block received reset miner
+            if new_block:
+                self.notify_new_block()
+            # if valid block send it to all peers
+            if valid_block:
+                self.send(message, origin)
+                self.event_log.log(FORWARDED, peer, message)
+                # orphans that were waiting for it, their senders may lack the parent so send them to everyone
+                for block in connected:
+                    self.send(block, None)
+                    self.event_log.log(FORWARDED, None, block)
+                self.metrics.inc('orphans_connected', len(connected))
+            elif self.relay == 'inv' and message not in self.block_chain.orphans:
+                # don't fetch it again when it is announced
+                self.inventory.add(message, valid=False, digest=digest)
+        return True
 
-    def send(self, message, peer_socket):
+    def send(self, message, origin):
         """
         Send message to all adjacent peers
         :param message: message to be sent
-        :param peer_socket: socket object of the peer message received from
+        :param origin: connection of the peer message received from
         :return:
         """
-        for connection in self.connections:
-            # send if peer is not same as where it came from
-            if connection != peer_socket:
-                connection.sendall(message)
+        start = perf_counter()
+        if message == START_MN:
+            self.transport.send(FRAME_START_MN, [], origin)
+        else:
+            targets = self.dissemination.targets(list(self.connections), origin, message)
+            if self.dissemination.strategy == 'rumor':
+                self.transport.send(FRAME_RUMOR, [message], origin, targets)
+                self.metrics.inc('blocks_sent', len(targets))
+            elif self.relay == 'inv':
+                # handle and mine_block already added a valid block, a connected orphan is added here
+                self.transport.send(FRAME_INV, [self.inventory.add(message)], origin, targets)
+                self.metrics.inc('control_sent', len(targets))
+            elif targets:
+                self.transport.send(FRAME_BLOCKS, [message], origin, targets)
+                self.metrics.inc('blocks_sent', len(targets))
+        self.metrics.observe('send_time', perf_counter() - start)
+        self.metrics.inc('messages_forwarded' if origin is not None else 'messages_sent')
+
+    def gossip(self):
+        """
+        Rounds of the periodic dissemination strategies: 'rumor' sends the blocks it still spreads to random
+        neighbors, 'push-pull' sends a summary of its recent blocks to one random neighbor
+        :return:
+        """
+        dissemination = self.dissemination
+        while True:
+            time.sleep(dissemination.interval)
+            neighbors = [connection for connection in list(self.connections) if not connection.closed]
+            if dissemination.strategy == 'rumor':
+                for connection, blocks in dissemination.rumor_round(neighbors).items():
+                    self.transport.send(FRAME_RUMOR, blocks, None, [connection])
+                    self.metrics.inc('blocks_sent', len(blocks))
+            else:
+                partner = dissemination.partner(neighbors)
+                if partner is not None:
+                    summary = b''.join(self.inventory.recent(dissemination.window))
+                    self.transport.send(FRAME_SUMMARY, [summary], None, [partner])
+                    self.metrics.inc('control_sent')
+
+    def lock_stats(self):
+        """
+        Lock wait counters of the seen-message stripes and the block-chain
+        :return: dict of name -> counters
+        """
+        stats = {'chain': self.block_chain.lock.stats()}
+        if hasattr(self.messages, 'lock_stats'):
+            stats['seen'] = self.messages.lock_stats()
+        return stats
+
+    def peer_stats(self):
+        """
+        Outbound queue metrics of every connected peer
+        :return: list of dict
+        """
+        return [connection.stats() for connection in list(self.connections)]
+
+    def mining_timer(self):
+        """
+        Draw time until this node mines its next block
+        :return: waiting time in seconds
+        """
+        waiting_time = numpy.random.exponential(1.0/self.client_lambda)
+        print ("Timer: %fs" % waiting_time)
+        return waiting_time
+
+    def mine_block(self, block=None):
+        """
+        Mine a new block on longest chain and broadcast it
+        :param block: block with a nonce found by proof of work, None to generate one
+        :return: block, None if a found block was not added
+        """
+        digest = None
+        if block is None:
+            block = self.block_chain.generate_block()
+        else:
+            digest = hashlib.sha256(block).digest()
+            if not self.block_chain.verify_and_add_block(block, digest=digest)[0]:
+                return None
+        self.metrics.inc('blocks_generated')
+        self.event_log.log(GENERATED, str(self), block)
+        self.messages.add(block)
+        self.inventory.add(block, digest=digest)
+        self.send(block, None)
+        return block
+
+    def start_miner(self):
+        """
+        Start the miner once mining started and the chain is synced, called when either happens
+        :return:
+        """
+        with self.miner_lock:
+            if self.miner_started or not self.mining or (self.sync is not None and not self.sync.synced.is_set()):
+                return
+            self.miner_started = True
+        if self.pow is not None:
+            thread = Thread(target=self.mine_pow)
+            thread.daemon = True
+            thread.start()
+        else:
+            self.transport.start_miner()
+
+    def notify_new_block(self):
+        """
+        Restart the miner on a new block in longest chain
+        :return:
+        """
+        if self.pow is None:
+            self.transport.notify_new_block()
+            return
+        # the proof of work miner waits on the condition whatever the transport
+        with self.new_block_received_cond:
+            self.new_block_received = True
+            self.new_block_received_cond.notify_all()
 
     def mine(self):
         """
-        Send 10 messages every 5 seconds to all adjacent nodes
+        Mine a block every exponentially distributed interval and restart when a new block is received
         :return:
         """
         while True:
             # wait till time-out or a new block in longest chain received
             with self.new_block_received_cond:
-                waiting_time = numpy.random.exponential(1.0/self.client_lambda)
-                print ("Timer: %fs" % waiting_time)
-                self.new_block_received_cond.wait(timeout=waiting_time)
+                self.new_block_received_cond.wait(timeout=self.mining_timer())
             # if new block received reset miner
             if self.new_block_received:
                 self.new_block_received = False
             else:
                 # mine a new block and broadcast it
-                block = self.block_chain.generate_block()
-                print ("Generated: %d:%s" % (int(time.time()), block))
-                self.messages_lock.acquire()
-                self.messages[block] = True
-                self.messages_lock.release()
-                self.send(block, None)
+                self.mine_block()
+
+    def mine_pow(self):
+        """
+        Search a nonce for a block on longest chain and broadcast it, restart the search when a new block is received
+        :return:
+        """
+        while not self.pow.closed:
+            with self.new_block_received_cond:
+                self.new_block_received = False
+            # read after the reset, a block received from here on cancels the search
+            header = self.block_chain.block_header()
+            nonce = self.pow.search(header, self.new_block_received_cond, lambda: self.new_block_received)
+            if nonce is not None:
+                self.mine_block(header + struct.pack(NONCE_FORMAT, nonce))
     
     def start_mining(self):
+        # mine here too, the echoed START-MN is dropped as seen
+        if not self.mining:
+            self.mining = True
+            self.start_miner()
         # send all client START-MN message
-        self.send(bytes('START-MN', 'utf-8'), None)
-        self.messages['START-MN'] = True
+        self.messages.add(START_MN)
+        self.send(START_MN, None)
     
     def longest_chain(self):
-        print("Calculating longest chain...")
-        self.messages_lock.acquire()
-        total_blocks = 0
-        for blocks in self.block_chain.block_chain:
-            total_blocks += len(blocks)
-        print ("Total blocks: %d, Blocks in longest chain: %d" % (total_blocks, len(self.block_chain.block_chain)))
-        self.messages_lock.release()
+        stats = self.block_chain.stats()
+        print ("Total blocks: %d, Blocks in longest chain: %d, Orphaned branches: %d"
+               % (stats['total_blocks'], stats['main_chain_length'], stats['orphaned_branches']))
         self.block_chain.tree()
 
+    def close(self):
+        """
+        Flush and close the node's output files
+        :return:
+        """
+        if self.pow is not None:
+            self.pow.close()
+        self.event_log.close()
+        self.output_file.close()
+        if self.store is not None:
+            self.store.close()
+
     def __str__(self):
         return "%s:%s" % (self.ip, self.port)
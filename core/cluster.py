@@ -0,0 +1,353 @@
+import argparse
+import configparser
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import sys
+import time
+from threading import Thread
+
+from .client import Client
+from .seed import Seed
+
+
+def boolean(value):
+    return configparser.ConfigParser.BOOLEAN_STATES[value.lower()]
+
+
+# client options that may be set in a client or template section, with their types
+CLIENT_OPTIONS = {
+    'transport': str,
+    'relay': str,
+    'overflow': str,
+    'peer_queue': int,
+    'connect_timeout': float,
+    'heartbeat_interval': float,
+    'stats_interval': float,
+    'data_dir': str,
+    'snapshot_interval': int,
+    'topology': str,
+    'out_degree': int,
+    'max_in_degree': int,
+    'dissemination': str,
+    'fanout': int,
+    'stop_probability': float,
+    'gossip_interval': float,
+    'active_rounds': int,
+    'anti_entropy_interval': float,
+    'anti_entropy_window': int,
+    'sync': boolean,
+    'pow_difficulty': int,
+    'pow_workers': int,
+}
+
+
+def client_options(section):
+    return {name: convert(section[name]) for name, convert in CLIENT_OPTIONS.items() if section.get(name)}
+
+
+def load_nodes(config_path, counts=None):
+    """
+    Read the seed and the clients of a gossip settings file. Sections listed in the clients key describe one client
+    each, sections listed in the templates key describe count clients each: client i of a template gets port + i,
+    random_seed + i and an equal part of the template's hash_power.
+    :param config_path: path of ini file
+    :param counts: dict of template section -> number of clients, overrides count of the section
+    :return: (seed config dict, list of client config dicts)
+    """
+    config = configparser.ConfigParser()
+    if not config.read(config_path):
+        raise ValueError("Can't read settings file %s" % config_path)
+    defaults = config.defaults()
+    seed_section = config[defaults['seeds'].split(',')[0].strip()]
+    seed = {'role': 'seed', 'name': seed_section.name, 'ip': seed_section.get('ip'),
+            'port': seed_section.getint('port', 9000)}
+    clients = []
+    for name in filter(None, (name.strip() for name in defaults.get('clients', '').split(','))):
+        section = config[name]
+        clients.append(dict(client_options(section), role='client', name=name, ip=section.get('ip'),
+                            port=section.getint('port'), hash_power=section.getfloat('hash_power'),
+                            inter_arrival_time=section.getfloat('inter_arrival_time'),
+                            random_seed=section.getint('random_seed')))
+    counts = counts or {}
+    templates = [name for name in (name.strip() for name in defaults.get('templates', '').split(',')) if name]
+    unknown = set(counts) - set(templates)
+    if unknown:
+        raise ValueError("Unknown template %s, expected one of %s" % (", ".join(sorted(unknown)), ", ".join(templates)))
+    for name in templates:
+        section = config[name]
+        count = counts.get(name, section.getint('count', 0))
+        for i in range(count):
+            clients.append(dict(client_options(section), role='client', name="%s.%d" % (name, i),
+                                ip=section.get('ip'), port=section.getint('port') + i,
+                                hash_power=section.getfloat('hash_power') / count,
+                                inter_arrival_time=section.getfloat('inter_arrival_time'),
+                                random_seed=section.getint('random_seed') + i))
+    return seed, clients
+
+
+def run_node(node, workdir, core, control, events):
+    """
+    Body of a node process: run a seed or client in workdir, report readiness and obey launcher commands
+    :param node: node config dict from load_nodes
+    :param workdir: directory for the node's output files
+    :param core: CPU core to pin the process to, None to let the OS schedule it
+    :param control: pipe end receiving 'start_mining' and 'stop' commands
+    :param events: queue of (event, node name, data) sent to the launcher
+    :return:
+    """
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    # the launcher handles ctrl-c and stops nodes in order
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # a proof of work node spreads its workers over the cores itself
+    if core is not None and hasattr(os, 'sched_setaffinity') and not node.get('pow_difficulty'):
+        os.sched_setaffinity(0, {core})
+    sys.stdout = open('stdout.txt', 'w')
+    logging.basicConfig(format='%(asctime)s:%(message)s', filename='node.log', filemode='w', level=logging.DEBUG,
+                        force=True)
+    name = node['name']
+    try:
+        if node['role'] == 'seed':
+            process = Seed(node['ip'], node['port'])
+            # Seed installs its own ctrl-c handler, the launcher saves its membership on stop instead
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+        else:
+            options = {option: node[option] for option in CLIENT_OPTIONS if option in node}
+            process = Client(node['ip'], node['port'], node['seed_ip'], node['seed_port'], node['hash_power'],
+                             node['inter_arrival_time'], node['random_seed'], **options)
+    except Exception as e:
+        events.put(('failed', name, repr(e)))
+        return
+    failure = []
+
+    def serve():
+        try:
+            process.start()
+        except Exception as e:
+            failure.append(e)
+            events.put(('failed', name, repr(e)))
+
+    thread = Thread(target=serve)
+    thread.daemon = True
+    thread.start()
+    while not process.ready.wait(0.1):
+        if failure:
+            return
+    events.put(('ready', name, None))
+    while True:
+        command = control.recv()
+        if command == 'start_mining':
+            process.start_mining()
+        elif command == 'stop':
+            break
+    events.put(('done', name, node_summary(process)))
+    sys.stdout.flush()
+
+
+def node_summary(process):
+    """
+    Final stats of a node, written to stats.json in its directory
+    :param process: Seed or Client
+    :return: dict
+    """
+    summary = {'node': str(process), 'metrics': process.metrics.snapshot()}
+    if isinstance(process, Seed):
+        summary['clients'] = len(process.client_list)
+        process.save()
+    else:
+        chain = process.block_chain.stats()
+        summary['total_blocks'] = chain['total_blocks']
+        summary['longest_chain'] = chain['main_chain_length']
+        summary['orphaned_branches'] = chain['orphaned_branches']
+        summary['blocks_sent'] = summary['metrics']['counters'].get('blocks_sent', 0)
+        summary['control_sent'] = summary['metrics']['counters'].get('control_sent', 0)
+        process.close()
+    with open('stats.json', 'w') as f:
+        json.dump(summary, f)
+    return summary
+
+
+class Cluster:
+    def __init__(self, seed, clients, run_dir, pin_cores=True, ready_timeout=60.0):
+        """
+        Local cluster of a seed and clients, each in its own process
+        :param seed: seed config dict from load_nodes
+        :param clients: list of client config dicts from load_nodes
+        :param run_dir: directory that gets a sub directory per node and the cluster summary
+        :param pin_cores: spread node processes round robin over the CPU cores the launcher may use
+        :param ready_timeout: seconds to wait for all nodes to be ready
+        """
+        self.seed = seed
+        self.clients = [dict(client, seed_ip=seed['ip'], seed_port=seed['port']) for client in clients]
+        self.run_dir = run_dir
+        self.ready_timeout = ready_timeout
+        if pin_cores and hasattr(os, 'sched_getaffinity'):
+            self.cores = sorted(os.sched_getaffinity(0))
+        else:
+            self.cores = None
+        # fork shares the launcher's imports with every node, spawn re-imports them per node
+        methods = multiprocessing.get_all_start_methods()
+        self.context = multiprocessing.get_context('fork' if 'fork' in methods else 'spawn')
+        self.events = self.context.Queue()
+        # node name -> (process, control pipe)
+        self.nodes = {}
+        self.ready = set()
+        self.failed = {}
+        self.summaries = {}
+
+    def spawn(self, node, index):
+        core = self.cores[index % len(self.cores)] if self.cores else None
+        control, node_control = self.context.Pipe()
+        process = self.context.Process(target=run_node, name=node['name'], args=(
+            node, os.path.join(self.run_dir, node['name']), core, node_control, self.events))
+        # daemonic processes can't start the worker processes of proof of work
+        process.daemon = not node.get('pow_difficulty')
+        process.start()
+        self.nodes[node['name']] = (process, control)
+
+    def wait(self, event, names, timeout):
+        """
+        Collect events from nodes until every node in names sent event, failed, or timeout passed
+        :return: set of names that sent event
+        """
+        names = set(names)
+        received = set()
+        deadline = time.time() + timeout
+        while received | set(self.failed) < names:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                kind, name, data = self.events.get(timeout=min(remaining, 1.0))
+            except queue.Empty:
+                continue
+            if kind == 'failed':
+                self.failed[name] = data
+                logging.warning("Node %s failed: %s" % (name, data))
+            elif kind == 'ready':
+                self.ready.add(name)
+            elif kind == 'done':
+                self.summaries[name] = data
+            if kind == event:
+                received.add(name)
+        return received
+
+    def start(self):
+        """
+        Start the seed, then every client, and wait until all are ready
+        :return: number of clients ready
+        """
+        os.makedirs(self.run_dir, exist_ok=True)
+        self.spawn(self.seed, 0)
+        if self.seed['name'] not in self.wait('ready', [self.seed['name']], self.ready_timeout):
+            raise RuntimeError("Seed %s did not start: %s" % (self.seed['name'], self.failed.get(self.seed['name'])))
+        started = time.time()
+        for i, client in enumerate(self.clients):
+            self.spawn(client, i + 1)
+        ready = self.wait('ready', [client['name'] for client in self.clients], self.ready_timeout)
+        logging.info("%d of %d clients ready in %.1f s" % (len(ready), len(self.clients), time.time() - started))
+        return len(ready)
+
+    def start_mining(self):
+        """
+        Send START-MN from one ready client, gossip carries it to the rest
+        :return:
+        """
+        for client in reversed(self.clients):
+            if client['name'] in self.ready:
+                self.nodes[client['name']][1].send('start_mining')
+                return
+        raise RuntimeError("No client is ready to start mining")
+
+    def stop(self, timeout=30.0):
+        """
+        Stop clients then seed, collect their stats and write summary.json to run_dir
+        :return: summary dict
+        """
+        clients = [client['name'] for client in self.clients if client['name'] in self.ready]
+        for name in clients:
+            self.nodes[name][1].send('stop')
+        self.wait('done', clients, timeout)
+        if self.seed['name'] in self.ready:
+            self.nodes[self.seed['name']][1].send('stop')
+            self.wait('done', [self.seed['name']], timeout)
+        for process, _ in self.nodes.values():
+            process.join(1.0)
+            if process.is_alive():
+                process.terminate()
+        summary = self.summary()
+        with open(os.path.join(self.run_dir, 'summary.json'), 'w') as f:
+            json.dump(summary, f, indent=2)
+        return summary
+
+    def summary(self):
+        clients = [self.summaries[client['name']] for client in self.clients if client['name'] in self.summaries]
+        chains = [client['longest_chain'] for client in clients]
+        blocks = [client['total_blocks'] for client in clients]
+        blocks_sent = sum(client['blocks_sent'] for client in clients)
+        control_sent = sum(client['control_sent'] for client in clients)
+        return {
+            'clients': len(self.clients),
+            'clients_ready': len([client for client in self.clients if client['name'] in self.ready]),
+            'clients_reported': len(clients),
+            'failed': self.failed,
+            'longest_chain_min': min(chains) if chains else None,
+            'longest_chain_max': max(chains) if chains else None,
+            'total_blocks_max': max(blocks) if blocks else None,
+            # share of the blocks a client could have that it has, against what it cost to spread them
+            'coverage': sum(blocks) / (len(blocks) * max(blocks)) if blocks and max(blocks) else None,
+            'blocks_sent': blocks_sent,
+            'blocks_sent_per_block': blocks_sent / max(blocks) if blocks and max(blocks) else None,
+            # inv, getdata, summary and known frames
+            'control_sent': control_sent,
+            'control_sent_per_block': control_sent / max(blocks) if blocks and max(blocks) else None,
+            'nodes': self.summaries,
+        }
+
+    def run(self, duration):
+        """
+        Start the cluster, mine for duration seconds or until ctrl-c, then stop it
+        :param duration: seconds of mining, None to run until ctrl-c
+        :return: summary dict
+        """
+        try:
+            self.start()
+            self.start_mining()
+            if duration is None:
+                while True:
+                    time.sleep(3600)
+            time.sleep(duration)
+        except KeyboardInterrupt:
+            pass
+        return self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a seed and its clients as separate local processes")
+    parser.add_argument('--config', default=os.environ.get('GOSSIP.CONFIG_PATH', 'gossip_settings.ini'))
+    parser.add_argument('--template', action='append', default=[], metavar='SECTION=COUNT',
+                        help="number of clients to create from a template section, repeatable")
+    parser.add_argument('--duration', type=float, default=None, help="seconds of mining, until ctrl-c if not set")
+    parser.add_argument('--run-dir', default=None, help="output directory, runs/<time> by default")
+    parser.add_argument('--no-pin', action='store_true', help="don't pin node processes to CPU cores")
+    parser.add_argument('--ready-timeout', type=float, default=60.0)
+    args = parser.parse_args()
+    logging.basicConfig(format='%(asctime)s:%(message)s', level=logging.INFO)
+    counts = {}
+    for template in args.template:
+        name, _, count = template.partition('=')
+        counts[name] = int(count)
+    seed, clients = load_nodes(args.config, counts)
+    run_dir = args.run_dir or os.path.join('runs', time.strftime('%Y%m%d-%H%M%S'))
+    cluster = Cluster(seed, clients, run_dir, pin_cores=not args.no_pin, ready_timeout=args.ready_timeout)
+    summary = cluster.run(args.duration)
+    print(json.dumps({key: value for key, value in summary.items() if key != 'nodes'}, indent=2))
+    print("Node outputs in %s" % run_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+import random
+from collections import OrderedDict
+from threading import Lock
+
+# how a node spreads a new block: to every neighbor; once to fanout random neighbors; to fanout random neighbors
+# every round until neighbors' feedback makes it lose interest; or not at all, one random neighbor per round
+# exchanges recent blocks with it instead
+STRATEGIES = ('flood', 'push', 'rumor', 'push-pull')
+
+
+class Dissemination:
+    def __init__(self, strategy='flood', fanout=3, stop_probability=0.25, interval=1.0, window=64, max_hot=1000,
+                 active_rounds=10, rng=random):
+        """
+        Choice of the neighbors a node sends blocks to, shared by Client and the simulator.
+
+        'rumor' never sends a block to a neighbor known to have it: the one it came from, the ones it was sent to and
+        the ones that sent it again. It sends a block over a link at most once, so it costs at most what flooding
+        does and less the sooner it loses interest. On a sparse graph, where flooding sends a block to few
+        neighbors anyway, it saves little and loses coverage; it pays off once the degree is well above fanout.
+        :param strategy: one of STRATEGIES
+        :param fanout: 'push' and 'rumor', neighbors a block is sent to at a time
+        :param stop_probability: 'rumor' only, chance to stop spreading a block each time a neighbor answers it
+            already had it
+        :param interval: seconds between rounds of 'rumor' and 'push-pull'
+        :param window: 'push-pull' only, recent blocks compared with the partner of a round
+        :param max_hot: 'rumor' only, max blocks spread at once, the oldest is dropped first
+        :param active_rounds: 'push-pull' only, rounds a node keeps sending summaries after its last new block,
+            an idle node only answers summaries
+        :param rng: random.Random or the random module
+        """
+        if strategy not in STRATEGIES:
+            raise ValueError("Unknown dissemination %r, expected one of %s" % (strategy, ", ".join(STRATEGIES)))
+        self.strategy = strategy
+        self.fanout = fanout
+        self.stop_probability = stop_probability
+        self.interval = interval
+        self.window = window
+        self.max_hot = max_hot
+        self.active_rounds = active_rounds
+        self.rng = rng
+        # 'rumor': blocks still spread every round, oldest first, -> set of neighbors known to have the block
+        self.hot = OrderedDict()
+        # 'push-pull': rounds since the last new block
+        self.idle = 0
+        # feedback arrives on receiver threads, rounds run on their own
+        self.lock = Lock()
+        self.pushed = 0
+        self.rounds = 0
+        self.feedback = 0
+        self.cooled = 0
+        self.skipped = 0
+
+    @property
+    def periodic(self):
+        return self.strategy in ('rumor', 'push-pull')
+
+    def sample(self, candidates):
+        if len(candidates) <= self.fanout:
+            return list(candidates)
+        return self.rng.sample(candidates, self.fanout)
+
+    def targets(self, neighbors, origin, message):
+        """
+        Neighbors to send a new block to right away
+        :param neighbors: list of neighbors
+        :param origin: neighbor the block came from, None if mined here
+        :param message: the block
+        :return: list of neighbors
+        """
+        candidates = [neighbor for neighbor in neighbors if neighbor != origin]
+        if self.strategy == 'flood':
+            chosen = candidates
+        elif self.strategy == 'push-pull':
+            chosen = []
+            self.idle = 0
+        else:
+            chosen = self.sample(candidates)
+        if self.strategy == 'rumor':
+            with self.lock:
+                self.hot[message] = set(chosen) | {origin}
+                while len(self.hot) > self.max_hot:
+                    self.hot.popitem(last=False)
+        self.pushed += len(chosen)
+        return chosen
+
+    def known(self, message, neighbor):
+        """
+        A neighbor answered that it already had a block, lose interest in it with stop_probability
+        :param message: the block
+        :param neighbor: the neighbor
+        :return:
+        """
+        with self.lock:
+            if message in self.hot:
+                self.feedback += 1
+                self.hot[message].add(neighbor)
+                if self.rng.random() < self.stop_probability:
+                    del self.hot[message]
+                    self.cooled += 1
+
+    def has(self, message, neighbor):
+        """
+        A neighbor sent a block again, it is not sent back there
+        :param message: the block
+        :param neighbor: the neighbor
+        :return:
+        """
+        with self.lock:
+            if message in self.hot:
+                self.hot[message].add(neighbor)
+
+    def rumor_round(self, neighbors):
+        """
+        'rumor': send every block still spread to fanout random neighbors not known to have it, a block no neighbor
+        lacks any more is dropped
+        :param neighbors: list of neighbors
+        :return: dict of neighbor -> list of blocks
+        """
+        sends = {}
+        if not neighbors:
+            return sends
+        self.rounds += 1
+        with self.lock:
+            for message, informed in list(self.hot.items()):
+                candidates = [neighbor for neighbor in neighbors if neighbor not in informed]
+                if not candidates:
+                    del self.hot[message]
+                    continue
+                for neighbor in self.sample(candidates):
+                    informed.add(neighbor)
+                    sends.setdefault(neighbor, []).append(message)
+                    self.pushed += 1
+        return sends
+
+    def partner(self, neighbors):
+        """
+        'push-pull': neighbor to exchange recent blocks with this round, none once the node was idle for
+        active_rounds rounds
+        :param neighbors: list of neighbors
+        :return: neighbor or None
+        """
+        if not neighbors:
+            return None
+        self.idle += 1
+        if self.idle > self.active_rounds:
+            self.skipped += 1
+            return None
+        self.rounds += 1
+        return neighbors[self.rng.randrange(len(neighbors))]
+
+    def stats(self):
+        """
+        :return: dict of dissemination counters
+        """
+        return {
+            'strategy': self.strategy,
+            'pushed': self.pushed,
+            'rounds': self.rounds,
+            'hot': len(self.hot),
+            'feedback': self.feedback,
+            'cooled': self.cooled,
+            'skipped': self.skipped,
+        }
@@ -0,0 +1,211 @@
+"""
+Binary log of the blocks a client receives, generates, forwards and rejects, written to events_<port>.bin.
+
+The file starts with a 12 byte LOG_HEADER: the magic b'GOSSIPEV', the format version (1) and the record size (28),
+all little endian. Fixed width 28 byte records follow, one per event:
+
+    time   f8   event time, seconds since the epoch
+    event  u1   RECEIVED, GENERATED, FORWARDED or REJECTED
+    pad    3x
+    peer   u4   line of the peer id in the <path>.peers side file
+    block  12s  the block itself, or the first 12 bytes of the sha256 digest of any other message
+
+read_events memory maps the records as a NumPy structured array, python -m core.eventlog <path> prints them as text.
+"""
+import argparse
+import hashlib
+import os
+import struct
+import sys
+import time
+from collections import deque
+from threading import Condition, Lock, Thread
+
+import numpy
+
+from .blockchain import BLOCK_SIZE
+
+# log header: magic, version, record size, then events: timestamp, kind, peer index into the .peers side file,
+# the BLOCK_SIZE byte block
+LOG_HEADER = struct.Struct('<8sHH')
+LOG_MAGIC = b'GOSSIPEV'
+LOG_VERSION = 1
+RECORD = struct.Struct('<dB3xI%ds' % BLOCK_SIZE)
+RECORD_DTYPE = numpy.dtype([('time', '<f8'), ('event', 'u1'), ('pad', 'V3'), ('peer', '<u4'),
+                            ('block', 'V%d' % BLOCK_SIZE)])
+
+# event kinds
+RECEIVED = 1
+GENERATED = 2
+FORWARDED = 3
+REJECTED = 4
+EVENT_NAMES = {RECEIVED: 'received', GENERATED: 'generated', FORWARDED: 'forwarded', REJECTED: 'rejected'}
+
+
+def block_id(block):
+    """
+    BLOCK_SIZE byte id of a block: the block itself, or the start of the sha256 digest of any other message
+    :param block: bytes
+    :return: BLOCK_SIZE bytes
+    """
+    if len(block) == BLOCK_SIZE:
+        return block
+    return hashlib.sha256(block).digest()[:BLOCK_SIZE]
+
+
+class EventLog:
+    def __init__(self, path, batch=4096, flush_interval=1.0):
+        """
+        Append only log of fixed width binary events, written in batches by a background thread
+        :param path: log file, peer ids go to <path>.peers one per line
+        :param batch: events buffered before a write
+        :param flush_interval: max seconds an event waits in memory
+        """
+        self.path = path
+        self.file = open(path, 'wb')
+        self.file.write(LOG_HEADER.pack(LOG_MAGIC, LOG_VERSION, RECORD.size))
+        self.file.flush()
+        self.peers_file = open(path + '.peers', 'w')
+        self.peers = {}
+        self.batch = batch
+        self.flush_interval = flush_interval
+        self.buffer = bytearray(RECORD.size * batch)
+        self.offset = 0
+        self.lock = Lock()
+        # filled buffers waiting for the writer
+        self.pending = deque()
+        self.cond = Condition(self.lock)
+        self.closed = False
+        self.written = 0
+        self.writer = Thread(target=self.write)
+        self.writer.daemon = True
+        self.writer.start()
+
+    def peer_index(self, peer):
+        index = self.peers.get(peer)
+        if index is None:
+            with self.lock:
+                index = self.peers.get(peer)
+                if index is None:
+                    index = len(self.peers)
+                    self.peers_file.write("%s\n" % peer)
+                    self.peers_file.flush()
+                    self.peers[peer] = index
+        return index
+
+    def log(self, event, peer, block, timestamp=None):
+        """
+        Record an event, only packs it into the current buffer
+        :param event: one of RECEIVED, GENERATED, FORWARDED, REJECTED
+        :param peer: peer id, None if unknown
+        :param block: block or message
+        :param timestamp: event time, now if None
+        :return:
+        """
+        peer = self.peer_index(peer)
+        if timestamp is None:
+            timestamp = time.time()
+        with self.lock:
+            RECORD.pack_into(self.buffer, self.offset, timestamp, event, peer, block_id(block))
+            self.offset += RECORD.size
+            if self.offset == len(self.buffer):
+                self.swap()
+
+    def swap(self):
+        # caller holds lock
+        self.pending.append(memoryview(self.buffer)[:self.offset])
+        self.buffer = bytearray(RECORD.size * self.batch)
+        self.offset = 0
+        self.cond.notify()
+
+    def write(self):
+        """
+        Writer thread: write full buffers as they come and partial ones every flush_interval
+        :return:
+        """
+        while True:
+            with self.cond:
+                if not self.pending and not self.closed:
+                    self.cond.wait(timeout=self.flush_interval)
+                if not self.pending and self.offset:
+                    self.swap()
+                pending, self.pending = self.pending, deque()
+                closed = self.closed
+            for buffer in pending:
+                self.file.write(buffer)
+                self.written += len(buffer) // RECORD.size
+            if pending:
+                self.file.flush()
+            if closed:
+                return
+
+    def close(self):
+        with self.cond:
+            if self.offset:
+                self.swap()
+            self.closed = True
+            self.cond.notify()
+        self.writer.join()
+        self.file.close()
+        self.peers_file.close()
+
+
+def read_events(path):
+    """
+    Memory map an event log
+    :param path: log file
+    :return: (numpy structured array of events, list of peer ids)
+    """
+    with open(path + '.peers') as f:
+        peers = f.read().splitlines()
+    with open(path, 'rb') as f:
+        header = f.read(LOG_HEADER.size)
+    if len(header) < LOG_HEADER.size or LOG_HEADER.unpack(header) != (LOG_MAGIC, LOG_VERSION, RECORD.size):
+        raise ValueError("Unsupported event log %s" % path)
+    count = (os.path.getsize(path) - LOG_HEADER.size) // RECORD.size
+    if not count:
+        return numpy.zeros(0, dtype=RECORD_DTYPE), peers
+    events = numpy.memmap(path, dtype=RECORD_DTYPE, mode='r', offset=LOG_HEADER.size, shape=(count,))
+    return events, peers
+
+
+def to_text(path, out):
+    """
+    Write an event log as text lines "<time>:<event>:<peer>-><block>", like the old outputfile lines
+    :param path: log file
+    :param out: text file object
+    :return:
+    """
+    events, peers = read_events(path)
+    for record in events:
+        out.write("%f:%s:%s->%s\n" % (record['time'], EVENT_NAMES.get(int(record['event']), record['event']),
+                                      peers[record['peer']], record['block'].tobytes()))
+
+
+def to_arrays(path):
+    """
+    Load an event log as plain NumPy columns for analysis
+    :param path: log file
+    :return: dict of column -> array, and 'peers' list
+    """
+    events, peers = read_events(path)
+    columns = {
+        'time': numpy.array(events['time']),
+        'event': numpy.array(events['event']),
+        'peer': numpy.array(events['peer']),
+        'block': numpy.array(events['block']),
+        'peers': peers,
+    }
+    # blocks are stored verbatim, split them into their fields
+    blocks = numpy.frombuffer(numpy.ascontiguousarray(events['block']).tobytes(), dtype=numpy.dtype(
+        [('prev_block_hash', 'u2'), ('merkel_root', 'u2'), ('timestamp', 'u4'), ('nonce', 'u4')]))
+    for field in blocks.dtype.names:
+        columns[field] = blocks[field]
+    return columns
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Convert a binary event log to text")
+    parser.add_argument('path')
+    args = parser.parse_args()
+    to_text(args.path, sys.stdout)
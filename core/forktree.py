@@ -0,0 +1,168 @@
+import argparse
+import json
+import sys
+from xml.sax.saxutils import quoteattr
+
+from .blockchain import Blockhain
+from .store import ChainStore
+
+FORMATS = ('dot', 'jsonl', 'graphml')
+GENESIS = 'genesis'
+
+
+def snapshot(block_chain):
+    """
+    Copy the fork tree under the chain lock so it can be written out without holding it
+    :param block_chain: Blockhain
+    :return: (list of (block, hash, height, parent) in height order, set of main chain blocks)
+    """
+    with block_chain.lock:
+        blocks = block_chain.blocks
+        nodes = [(block,) + blocks[block] for level in block_chain.block_chain for block in level]
+        main = set(block_chain.main_chain())
+    return nodes, main
+
+
+def node_id(block):
+    return block.hex()
+
+
+class ForkTree:
+    def __init__(self, nodes, main, collapse=None):
+        """
+        Fork tree ready to be streamed, every step is a single pass over the blocks
+        :param nodes: list of (block, hash, height, parent) in height order, from snapshot
+        :param main: set of blocks on the main chain
+        :param collapse: if set, runs of at least this many blocks that each have one child and no sibling are
+            written as one node
+        """
+        self.nodes = nodes
+        self.main = main
+        children = {}
+        for _, _, _, parent in nodes:
+            children[parent] = children.get(parent, 0) + 1
+        # block inside a collapsed run -> first block of run, run start -> (length, last block)
+        self.run_of = {}
+        self.runs = {}
+        if collapse:
+            runs = {}
+            for block, _, _, parent in nodes:
+                if children.get(block) == 1 and children[parent] == 1:
+                    start = runs.get(parent, block)
+                    runs[block] = start
+                    length, _ = self.runs.get(start, (0, None))
+                    self.runs[start] = (length + 1, block)
+            self.runs = {start: run for start, run in self.runs.items() if run[0] >= collapse}
+            self.run_of = {block: start for block, start in runs.items() if start in self.runs}
+
+    def display(self, block):
+        """
+        :return: id of the node a block is drawn as
+        """
+        if block is None:
+            return GENESIS
+        start = self.run_of.get(block)
+        if start is not None:
+            return "run_%s" % node_id(start)
+        return node_id(block)
+
+    def walk(self):
+        """
+        Nodes and edges in height order, a collapsed run is yielded once at its first block
+        :return: generator of dicts with id, parent, height, hash, main and, for a run, blocks and last_height
+        """
+        for block, block_hash, height, parent in self.nodes:
+            start = self.run_of.get(block)
+            if start is not None and start != block:
+                continue
+            node = {
+                'id': self.display(block),
+                'parent': self.display(parent),
+                'height': height,
+                'hash': block_hash,
+                'main': block in self.main,
+            }
+            if start is not None:
+                length, _ = self.runs[start]
+                node['blocks'] = length
+                node['last_height'] = height + length - 1
+            yield node
+
+
+def write_dot(tree, out):
+    out.write("digraph forktree {\n  rankdir=LR;\n  node [shape=ellipse];\n  %s [shape=box];\n" % GENESIS)
+    for node in tree.walk():
+        if 'blocks' in node:
+            label = "%d blocks\\n%d-%d" % (node['blocks'], node['height'], node['last_height'])
+            attributes = 'shape=box, label="%s"' % label
+        else:
+            attributes = 'label="%d:%04x"' % (node['height'], node['hash'])
+        if node['main']:
+            attributes += ', color=red'
+        out.write('  "%s" [%s];\n  "%s" -> "%s";\n' % (node['id'], attributes, node['parent'], node['id']))
+    out.write("}\n")
+
+
+def write_jsonl(tree, out):
+    for node in tree.walk():
+        out.write(json.dumps(node))
+        out.write("\n")
+
+
+def write_graphml(tree, out):
+    out.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+              '<graphml xmlns="http://graphml.graphdrawing.org/xmlns">\n'
+              '  <key id="height" for="node" attr.name="height" attr.type="int"/>\n'
+              '  <key id="hash" for="node" attr.name="hash" attr.type="int"/>\n'
+              '  <key id="main" for="node" attr.name="main" attr.type="boolean"/>\n'
+              '  <key id="blocks" for="node" attr.name="blocks" attr.type="int"><default>1</default></key>\n'
+              '  <graph id="forktree" edgedefault="directed">\n'
+              '    <node id="%s"/>\n' % GENESIS)
+    for node in tree.walk():
+        node_attr = quoteattr(node['id'])
+        out.write('    <node id=%s><data key="height">%d</data><data key="hash">%d</data>'
+                  '<data key="main">%s</data>' % (node_attr, node['height'], node['hash'],
+                                                  'true' if node['main'] else 'false'))
+        if 'blocks' in node:
+            out.write('<data key="blocks">%d</data>' % node['blocks'])
+        out.write('</node>\n    <edge source=%s target=%s/>\n' % (quoteattr(node['parent']), node_attr))
+    out.write('  </graph>\n</graphml>\n')
+
+
+WRITERS = {
+    'dot': write_dot,
+    'jsonl': write_jsonl,
+    'graphml': write_graphml,
+}
+
+
+def write_tree(block_chain, path, format='dot', collapse=None):
+    """
+    Stream the fork tree of a block-chain to a file in linear time
+    :param block_chain: Blockhain
+    :param path: output file, '-' for stdout
+    :param format: 'dot', 'jsonl' or 'graphml'
+    :param collapse: if set, write runs of at least this many linear blocks as one node
+    :return: number of nodes written
+    """
+    if format not in WRITERS:
+        raise ValueError("Unknown format %r, expected one of %s" % (format, ", ".join(FORMATS)))
+    tree = ForkTree(*snapshot(block_chain), collapse=collapse)
+    if path == '-':
+        WRITERS[format](tree, sys.stdout)
+    else:
+        with open(path, 'w', buffering=1 << 20) as out:
+            WRITERS[format](tree, out)
+    return len(tree.nodes) - len(tree.run_of) + len(tree.runs)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Export the fork tree of a node's chain store")
+    parser.add_argument('data_dir', help="data_dir of a client")
+    parser.add_argument('out', help="output file, - for stdout")
+    parser.add_argument('--format', choices=FORMATS, default='dot')
+    parser.add_argument('--collapse', type=int, default=None, help="collapse linear runs of at least this many blocks")
+    args = parser.parse_args()
+    block_chain = Blockhain()
+    ChainStore(args.data_dir).load(block_chain)
+    write_tree(block_chain, args.out, args.format, args.collapse)
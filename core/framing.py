@@ -0,0 +1,189 @@
+import os
+import socket
+import struct
+
+# frame header: type byte and payload length
+HEADER = struct.Struct('!BI')
+# largest payload accepted, a peer announcing more is disconnected before anything is allocated for it
+MAX_FRAME = 16 * 1024 * 1024
+
+# frame types
+FRAME_HELLO = 1  # payload: peer id "ip:port"
+FRAME_START_MN = 2  # no payload
+FRAME_BLOCKS = 3  # payload: blocks back to back
+FRAME_INV = 4  # payload: inventory ids of blocks the sender has
+FRAME_GETDATA = 5  # payload: inventory ids of blocks requested from the receiver
+FRAME_REGISTER = 6  # client to seed, payload: peer record of the client
+FRAME_PEERS = 7  # seed to client, payload: peer records back to back
+FRAME_HEARTBEAT = 8  # client to seed, payload: peer record of the client, renews its lease
+FRAME_RUMOR = 9  # payload: blocks back to back, the receiver answers with FRAME_KNOWN for those it already had
+FRAME_KNOWN = 10  # payload: blocks of a FRAME_RUMOR the sender already had
+FRAME_SUMMARY = 11  # payload: inventory ids of the sender's recent blocks, the receiver fetches those it lacks and
+                    # announces its own recent blocks the sender didn't list
+FRAME_TIP = 12  # payload: antientropy.TIP summary of the sender's tip and recent window
+FRAME_SKETCH = 13  # payload: antientropy.SKETCH_HEADER and a sketch.Sketch of the sender's blocks in that window
+FRAME_MISSING = 14  # payload: blocks back to back the receiver lacks, accepted whatever their timestamp
+FRAME_GET_STATUS = 15  # no payload, asks for a FRAME_STATUS
+FRAME_STATUS = 16  # payload: sync.STATUS, tip height and hash of the sender and whether it mines
+FRAME_GET_RANGE = 17  # payload: sync.RANGE, heights of blocks requested
+FRAME_RANGE = 18  # payload: sync.RANGE with the heights served, then sync.RANGE_RECORD of every block in them
+
+# peer record: packed IPv4 address and port
+PEER_RECORD = struct.Struct('!4sH')
+
+# frame types whose payloads are concatenated when several are queued back to back for the same peer
+COALESCED_FRAMES = frozenset([FRAME_BLOCKS, FRAME_INV, FRAME_GETDATA, FRAME_RUMOR, FRAME_KNOWN,
+                              FRAME_MISSING])
+
+try:
+    IOV_MAX = os.sysconf('SC_IOV_MAX')
+except (AttributeError, ValueError, OSError):
+    IOV_MAX = 1024
+
+
+def encode_header(frame_type, length):
+    """
+    Pack a frame header
+    :param frame_type: one of FRAME_*
+    :param length: payload length in bytes
+    :return: header bytes
+    """
+    return HEADER.pack(frame_type, length)
+
+
+def encode_frame(frame_type, payloads=()):
+    """
+    Build the list of buffers of one frame without joining its payloads
+    :param frame_type: one of FRAME_*
+    :param payloads: list of bytes like objects sent back to back
+    :return: list of buffers
+    """
+    return [encode_header(frame_type, sum(len(payload) for payload in payloads))] + list(payloads)
+
+
+def encode_peer(ip, port):
+    """
+    Pack a peer address
+    :param ip: IPv4 address or host name
+    :param port: port number
+    :return: PEER_RECORD bytes
+    """
+    return PEER_RECORD.pack(socket.inet_aton(socket.gethostbyname(ip)), port)
+
+
+def decode_peers(payload):
+    """
+    Unpack peer records
+    :param payload: bytes like, peer records back to back
+    :return: dict of peer_id "ip:port" -> (ip, port)
+    """
+    peers = {}
+    for address, port in PEER_RECORD.iter_unpack(payload):
+        ip = socket.inet_ntoa(address)
+        peers["%s:%d" % (ip, port)] = (ip, port)
+    return peers
+
+
+def encode_frames(frames):
+    """
+    Build buffers for a list of frames, merging consecutive coalesced frames of the same type into one
+    :param frames: list of (frame_type, payloads)
+    :return: list of buffers
+    """
+    buffers = []
+    frame_type, payloads = None, []
+    for next_type, next_payloads in frames:
+        if next_type == frame_type and frame_type in COALESCED_FRAMES:
+            payloads.extend(next_payloads)
+            continue
+        if frame_type is not None:
+            buffers.extend(encode_frame(frame_type, payloads))
+        frame_type, payloads = next_type, list(next_payloads)
+    if frame_type is not None:
+        buffers.extend(encode_frame(frame_type, payloads))
+    return buffers
+
+
+def decode_header(data, offset=0):
+    """
+    :param data: bytes like holding a frame header at offset
+    :return: (frame_type, payload length)
+    :raise ConnectionError: if the payload length exceeds MAX_FRAME
+    """
+    frame_type, length = HEADER.unpack_from(data, offset)
+    if length > MAX_FRAME:
+        raise ConnectionError("Frame of type %d announces %d bytes, more than %d" % (frame_type, length, MAX_FRAME))
+    return frame_type, length
+
+
+def sendmsg_all(sock, buffers):
+    """
+    Send all buffers with as few sendmsg calls as the kernel allows
+    :param sock: blocking socket
+    :param buffers: list of bytes like objects
+    :return:
+    """
+    buffers = [memoryview(buffer) for buffer in buffers if len(buffer)]
+    while buffers:
+        sent = sock.sendmsg(buffers[:IOV_MAX])
+        # drop what went out and keep the rest of a partially sent buffer
+        while buffers and sent >= len(buffers[0]):
+            sent -= len(buffers.pop(0))
+        if sent:
+            buffers[0] = buffers[0][sent:]
+
+
+class FrameReader:
+    def __init__(self, size=65536):
+        """
+        Parse frames out of a receive buffer that is reused for the whole connection
+        :param size: initial buffer size, grows if a frame does not fit
+        """
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        # unparsed data is buffer[start:end]
+        self.start = 0
+        self.end = 0
+
+    def recv_into(self, sock):
+        """
+        Receive whatever is available from sock into the free end of the buffer
+        :param sock: blocking socket
+        :return: number of bytes received, 0 if peer closed the connection
+        """
+        if self.end == len(self.buffer):
+            self.compact()
+        received = sock.recv_into(self.view[self.end:])
+        self.end += received
+        return received
+
+    def compact(self):
+        """
+        Move unparsed data to the front of the buffer, doubling it if it is already full
+        :return:
+        """
+        pending = self.end - self.start
+        if self.start == 0:
+            # payload views handed out earlier may still pin the old buffer, so copy instead of resizing it
+            buffer = bytearray(2 * len(self.buffer))
+            buffer[:pending] = self.view[:pending]
+            self.buffer, self.view = buffer, memoryview(buffer)
+        else:
+            self.buffer[:pending] = self.view[self.start:self.end]
+        self.start, self.end = 0, pending
+
+    def frames(self):
+        """
+        Yield complete frames received so far, payload views are only valid until the next recv_into
+        :return: generator of (frame_type, memoryview payload)
+        :raise ConnectionError: on a frame larger than MAX_FRAME, the connection can't be parsed any further
+        """
+        while self.end - self.start >= HEADER.size:
+            frame_type, length = decode_header(self.buffer, self.start)
+            payload_start = self.start + HEADER.size
+            if payload_start + length > self.end:
+                break
+            self.start = payload_start + length
+            yield frame_type, self.view[payload_start:self.start]
+        if self.start == self.end:
+            self.start = self.end = 0
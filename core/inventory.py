@@ -0,0 +1,107 @@
+import hashlib
+import time
+from collections import OrderedDict
+from threading import Lock
+
+# bytes of sha256 digest used to announce a block
+INV_ID_SIZE = 8
+
+
+def inv_ids(payload):
+    """
+    Split an INV or GETDATA payload into inventory ids
+    :param payload: bytes like
+    :return: list of inventory ids
+    """
+    return [bytes(payload[offset:offset + INV_ID_SIZE])
+            for offset in range(0, len(payload) - INV_ID_SIZE + 1, INV_ID_SIZE)]
+
+
+class Inventory:
+    def __init__(self, capacity=100000, request_timeout=2.0, clock=time.monotonic):
+        """
+        Blocks a node can serve by inventory id and ids it is fetching
+        :param capacity: max blocks remembered
+        :param request_timeout: seconds before an id that was requested but not delivered is asked for again
+        :param clock: time source
+        """
+        self.capacity = capacity
+        self.request_timeout = request_timeout
+        self.clock = clock
+        # inventory id -> block, None if block was rejected
+        self.blocks = OrderedDict()
+        # block -> inventory id, so relaying a block doesn't hash it again
+        self.ids = OrderedDict()
+        # inventory id -> time requested, oldest first
+        self.requested = OrderedDict()
+        self.lock = Lock()
+
+    def inv_id(self, block):
+        """
+        :param block: block
+        :return: inventory id of block, the start of its sha256 digest, hashed only if block is not remembered
+        """
+        inv_id = self.ids.get(block)
+        if inv_id is None:
+            inv_id = hashlib.sha256(block).digest()[:INV_ID_SIZE]
+        return inv_id
+
+    def add(self, block, valid=True, digest=None):
+        """
+        Remember a block so it can be served and is not requested again
+        :param block: block
+        :param valid: false to only remember that block was rejected
+        :param digest: sha256 digest of block if already computed
+        :return: inventory id of block
+        """
+        inv_id = digest[:INV_ID_SIZE] if digest is not None else self.inv_id(block)
+        with self.lock:
+            self.blocks[inv_id] = block if valid else None
+            self.blocks.move_to_end(inv_id)
+            self.ids[block] = inv_id
+            self.ids.move_to_end(block)
+            self.requested.pop(inv_id, None)
+            while len(self.blocks) > self.capacity:
+                self.blocks.popitem(last=False)
+            while len(self.ids) > self.capacity:
+                self.ids.popitem(last=False)
+        return inv_id
+
+    def get(self, inv_id):
+        """
+        :param inv_id: inventory id
+        :return: block or None if unknown or rejected
+        """
+        return self.blocks.get(inv_id)
+
+    def recent(self, n):
+        """
+        :param n: max ids returned
+        :return: ids of the last n valid blocks added, newest first
+        """
+        ids = []
+        with self.lock:
+            for inv_id in reversed(self.blocks):
+                if len(ids) == n:
+                    break
+                if self.blocks[inv_id] is not None:
+                    ids.append(inv_id)
+        return ids
+
+    def want(self, ids):
+        """
+        Pick announced ids to fetch: unknown and not already requested, and mark them requested
+        :param ids: announced inventory ids
+        :return: list of ids to request
+        """
+        now = self.clock()
+        wanted = []
+        with self.lock:
+            requested = self.requested
+            while requested and now - next(iter(requested.values())) > self.request_timeout:
+                requested.popitem(last=False)
+            for inv_id in ids:
+                if inv_id not in self.blocks and inv_id not in requested:
+                    requested[inv_id] = now
+                    wanted.append(inv_id)
+        return wanted
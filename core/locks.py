@@ -0,0 +1,62 @@
+from threading import Lock
+from time import perf_counter
+
+
+class InstrumentedLock:
+    def __init__(self):
+        """
+        Mutex that records how often and how long threads waited for it
+        """
+        self.lock = Lock()
+        self.acquisitions = 0
+        self.contended = 0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+
+    def acquire(self):
+        # only time acquisitions that actually had to wait, the fast path is one non-blocking try
+        if not self.lock.acquire(blocking=False):
+            start = perf_counter()
+            self.lock.acquire()
+            wait = perf_counter() - start
+            self.contended += 1
+            self.wait_time += wait
+            if wait > self.max_wait:
+                self.max_wait = wait
+        self.acquisitions += 1
+        return True
+
+    def release(self):
+        self.lock.release()
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+    def stats(self):
+        """
+        :return: dict of lock wait counters, times in seconds
+        """
+        return {
+            'acquisitions': self.acquisitions,
+            'contended': self.contended,
+            'wait_time': self.wait_time,
+            'max_wait': self.max_wait,
+        }
+
+
+def merge_lock_stats(stats):
+    """
+    Sum lock wait counters of several locks
+    :param stats: iterable of InstrumentedLock.stats()
+    :return: dict of lock wait counters
+    """
+    merged = {'acquisitions': 0, 'contended': 0, 'wait_time': 0.0, 'max_wait': 0.0}
+    for lock_stats in stats:
+        merged['acquisitions'] += lock_stats['acquisitions']
+        merged['contended'] += lock_stats['contended']
+        merged['wait_time'] += lock_stats['wait_time']
+        merged['max_wait'] = max(merged['max_wait'], lock_stats['max_wait'])
+    return merged
@@ -0,0 +1,183 @@
+import bisect
+import json
+import logging
+import os
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+
+# histogram bucket upper bounds in seconds, 1us doubling up to about 1 minute
+DEFAULT_BOUNDS = [1e-6 * 2 ** i for i in range(27)]
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0
+        self.lock = Lock()
+
+    def inc(self, n=1):
+        with self.lock:
+            self.value += n
+
+    def snapshot(self):
+        return self.value
+
+
+class Histogram:
+    def __init__(self, bounds=DEFAULT_BOUNDS):
+        """
+        Fixed bucket histogram, the last bucket counts values above the highest bound
+        :param bounds: sorted bucket upper bounds
+        """
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.lock = Lock()
+
+    def observe(self, value):
+        bucket = bisect.bisect_left(self.bounds, value)
+        with self.lock:
+            self.counts[bucket] += 1
+            self.count += 1
+            self.sum += value
+            if value > self.max:
+                self.max = value
+
+    def quantile(self, q):
+        """
+        Upper bound of the bucket holding quantile q, capped at the largest value seen
+        """
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(bound, self.max)
+        return self.max
+
+    def snapshot(self):
+        with self.lock:
+            if not self.count:
+                return {'count': 0}
+            return {
+                'count': self.count,
+                'sum': self.sum,
+                'mean': self.sum / self.count,
+                'max': self.max,
+                'p50': self.quantile(0.5),
+                'p90': self.quantile(0.9),
+                'p99': self.quantile(0.99),
+            }
+
+
+class Metrics:
+    def __init__(self, labels=None):
+        """
+        Registry of a node's counters, histograms and gauges
+        :param labels: dict added to every snapshot, e.g. the node address
+        """
+        self.labels = labels or {}
+        self.started = time.time()
+        self.counters = {}
+        self.histograms = {}
+        # name -> function returning a json serializable value, evaluated on snapshot
+        self.gauges = {}
+        self.lock = Lock()
+        self.server = None
+
+    def counter(self, name):
+        counter = self.counters.get(name)
+        if counter is None:
+            with self.lock:
+                counter = self.counters.setdefault(name, Counter())
+        return counter
+
+    def histogram(self, name, bounds=DEFAULT_BOUNDS):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(name, Histogram(bounds))
+        return histogram
+
+    def inc(self, name, n=1):
+        self.counter(name).inc(n)
+
+    def observe(self, name, value):
+        self.histogram(name).observe(value)
+
+    def gauge(self, name, function):
+        self.gauges[name] = function
+
+    def snapshot(self):
+        """
+        :return: dict of every metric's current value
+        """
+        snapshot = dict(self.labels)
+        snapshot['time'] = time.time()
+        snapshot['uptime'] = snapshot['time'] - self.started
+        snapshot['counters'] = {name: counter.snapshot() for name, counter in list(self.counters.items())}
+        snapshot['histograms'] = {name: histogram.snapshot() for name, histogram in list(self.histograms.items())}
+        gauges = {}
+        for name, function in list(self.gauges.items()):
+            try:
+                gauges[name] = function()
+            except Exception as e:
+                gauges[name] = "error: %s" % e
+        snapshot['gauges'] = gauges
+        return snapshot
+
+    def serve(self, port, host='127.0.0.1'):
+        """
+        Serve snapshots as json over HTTP on localhost in a background thread
+        :param port: port number, 0 to pick a free one
+        :return: bound (host, port)
+        """
+        metrics = self
+
+        class StatsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = json.dumps(metrics.snapshot()).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), StatsHandler)
+        self.server.daemon_threads = True
+        thread = Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        logging.info("Stats served at http://%s:%d/" % self.server.server_address[:2])
+        return self.server.server_address[:2]
+
+    def write_snapshot(self, path):
+        # write to a temporary file and rename so readers never see a partial snapshot
+        temporary = "%s.tmp" % path
+        with open(temporary, 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(temporary, path)
+
+    def write_periodically(self, path, interval):
+        """
+        Write a snapshot to path every interval seconds in a background thread
+        :param path: snapshot file
+        :param interval: seconds
+        :return:
+        """
+        def write():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.write_snapshot(path)
+                except OSError as e:
+                    logging.warning("Failed to write stats to %s: %s" % (path, e))
+
+        thread = Thread(target=write)
+        thread.daemon = True
+        thread.start()
@@ -0,0 +1,137 @@
+import argparse
+import json
+
+import numpy
+
+from .cluster import load_nodes
+
+
+def simulate(hash_power, inter_arrival_time, delay, horizon, trials=1000, seed=None, max_elements=2**24):
+    """
+    Monte Carlo estimate of chain growth for many configurations at once, without a per-block Python loop.
+
+    Miner i finds blocks as a Poisson process of rate hash_power[i] / inter_arrival_time[i], the rate of
+    Client.mine. A block found less than delay seconds after the previous block by a different miner was
+    mined on a tip that had not propagated yet, so it forks and goes stale.
+    :param hash_power: (configs, miners) or (miners,) hash power shares
+    :param inter_arrival_time: scalar, (configs,) or (configs, miners) block interval in seconds
+    :param delay: scalar or (configs,) propagation delay in seconds
+    :param horizon: seconds of mining per trial
+    :param trials: trials per configuration
+    :param seed: seed of numpy random generator
+    :param max_elements: max array elements per batch, bounds memory
+    :return: dict of arrays over configs: blocks, longest_chain, forks, fork_rate, and miner_share (configs, miners)
+    """
+    rng = numpy.random.default_rng(seed)
+    hash_power = numpy.atleast_2d(numpy.asarray(hash_power, dtype=float))
+    configs = max(hash_power.shape[0], numpy.size(delay) if numpy.ndim(delay) else 1,
+                  numpy.shape(inter_arrival_time)[0] if numpy.ndim(inter_arrival_time) else 1)
+    hash_power = numpy.broadcast_to(hash_power, (configs, hash_power.shape[1]))
+    inter_arrival_time = numpy.asarray(inter_arrival_time, dtype=float)
+    if inter_arrival_time.ndim == 1:
+        inter_arrival_time = inter_arrival_time[:, None]
+    rates = hash_power / numpy.broadcast_to(inter_arrival_time, hash_power.shape)
+    delay = numpy.broadcast_to(numpy.asarray(delay, dtype=float), (configs,))
+    total_rate = rates.sum(axis=1)
+    # blocks to draw per trial so that the horizon is covered with overwhelming probability
+    expected = total_rate.max() * horizon
+    n_blocks = int(expected + 8 * numpy.sqrt(expected) + 16)
+    batch = max(1, max_elements // (trials * n_blocks))
+
+    results = {
+        'blocks': numpy.empty(configs),
+        'longest_chain': numpy.empty(configs),
+        'forks': numpy.empty(configs),
+        'miner_share': numpy.empty(rates.shape),
+    }
+    for start in range(0, configs, batch):
+        stop = min(configs, start + batch)
+        chunk = simulate_batch(rng, rates[start:stop], total_rate[start:stop], delay[start:stop],
+                               horizon, trials, n_blocks)
+        for key, value in chunk.items():
+            results[key][start:stop] = value
+    results['fork_rate'] = numpy.divide(results['forks'], results['blocks'],
+                                        out=numpy.zeros(configs), where=results['blocks'] > 0)
+    return results
+
+
+def simulate_batch(rng, rates, total_rate, delay, horizon, trials, n_blocks):
+    configs, miners = rates.shape
+    shape = (configs, trials, n_blocks)
+    # block arrival times, blocks past the horizon are masked out
+    gaps = rng.exponential(1.0, shape) / total_rate[:, None, None]
+    mined = numpy.cumsum(gaps, axis=2) <= horizon
+    # miner of each block: invert the per config cumulative share, offset by config index so one
+    # searchsorted call serves all configs
+    shares = numpy.cumsum(rates / total_rate[:, None], axis=1)
+    shares[:, -1] = 1.0
+    offsets = numpy.arange(configs)[:, None, None]
+    miner = numpy.searchsorted((shares + numpy.arange(configs)[:, None]).ravel(),
+                               rng.random(shape) + offsets, side='right') - offsets * miners
+
+    stale = numpy.zeros(shape, dtype=bool)
+    stale[:, :, 1:] = (gaps[:, :, 1:] < delay[:, None, None]) & (miner[:, :, 1:] != miner[:, :, :-1])
+    stale &= mined
+    main = mined & ~stale
+
+    blocks = mined.sum(axis=2)
+    longest_chain = main.sum(axis=2)
+    # main chain blocks per miner, summed over trials
+    per_miner = numpy.bincount((offsets * miners + miner)[main], minlength=configs * miners).reshape(configs, miners)
+    main_total = per_miner.sum(axis=1, keepdims=True)
+    return {
+        'blocks': blocks.mean(axis=1),
+        'longest_chain': longest_chain.mean(axis=1),
+        'forks': (blocks - longest_chain).mean(axis=1),
+        'miner_share': numpy.divide(per_miner, main_total, out=numpy.zeros(per_miner.shape), where=main_total > 0),
+    }
+
+
+def grid(hash_power, inter_arrival_times, delays):
+    """
+    Cartesian product of inter-arrival times and delays for one hash power split
+    :param hash_power: (miners,) hash power shares
+    :param inter_arrival_times: list of block intervals
+    :param delays: list of propagation delays
+    :return: (hash_power, inter_arrival_time, delay) arrays over configs for simulate
+    """
+    inter_arrival_time, delay = numpy.meshgrid(inter_arrival_times, delays, indexing='ij')
+    configs = inter_arrival_time.size
+    return numpy.tile(numpy.asarray(hash_power, dtype=float), (configs, 1)), inter_arrival_time.ravel(), delay.ravel()
+
+
+def from_settings(config_path):
+    """
+    Read hash power and inter-arrival time of every client a gossip settings file runs, templates expanded to their
+    count of clients as the cluster does
+    :param config_path: path of ini file
+    :return: (names, hash_power, inter_arrival_time)
+    """
+    _, clients = load_nodes(config_path)
+    names = [client['name'] for client in clients]
+    hash_power = numpy.array([client['hash_power'] for client in clients])
+    inter_arrival_time = numpy.array([client['inter_arrival_time'] for client in clients])
+    return names, hash_power, inter_arrival_time
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Sweep propagation delay for the clients of a settings file")
+    parser.add_argument('--config', default='gossip_settings.ini')
+    parser.add_argument('--delays', type=float, nargs='+', default=[0.1, 0.5, 1, 2, 5, 10])
+    parser.add_argument('--horizon', type=float, default=3600)
+    parser.add_argument('--trials', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    names, hash_power, inter_arrival_time = from_settings(args.config)
+    configs = len(args.delays)
+    results = simulate(numpy.tile(hash_power, (configs, 1)), numpy.tile(inter_arrival_time, (configs, 1)),
+                       args.delays, args.horizon, args.trials, args.seed)
+    for i, delay in enumerate(args.delays):
+        print(json.dumps({
+            'delay': delay,
+            'blocks': results['blocks'][i],
+            'longest_chain': results['longest_chain'][i],
+            'forks': results['forks'][i],
+            'fork_rate': results['fork_rate'][i],
+            'miner_share': dict(zip(names, results['miner_share'][i].round(4).tolist())),
+        }))
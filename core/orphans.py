@@ -0,0 +1,99 @@
+import time
+from collections import OrderedDict
+
+
+class OrphanPool:
+    def __init__(self, max_orphans=10000, max_bytes=1 << 20, max_age=600, clock=time.time, on_evict=None):
+        """
+        Blocks whose parent is not known yet, indexed by the parent hash they wait for
+        :param max_orphans: max blocks kept
+        :param max_bytes: max total size of blocks kept
+        :param max_age: seconds a block is kept
+        :param clock: time source
+        :param on_evict: called with a block dropped for age or size, e.g. to forget it was seen
+        """
+        self.max_orphans = max_orphans
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.clock = clock
+        self.on_evict = on_evict
+        # block -> (parent hash, time added), oldest first
+        self.orphans = OrderedDict()
+        # parent hash -> blocks waiting for it
+        self.by_parent = {}
+        self.bytes = 0
+        self.added = 0
+        self.connected = 0
+        self.evicted = 0
+
+    def __contains__(self, block):
+        return block in self.orphans
+
+    def __len__(self):
+        return len(self.orphans)
+
+    def add(self, block, parent_hash):
+        """
+        Keep a block until its parent arrives
+        :param block: block bytes
+        :param parent_hash: hash of missing parent
+        :return: false if block was already waiting
+        """
+        if block in self.orphans:
+            return False
+        now = self.clock()
+        self.orphans[block] = (parent_hash, now)
+        self.by_parent.setdefault(parent_hash, []).append(block)
+        self.bytes += len(block)
+        self.added += 1
+        self.evict(now)
+        return True
+
+    def pop_children(self, parent_hash):
+        """
+        Remove and return the blocks waiting for a parent
+        :param parent_hash: hash of a block just added to the chain
+        :return: list of blocks, oldest first
+        """
+        children = self.by_parent.pop(parent_hash, ())
+        for block in children:
+            del self.orphans[block]
+            self.bytes -= len(block)
+        self.connected += len(children)
+        self.evict(self.clock())
+        return children
+
+    def evict(self, now):
+        """
+        Drop the oldest blocks while any is too old or the pool is over its limits
+        :param now: current time
+        :return:
+        """
+        orphans = self.orphans
+        while orphans:
+            block, (parent_hash, added) = next(iter(orphans.items()))
+            if len(orphans) <= self.max_orphans and self.bytes <= self.max_bytes and now - added <= self.max_age:
+                break
+            del orphans[block]
+            self.bytes -= len(block)
+            waiting = self.by_parent[parent_hash]
+            waiting.remove(block)
+            if not waiting:
+                del self.by_parent[parent_hash]
+            self.evicted += 1
+            if self.on_evict is not None:
+                self.on_evict(block)
+
+    def stats(self):
+        """
+        :return: dict of pool counters
+        """
+        self.evict(self.clock())
+        return {
+            'size': len(self.orphans),
+            'bytes': self.bytes,
+            'missing_parents': len(self.by_parent),
+            'added': self.added,
+            'connected': self.connected,
+            'evicted': self.evicted,
+        }
@@ -0,0 +1,206 @@
+import asyncio
+import logging
+import socket
+from collections import deque
+from threading import Condition, Thread, get_ident
+
+from .framing import encode_frames, sendmsg_all
+
+# what to do when a peer's outbound queue is full
+OVERFLOW_POLICIES = ('drop-oldest', 'disconnect')
+
+
+class Peer:
+    def __init__(self, sock, peer_id=None, max_queue=1000, overflow='drop-oldest'):
+        """
+        Connection to a peer node with a bounded outbound queue drained by its own writer thread
+        :param sock: connected blocking socket
+        :param peer_id: "ip:port" of peer, None until its hello frame arrives
+        :param max_queue: max messages waiting to be written
+        :param overflow: 'drop-oldest' to make room by dropping queued messages, 'disconnect' to drop the peer
+        """
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError("Unknown overflow policy %r, expected one of %s"
+                             % (overflow, ", ".join(OVERFLOW_POLICIES)))
+        self.sock = sock
+        if sock is not None:
+            # frames are small and latency matters more than packet count
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.peer_id = peer_id
+        # true if this node dialed the peer, set by the transport
+        self.outbound = False
+        # new blocks this peer was first to deliver, read and reset by Topology.rotate
+        self.deliveries = 0
+        self.max_queue = max_queue
+        self.overflow = overflow
+        # (frame_type, payloads) waiting to be written
+        self.queue = deque()
+        self.depth = 0
+        self.closed = False
+        self.cond = Condition()
+        # metrics
+        self.max_depth = 0
+        self.dropped = 0
+        self.sent_frames = 0
+        self.sent_bytes = 0
+
+    def start(self):
+        writer = Thread(target=self.write)
+        writer.daemon = True
+        writer.start()
+
+    def send(self, frame_type, payloads=()):
+        """
+        Queue a frame for peer, never blocks on the network
+        :param frame_type: one of framing.FRAME_*
+        :param payloads: list of bytes like objects
+        :return: false if frame was not queued because peer is closed or was disconnected
+        """
+        with self.cond:
+            if not self.put(frame_type, payloads):
+                return False
+            self.cond.notify()
+        return True
+
+    def put(self, frame_type, payloads):
+        # a frame counts as many messages as it carries payloads
+        size = max(1, len(payloads))
+        if self.closed:
+            return False
+        if self.depth + size > self.max_queue:
+            if self.overflow == 'disconnect':
+                logging.info("%s: outbound queue full, disconnecting" % self)
+                self.shutdown()
+                return False
+            while self.queue and self.depth + size > self.max_queue:
+                dropped = max(1, len(self.queue.popleft()[1]))
+                self.depth -= dropped
+                self.dropped += dropped
+        self.queue.append((frame_type, payloads))
+        self.depth += size
+        self.max_depth = max(self.max_depth, self.depth)
+        return True
+
+    def take(self):
+        frames, self.queue, self.depth = self.queue, deque(), 0
+        return frames
+
+    def write(self):
+        """
+        Writer thread: send everything queued with one sendmsg per wake-up
+        :return:
+        """
+        while True:
+            with self.cond:
+                while not self.queue and not self.closed:
+                    self.cond.wait()
+                if self.closed:
+                    return
+                frames = self.take()
+            buffers = encode_frames(frames)
+            try:
+                sendmsg_all(self.sock, buffers)
+            except OSError as e:
+                logging.info("%s: send failed: %s" % (self, e))
+                with self.cond:
+                    self.shutdown()
+                return
+            self.sent_frames += len(frames)
+            self.sent_bytes += sum(len(buffer) for buffer in buffers)
+
+    def shutdown(self):
+        # wake the writer and make the receiver see the connection end, it closes the socket
+        self.closed = True
+        self.cond.notify_all()
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def close(self):
+        with self.cond:
+            if not self.closed:
+                self.shutdown()
+        self.sock.close()
+
+    def stats(self):
+        """
+        :return: dict of queue metrics
+        """
+        return {
+            'peer': self.peer_id,
+            'outbound': self.outbound,
+            'depth': self.depth,
+            'max_depth': self.max_depth,
+            'dropped': self.dropped,
+            'sent_frames': self.sent_frames,
+            'sent_bytes': self.sent_bytes,
+            'closed': self.closed,
+        }
+
+    def __str__(self):
+        return str(self.peer_id)
+
+
+class AsyncPeer(Peer):
+    def __init__(self, writer, peer_id=None, max_queue=1000, overflow='drop-oldest'):
+        """
+        Peer connection for the asyncio transport, its queue is drained by a writer task on the node's event loop.
+        Must be created on that loop; sends and closes from other threads are handed over to it.
+        :param writer: stream writer of peer
+        """
+        super().__init__(None, peer_id, max_queue, overflow)
+        writer.get_extra_info('socket').setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.writer = writer
+        self.ready = asyncio.Event()
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread = get_ident()
+
+    def start(self):
+        self.loop.create_task(self.write())
+
+    def send(self, frame_type, payloads=()):
+        if get_ident() != self.loop_thread:
+            # queue and event belong to the loop, e.g. a sync thread answering a peer
+            if self.closed:
+                return False
+            self.loop.call_soon_threadsafe(self.send, frame_type, payloads)
+            return True
+        if not self.put(frame_type, payloads):
+            return False
+        self.ready.set()
+        return True
+
+    async def write(self):
+        """
+        Writer task: write everything queued and wait for the transport to drain before the next batch
+        :return:
+        """
+        try:
+            while not self.closed:
+                await self.ready.wait()
+                self.ready.clear()
+                if self.closed:
+                    break
+                frames = self.take()
+                buffers = encode_frames(frames)
+                self.writer.writelines(buffers)
+                await self.writer.drain()
+                self.sent_frames += len(frames)
+                self.sent_bytes += sum(len(buffer) for buffer in buffers)
+        except ConnectionError as e:
+            logging.info("%s: send failed: %s" % (self, e))
+        finally:
+            self.shutdown()
+
+    def shutdown(self):
+        if get_ident() != self.loop_thread:
+            self.closed = True
+            self.loop.call_soon_threadsafe(self.shutdown)
+            return
+        self.closed = True
+        self.ready.set()
+        self.writer.close()
+
+    def close(self):
+        self.shutdown()
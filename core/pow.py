@@ -0,0 +1,199 @@
+import hashlib
+import multiprocessing
+import os
+import signal
+import struct
+from concurrent.futures import ProcessPoolExecutor
+from threading import Lock
+from time import perf_counter
+
+from .blockchain import NONCE_FORMAT, target_of
+
+NONCE = struct.Struct(NONCE_FORMAT)
+MAX_NONCE = 1 << (8 * NONCE.size)
+# nonces a worker hashes between checks for cancellation
+CHECK_EVERY = 4096
+
+# set in every worker process by init_worker
+_epoch = None
+_worker = None
+_core = None
+
+
+def init_worker(epoch, counter, cores):
+    """
+    Worker process start: keep the shared epoch and pin the worker to its own core
+    :param epoch: shared value bumped by ProofOfWork.abort
+    :param counter: shared value numbering the workers
+    :param cores: list of cores to spread workers over, None to leave affinity alone
+    :return:
+    """
+    global _epoch, _worker, _core
+    # the node handles ctrl-c
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _epoch = epoch
+    with counter.get_lock():
+        _worker = counter.value
+        counter.value += 1
+    _core = _worker
+    if cores:
+        _core = cores[_worker % len(cores)]
+        os.sched_setaffinity(0, {_core})
+
+
+def search(header, start, stop, target, epoch):
+    """
+    Worker: hash header with nonces start to stop - 1 until a digest is below target, giving up early once the
+    shared epoch moved past epoch
+    :return: (nonce or None, hashes done, seconds, worker, core)
+    """
+    started = perf_counter()
+    # hashing state after the header, copied for every nonce
+    prefix = hashlib.sha256(header)
+    pack = NONCE.pack
+    found = None
+    nonce = start
+    while nonce < stop and found is None and _epoch.value == epoch:
+        for nonce in range(nonce, min(nonce + CHECK_EVERY, stop)):
+            digest = prefix.copy()
+            digest.update(pack(nonce))
+            if digest.digest() < target:
+                found = nonce
+                break
+        nonce += 1
+    return found, nonce - start, perf_counter() - started, _worker, _core
+
+
+class ProofOfWork:
+    def __init__(self, difficulty, workers=None, batch=1 << 16):
+        """
+        Nonce search on a pool of worker processes, one per core. A search hands out ranges of batch nonces, two per
+        worker in flight, and is cancelled within CHECK_EVERY hashes per worker when a new block arrives.
+        :param difficulty: leading zero bits of the sha256 digest of a block
+        :param workers: worker processes, one per usable core if None
+        :param batch: nonces per range handed to a worker
+        """
+        if difficulty < 1:
+            raise ValueError("Difficulty must be at least 1 bit, got %r" % difficulty)
+        cores = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else None
+        self.difficulty = difficulty
+        self.target = target_of(difficulty)
+        self.workers = workers or (len(cores) if cores else os.cpu_count() or 1)
+        self.batch = batch
+        self.cores = cores
+        # forkserver and spawn start workers from a clean process, fork would copy the node's threads' locks
+        methods = multiprocessing.get_all_start_methods()
+        self.context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+        self.epoch = self.context.Value('Q', 0, lock=False)
+        self.pool = None
+        self.closed = False
+        # batch results are recorded on the pool's management thread
+        self.lock = Lock()
+        # worker -> [core, hashes, seconds busy]
+        self.per_worker = {}
+        self.searches = 0
+        self.found = 0
+        self.cancelled = 0
+        self.exhausted = 0
+
+    def start(self):
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(self.workers, mp_context=self.context, initializer=init_worker,
+                                            initargs=(self.epoch, self.context.Value('i', 0), self.cores))
+        return self.pool
+
+    def search(self, header, cond, cancelled):
+        """
+        Search a nonce for header until one meets the target, all nonces were tried, or cancelled() turns true
+        :param header: packed HEADER_FORMAT
+        :param cond: Condition notified when cancelled() may have turned true, finished ranges notify it as well
+        :param cancelled: callable, called with cond held
+        :return: nonce or None, also once closed
+        """
+        if self.closed:
+            return None
+        pool = self.start()
+        epoch = self.epoch.value
+        self.searches += 1
+        in_flight = set()
+        next_nonce = 0
+
+        def done(future):
+            if not future.cancelled() and future.exception() is None:
+                self.record(*future.result()[1:])
+            with cond:
+                cond.notify_all()
+
+        with cond:
+            while True:
+                if self.closed:
+                    return None
+                if cancelled():
+                    self.cancelled += 1
+                    self.abort(in_flight)
+                    return None
+                for future in [future for future in in_flight if future.done()]:
+                    in_flight.discard(future)
+                    nonce = None if future.cancelled() else future.result()[0]
+                    if nonce is not None:
+                        self.found += 1
+                        self.abort(in_flight)
+                        return nonce
+                while len(in_flight) < 2 * self.workers and next_nonce < MAX_NONCE:
+                    try:
+                        future = pool.submit(search, header, next_nonce, min(next_nonce + self.batch, MAX_NONCE),
+                                             self.target, epoch)
+                    except RuntimeError:
+                        # the pool was shut down, by close or at interpreter exit, or broke: no more searches
+                        self.closed = True
+                        return None
+                    next_nonce += self.batch
+                    in_flight.add(future)
+                    future.add_done_callback(done)
+                if not in_flight:
+                    self.exhausted += 1
+                    return None
+                cond.wait()
+
+    def abort(self, in_flight):
+        # running ranges see the new epoch, queued ones never start
+        self.epoch.value += 1
+        for future in in_flight:
+            future.cancel()
+
+    def record(self, hashes, seconds, worker, core):
+        with self.lock:
+            totals = self.per_worker.setdefault(worker, [core, 0, 0.0])
+            totals[1] += hashes
+            totals[2] += seconds
+
+    def close(self):
+        self.closed = True
+        if self.pool is not None:
+            # running ranges stop within CHECK_EVERY hashes, a node process exits without joining its workers
+            self.epoch.value += 1
+            self.pool.shutdown(wait=True, cancel_futures=True)
+            self.pool = None
+
+    def stats(self):
+        """
+        :return: dict of search counters and hashes per second of every core while its workers were searching
+        """
+        per_core = {}
+        with self.lock:
+            for core, hashes, seconds in sorted(self.per_worker.values()):
+                totals = per_core.setdefault(str(core), {'hashes': 0, 'hashrate': 0.0})
+                totals['hashes'] += hashes
+                # workers sharing a core each get a part of its time
+                totals['hashrate'] += hashes / seconds if seconds else 0.0
+        return {
+            'difficulty': self.difficulty,
+            'workers': self.workers,
+            'searches': self.searches,
+            'found': self.found,
+            'cancelled': self.cancelled,
+            'exhausted': self.exhausted,
+            'hashes': sum(core['hashes'] for core in per_core.values()),
+            'hashrate': sum(core['hashrate'] for core in per_core.values()),
+            'per_core': per_core,
+        }
@@ -1,20 +1,61 @@
+import asyncio
+import os
+import struct
 import sys
 import socket
-import pickle
+import random
 import signal
 import logging
+from collections import OrderedDict
+from threading import Event
+from time import monotonic, perf_counter
+
+from .framing import FRAME_HEARTBEAT, FRAME_PEERS, FRAME_REGISTER, HEADER, PEER_RECORD, decode_peers, encode_frame
+from .metrics import Metrics
+
+# membership file: magic, number of peer records that follow
+MEMBERSHIP_HEADER = struct.Struct('<8sI')
+MEMBERSHIP_MAGIC = b'GOSSIPMB'
 
 
 class Seed:
-    def __init__(self, ip, port):
+    def __init__(self, ip, port, stats_port=None, stats_interval=None, sample=32, backlog=1024, timeout=10.0,
+                 lease=30.0, membership_file='membership.bin'):
         """
         Create a seed node
         :param ip: ip address of seed
         :param port: port number of seed
+        :param stats_port: if set, serve metrics as json on http://127.0.0.1:<stats_port>/
+        :param stats_interval: if set, write metrics to stats_<port>.json every stats_interval seconds
+        :param sample: max peers returned to a registering client, a random sample of the client list
+        :param backlog: listen backlog, registrations arrive in bursts when a cluster starts
+        :param timeout: seconds a client has to send its registration
+        :param lease: seconds a client stays in the client list without a heartbeat
+        :param membership_file: where stop saves the client list and resume loads it from
         """
         self.ip = ip
         self.port = int(port)
         self.client_list = {}
+        # encoded peer record of every client, sampled for replies, and position of each client in it
+        self.records = []
+        self.positions = {}
+        # peer_id -> lease deadline, in deadline order since every renewal moves a client to the end
+        self.expires = OrderedDict()
+        self.lease = lease
+        self.membership_file = membership_file
+        # reply with every client, rebuilt only after the client list changes
+        self.response = None
+        self.sample = sample
+        self.backlog = backlog
+        self.timeout = timeout
+        self.loop = None
+        self.closing = None
+        # set once the seed accepts registrations
+        self.ready = Event()
+        self.stats_port = stats_port
+        self.stats_interval = stats_interval
+        self.metrics = Metrics({'node': "%s:%d" % (self.ip, self.port), 'role': 'seed'})
+        self.metrics.gauge('clients', lambda: len(self.client_list))
         self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.server.bind((self.ip, self.port))
@@ -22,23 +63,123 @@ class Seed:
 
     def start(self):
         """
-        Start seed node listen to address <ip:port>
+        Start seed node listen to address <ip:port>, returns once stopped
         :return:
         """
-        self.server.listen(5)
+        if self.stats_port is not None:
+            self.metrics.serve(self.stats_port)
+        if self.stats_interval:
+            self.metrics.write_periodically("stats_%d.json" % self.port, self.stats_interval)
+        asyncio.run(self.run())
+
+    async def run(self):
+        self.loop = asyncio.get_running_loop()
+        self.closing = self.loop.create_future()
+        server = await asyncio.start_server(self.register, sock=self.server, backlog=self.backlog)
+        self.ready.set()
+        pruner = self.loop.create_task(self.prune_periodically())
         logging.info("Seed listening at: %s" % self)
+        async with server:
+            await self.closing
+        pruner.cancel()
+
+    async def register(self, reader, writer):
+        """
+        Serve one client: reply to its registration with a sample of the client list and add it to the list, then
+        renew its lease on every heartbeat until it disconnects or stays silent for a whole lease
+        :param reader: stream reader of client
+        :param writer: stream writer of client
+        :return:
+        """
+        start = perf_counter()
+        timeout = self.timeout
+        try:
+            while True:
+                frame_type, length = HEADER.unpack(await asyncio.wait_for(reader.readexactly(HEADER.size), timeout))
+                if frame_type not in (FRAME_REGISTER, FRAME_HEARTBEAT) or length != PEER_RECORD.size:
+                    logging.warning("Bad frame %d from %s" % (frame_type, writer.get_extra_info('peername')))
+                    return
+                record = await asyncio.wait_for(reader.readexactly(length), timeout)
+                (peer_id, client), = decode_peers(record).items()
+                self.prune()
+                if frame_type == FRAME_REGISTER:
+                    logging.info("New Client: %s" % peer_id)
+                    # send client-list to new client
+                    writer.writelines(encode_frame(FRAME_PEERS, [self.peers_for(peer_id)]))
+                    await writer.drain()
+                    self.metrics.inc('registrations')
+                    self.metrics.observe('registration_time', perf_counter() - start)
+                else:
+                    self.metrics.inc('heartbeats')
+                self.renew(peer_id, client, record)
+                timeout = self.lease
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError) as e:
+            logging.info("Connection from %s closed: %r" % (writer.get_extra_info('peername'), e))
+        finally:
+            writer.close()
+
+    def renew(self, peer_id, client, record):
+        """
+        Extend the lease of a client, adding it to the client list if it is not there
+        """
+        if peer_id in self.client_list:
+            self.expires.move_to_end(peer_id)
+        else:
+            self.client_list[peer_id] = client
+            self.positions[peer_id] = len(self.records)
+            self.records.append(record)
+            self.response = None
+        self.expires[peer_id] = monotonic() + self.lease
+
+    def remove(self, peer_id):
+        del self.client_list[peer_id]
+        del self.expires[peer_id]
+        # move the last record into the hole so removal is O(1)
+        position = self.positions.pop(peer_id)
+        last = self.records.pop()
+        if position < len(self.records):
+            self.records[position] = last
+            (last_id, _), = decode_peers(last).items()
+            self.positions[last_id] = position
+        self.response = None
+
+    def prune(self):
+        """
+        Drop clients whose lease ran out, oldest deadline first
+        :return: number of clients dropped
+        """
+        now = monotonic()
+        pruned = 0
+        while self.expires:
+            peer_id, deadline = next(iter(self.expires.items()))
+            if deadline > now:
+                break
+            self.remove(peer_id)
+            logging.info("Lease of %s expired" % peer_id)
+            pruned += 1
+        if pruned:
+            self.metrics.inc('expired', pruned)
+        return pruned
+
+    async def prune_periodically(self):
         while True:
-            client_socket, address = self.server.accept()
-            message = client_socket.recv(4096).decode('utf-8')
-            client = message.split(":")
-            client = (client[0], int(client[1]))
-            logging.info("New Client: %s" % message)
-            # send client-list to new client
-            client_socket.send(pickle.dumps(self.client_list))
-            # check if client is not in client list add
-            if message not in self.client_list.keys():
-                self.client_list[message] = client
-            client_socket.close()
+            await asyncio.sleep(self.lease / 4)
+            self.prune()
+
+    def peers_for(self, peer_id):
+        """
+        Encoded peer records to send a registering client
+        :param peer_id: "ip:port" of client, left out of a sampled reply
+        :return: bytes
+        """
+        if len(self.records) <= self.sample:
+            if self.response is None:
+                self.response = b''.join(self.records)
+            return self.response
+        position = self.positions.get(peer_id)
+        own = self.records[position] if position is not None else None
+        sample = [record for record in random.sample(self.records, self.sample + 1) if record != own]
+        return b''.join(sample[:self.sample])
 
     def stop(self, signum, frame):
         """
@@ -47,17 +188,48 @@ class Seed:
         :param frame:
         :return:
         """
-        self.server.close()
-        with open('client_list.pkl', 'wb') as f:
-            pickle.dump(self.client_list, f)
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.close)
+        self.save()
+
+    def save(self):
+        """
+        Write the client list to membership_file as packed peer records
+        :return:
+        """
+        records = list(self.records)
+        temporary = "%s.tmp" % self.membership_file
+        with open(temporary, 'wb') as f:
+            f.write(MEMBERSHIP_HEADER.pack(MEMBERSHIP_MAGIC, len(records)))
+            f.write(b''.join(records))
+        os.replace(temporary, self.membership_file)
+
+    def load(self):
+        """
+        Read the client list saved by save, every client gets a fresh lease to renew it
+        :return:
+        """
+        with open(self.membership_file, 'rb') as f:
+            data = f.read()
+        magic, count = MEMBERSHIP_HEADER.unpack_from(data)
+        if magic != MEMBERSHIP_MAGIC:
+            raise ValueError("Unsupported membership file %s" % self.membership_file)
+        records = data[MEMBERSHIP_HEADER.size:MEMBERSHIP_HEADER.size + count * PEER_RECORD.size]
+        for offset in range(0, len(records), PEER_RECORD.size):
+            record = records[offset:offset + PEER_RECORD.size]
+            (peer_id, client), = decode_peers(record).items()
+            self.renew(peer_id, client, record)
+
+    def close(self):
+        if not self.closing.done():
+            self.closing.set_result(None)
 
     def resume(self):
         """
         Start a seed node with previous client-list
         :return:
         """
-        with open('client_list.pkl', 'rb') as f:
-            self.client_list = pickle.load(f)
+        self.load()
         self.start()
 
     def __str__(self):
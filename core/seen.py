@@ -0,0 +1,226 @@
+import hashlib
+import math
+import time
+from collections import OrderedDict
+
+from .locks import InstrumentedLock, merge_lock_stats
+
+
+class BloomFilter:
+    def __init__(self, capacity, error_rate=1e-6):
+        """
+        Two generation Bloom filter, the older generation is dropped once the newer one is full
+        :param capacity: messages per generation
+        :param error_rate: false positive rate at capacity
+        """
+        self.capacity = capacity
+        self.n_bits = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.n_hashes = max(1, round(self.n_bits / capacity * math.log(2)))
+        self.current = bytearray((self.n_bits + 7) // 8)
+        self.previous = bytearray(len(self.current))
+        self.count = 0
+        self.rotations = 0
+
+    def positions(self, message):
+        digest = hashlib.blake2b(message, digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.n_bits for i in range(self.n_hashes)]
+
+    def __contains__(self, message):
+        positions = self.positions(message)
+        for bits in (self.current, self.previous):
+            if all(bits[p >> 3] & (1 << (p & 7)) for p in positions):
+                return True
+        return False
+
+    def add(self, message):
+        if self.count >= self.capacity:
+            self.rotate()
+        bits = self.current
+        for p in self.positions(message):
+            bits[p >> 3] |= 1 << (p & 7)
+        self.count += 1
+
+    def rotate(self):
+        self.previous = self.current
+        self.current = bytearray(len(self.previous))
+        self.count = 0
+        self.rotations += 1
+
+    @property
+    def size(self):
+        """
+        Memory used by both generations in bytes
+        """
+        return len(self.current) + len(self.previous)
+
+
+class SeenCache:
+    def __init__(self, capacity=100000, ttl=3600, bloom_capacity=None, bloom_error_rate=1e-6, clock=time.monotonic):
+        """
+        Bounded set of seen messages with LRU and TTL eviction
+        :param capacity: max messages remembered exactly
+        :param ttl: seconds a message is remembered after it was last seen, None to never expire
+        :param bloom_capacity: if set, messages are also recorded in a rotating Bloom filter of this many
+            messages per generation, so messages evicted from the exact cache for capacity are still recognised.
+            Expired and discarded messages are not, as long as they are among the last capacity ones forgotten.
+        :param bloom_error_rate: false positive rate of Bloom filter
+        :param clock: time source
+        """
+        self.capacity = capacity
+        self.ttl = ttl
+        self.clock = clock
+        # message -> time last seen, oldest first
+        self.entries = OrderedDict()
+        self.bloom = BloomFilter(bloom_capacity, bloom_error_rate) if bloom_capacity else None
+        # expired and discarded messages the Bloom filter can't delete, oldest first, at most capacity of them
+        self.forgotten = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.bloom_hits = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __contains__(self, message):
+        """
+        Check if message was seen, without recording it
+        :param message: bytes
+        :return: true if seen
+        """
+        if self.bloom is not None and message not in self.bloom:
+            self.misses += 1
+            return False
+        seen_at = self.entries.get(message)
+        if seen_at is not None:
+            if self.ttl is None or self.clock() - seen_at <= self.ttl:
+                self.hits += 1
+                return True
+        elif self.bloom is not None and message not in self.forgotten:
+            # evicted for capacity, the Bloom filter still remembers it
+            self.bloom_hits += 1
+            return True
+        self.misses += 1
+        return False
+
+    def add(self, message):
+        """
+        Record message as seen
+        :param message: bytes
+        :return: true if message was not seen before
+        """
+        new = message not in self
+        now = self.clock()
+        self.entries[message] = now
+        self.entries.move_to_end(message)
+        if new and self.bloom is not None:
+            self.bloom.add(message)
+            self.forgotten.pop(message, None)
+        self.evict(now)
+        return new
+
+    def discard(self, message):
+        """
+        Forget a message so it is accepted again, e.g. an orphan block dropped before its parent arrived
+        :param message: bytes
+        :return:
+        """
+        self.entries.pop(message, None)
+        self.forget(message)
+
+    def forget(self, message):
+        # the Bloom filter still holds message, don't trust it for this one
+        if self.bloom is not None:
+            self.forgotten[message] = True
+            if len(self.forgotten) > self.capacity:
+                self.forgotten.popitem(last=False)
+
+    def evict(self, now):
+        """
+        Drop expired messages and least recently seen ones above capacity, only the latter stay in the Bloom filter
+        :param now: current time
+        :return:
+        """
+        entries = self.entries
+        if self.ttl is not None:
+            while entries and now - next(iter(entries.values())) > self.ttl:
+                message, _ = entries.popitem(last=False)
+                self.forget(message)
+                self.expirations += 1
+        while len(entries) > self.capacity:
+            entries.popitem(last=False)
+            self.evictions += 1
+
+    def __len__(self):
+        return len(self.entries)
+
+    def stats(self):
+        """
+        :return: dict of cache counters
+        """
+        stats = {
+            'size': len(self.entries),
+            'capacity': self.capacity,
+            'hits': self.hits,
+            'misses': self.misses,
+            'bloom_hits': self.bloom_hits,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+        }
+        if self.bloom is not None:
+            stats['bloom_bytes'] = self.bloom.size
+            stats['bloom_rotations'] = self.bloom.rotations
+        return stats
+
+
+class StripedSeenCache:
+    def __init__(self, stripes=16, capacity=100000, ttl=3600, bloom_capacity=None, bloom_error_rate=1e-6,
+                 clock=time.monotonic):
+        """
+        Thread safe SeenCache split into stripes with a lock each, so concurrent receivers rarely wait on each other
+        :param stripes: number of independent stripes
+        :param capacity: max messages remembered exactly, shared evenly by stripes
+        Other parameters are those of SeenCache, Bloom capacity is shared evenly by stripes too
+        """
+        self.stripes = [
+            SeenCache(max(1, capacity // stripes), ttl, bloom_capacity and max(1, bloom_capacity // stripes),
+                      bloom_error_rate, clock)
+            for _ in range(stripes)
+        ]
+        self.locks = [InstrumentedLock() for _ in range(stripes)]
+
+    def __contains__(self, message):
+        stripe = hash(message) % len(self.stripes)
+        with self.locks[stripe]:
+            return message in self.stripes[stripe]
+
+    def add(self, message):
+        """
+        Record message as seen
+        :param message: bytes
+        :return: true if message was not seen before
+        """
+        stripe = hash(message) % len(self.stripes)
+        with self.locks[stripe]:
+            return self.stripes[stripe].add(message)
+
+    def discard(self, message):
+        stripe = hash(message) % len(self.stripes)
+        with self.locks[stripe]:
+            self.stripes[stripe].discard(message)
+
+    def __len__(self):
+        return sum(len(stripe) for stripe in self.stripes)
+
+    def stats(self):
+        """
+        :return: dict of cache counters summed over stripes
+        """
+        stats = {}
+        for stripe in self.stripes:
+            for key, value in stripe.stats().items():
+                stats[key] = stats.get(key, 0) + value
+        return stats
+
+    def lock_stats(self):
+        return merge_lock_stats(lock.stats() for lock in self.locks)
@@ -0,0 +1,307 @@
+import argparse
+import heapq
+import json
+import random
+import time
+from collections import deque
+
+import numpy
+
+from .blockchain import Blockhain
+from .dissemination import STRATEGIES, Dissemination
+from .orphans import OrphanPool
+
+# event kinds, mining sorts before delivery at the same instant
+MINE = 0
+DELIVER = 1
+# a node's round of a periodic dissemination strategy
+ROUND = 2
+# a rumor receiver answers that it already had the block
+FEEDBACK = 3
+# a push-pull summary of recent blocks arrives
+SUMMARY = 4
+
+
+class SimNode:
+    def __init__(self, node_id, hash_power, inter_arrival_time, clock, seed, dissemination):
+        """
+        A gossip node on the simulator's virtual clock
+        :param node_id: index of node
+        :param hash_power: share of network hash power
+        :param inter_arrival_time: network block interval in seconds
+        :param clock: virtual clock returning epoch seconds
+        :param seed: seed of node's own RNG
+        :param dissemination: dict of Dissemination arguments
+        """
+        self.node_id = node_id
+        self.client_lambda = hash_power*(1.0/inter_arrival_time)
+        self.rng = numpy.random.RandomState(seed)
+        self.messages = set()
+        self.block_chain = Blockhain(clock=clock, rng=self.rng, orphans=OrphanPool(clock=clock,
+                                                                                   on_evict=self.messages.discard))
+        # neighbor id -> link latency in seconds
+        self.neighbors = {}
+        # bumped whenever the mining timer is reset, stale mine events are ignored
+        self.mining_epoch = 0
+        self.dissemination = Dissemination(rng=random.Random(seed), **dissemination)
+        # blocks compared in push-pull rounds
+        self.recent = deque(maxlen=self.dissemination.window)
+        self.round_scheduled = False
+
+    def mining_timer(self):
+        return self.rng.exponential(1.0/self.client_lambda)
+
+
+class Simulator:
+    def __init__(self, n_nodes, hash_power=None, inter_arrival_time=600, latency=0.1, peers_per_node=2, seed=0,
+                 dissemination='flood', fanout=3, stop_probability=0.25, gossip_interval=1.0, active_rounds=10):
+        """
+        Discrete event simulator of a gossip network running Blockhain and the mining model of Client.mine
+        :param n_nodes: number of nodes
+        :param hash_power: list of hash power shares per node, equal shares if None
+        :param inter_arrival_time: network block interval in seconds
+        :param latency: link latency in seconds, a number, a (low, high) range drawn per link,
+            or a callable(rng, node_a, node_b) returning the latency of a link
+        :param peers_per_node: peers each node dials from the nodes that joined before it, as Client.start does
+        :param seed: seed of topology, latencies and per node RNG seeds
+        :param dissemination: one of dissemination.STRATEGIES, how nodes spread blocks
+        :param fanout: neighbors a block is pushed to at a time by 'push' and 'rumor'
+        :param stop_probability: chance that 'rumor' stops spreading a block when a neighbor already had it
+        :param gossip_interval: virtual seconds between rounds of 'rumor' and 'push-pull'
+        :param active_rounds: rounds a 'push-pull' node keeps sending summaries after its last new block
+        """
+        if hash_power is None:
+            hash_power = [1.0 / n_nodes] * n_nodes
+        if len(hash_power) != n_nodes:
+            raise ValueError("Expected %d hash power shares, got %d" % (n_nodes, len(hash_power)))
+        self.rng = numpy.random.RandomState(seed)
+        self.start_time = float(int(time.time()))
+        self.now = 0.0
+        self.events = []
+        self.sequence = 0
+        options = {'strategy': dissemination, 'fanout': fanout, 'stop_probability': stop_probability,
+                   'interval': gossip_interval, 'active_rounds': active_rounds}
+        self.nodes = [
+            SimNode(i, hash_power[i], inter_arrival_time, self.clock, self.rng.randint(0, 2**31 - 1), options)
+            for i in range(n_nodes)
+        ]
+        for node in self.nodes[1:]:
+            k = min(peers_per_node, node.node_id)
+            for peer_id in self.rng.choice(node.node_id, size=k, replace=False):
+                self.connect(node.node_id, int(peer_id), self.link_latency(latency, node.node_id, int(peer_id)))
+        # block -> (virtual time mined, miner, delays until each node received it)
+        self.blocks = {}
+        self.delivered = 0
+        # feedback, summaries, inv and getdata messages of the periodic strategies
+        self.control = 0
+        self.rejected = 0
+        self.orphans = 0
+
+    def clock(self):
+        return self.start_time + self.now
+
+    def link_latency(self, latency, a, b):
+        if callable(latency):
+            return float(latency(self.rng, a, b))
+        if isinstance(latency, (tuple, list)):
+            return float(self.rng.uniform(*latency))
+        return float(latency)
+
+    def connect(self, a, b, latency):
+        self.nodes[a].neighbors[b] = latency
+        self.nodes[b].neighbors[a] = latency
+
+    def schedule(self, delay, kind, node_id, data=None):
+        heapq.heappush(self.events, (self.now + delay, kind, self.sequence, node_id, data))
+        self.sequence += 1
+
+    def restart_miner(self, node):
+        node.mining_epoch += 1
+        self.schedule(node.mining_timer(), MINE, node.node_id, node.mining_epoch)
+
+    def broadcast(self, node, block, origin):
+        dissemination = node.dissemination
+        rumor = dissemination.strategy == 'rumor'
+        for neighbor in dissemination.targets(list(node.neighbors), origin, block):
+            self.schedule(node.neighbors[neighbor], DELIVER, neighbor, (block, node.node_id, rumor))
+        if rumor:
+            self.schedule_round(node)
+
+    def schedule_round(self, node):
+        if not node.round_scheduled:
+            node.round_scheduled = True
+            self.schedule(node.dissemination.interval, ROUND, node.node_id)
+
+    def round(self, node):
+        """
+        A round of 'rumor' or 'push-pull' on node, the next one is scheduled while there is something to do
+        """
+        node.round_scheduled = False
+        dissemination = node.dissemination
+        if dissemination.strategy == 'rumor':
+            for neighbor, blocks in dissemination.rumor_round(list(node.neighbors)).items():
+                for block in blocks:
+                    self.schedule(node.neighbors[neighbor], DELIVER, neighbor, (block, node.node_id, True))
+            if dissemination.hot:
+                self.schedule_round(node)
+        else:
+            partner = dissemination.partner(list(node.neighbors))
+            if partner is not None:
+                self.control += 1
+                self.schedule(node.neighbors[partner], SUMMARY, partner, (list(node.recent), node.node_id))
+            self.schedule_round(node)
+
+    def summary(self, node, blocks, sender):
+        """
+        Push-pull summary of sender's recent blocks arrives at node: node fetches the blocks it lacks and announces
+        the recent blocks sender didn't list, which sender then fetches
+        """
+        latency = node.neighbors[sender]
+        wanted = [block for block in blocks if block not in node.messages]
+        if wanted:
+            # getdata to sender, blocks back
+            self.control += 1
+            for block in wanted:
+                self.schedule(2 * latency, DELIVER, node.node_id, (block, sender, False))
+        listed = set(blocks)
+        missing = [block for block in node.recent if block not in listed]
+        if missing:
+            # inv to sender, getdata back, blocks to sender
+            self.control += 2
+            for block in missing:
+                self.schedule(3 * latency, DELIVER, sender, (block, node.node_id, False))
+
+    def mine(self, node, epoch):
+        if epoch != node.mining_epoch:
+            # timer was reset by a new block
+            return
+        block = node.block_chain.generate_block()
+        node.messages.add(block)
+        node.recent.append(block)
+        self.blocks[block] = (self.now, node.node_id, [0.0])
+        self.broadcast(node, block, None)
+        self.restart_miner(node)
+
+    def deliver(self, node, block, origin, rumor):
+        self.delivered += 1
+        if block in node.messages:
+            if rumor:
+                node.dissemination.has(block, origin)
+                self.control += 1
+                self.schedule(node.neighbors[origin], FEEDBACK, origin, (block, node.node_id))
+            return
+        node.messages.add(block)
+        self.blocks[block][2].append(self.now - self.blocks[block][0])
+        connected = []
+        valid_block, new_block = node.block_chain.verify_and_add_block(block, connected)
+        if new_block:
+            self.restart_miner(node)
+        if valid_block:
+            node.recent.append(block)
+            node.recent.extend(connected)
+            self.broadcast(node, block, origin)
+            for orphan in connected:
+                self.broadcast(node, orphan, None)
+        elif block in node.block_chain.orphans:
+            self.orphans += 1
+        else:
+            self.rejected += 1
+
+    def run(self, duration, settle=None):
+        """
+        Mine on every node for duration virtual seconds, then let blocks in flight arrive
+        :param duration: virtual seconds of mining
+        :param settle: virtual seconds push-pull rounds go on after mining stopped, 30 rounds if None
+        :return: dict of stats
+        """
+        if settle is None:
+            settle = 30 * self.nodes[0].dissemination.interval
+        for node in self.nodes:
+            self.restart_miner(node)
+            if node.dissemination.strategy == 'push-pull':
+                self.schedule_round(node)
+        while self.events:
+            at, kind, _, node_id, data = heapq.heappop(self.events)
+            if kind == MINE and at > duration or kind == ROUND and at > duration + settle:
+                continue
+            self.now = at
+            node = self.nodes[node_id]
+            if kind == MINE:
+                self.mine(node, data)
+            elif kind == DELIVER:
+                self.deliver(node, *data)
+            elif kind == ROUND:
+                self.round(node)
+            elif kind == FEEDBACK:
+                node.dissemination.known(*data)
+            else:
+                self.summary(node, *data)
+        return self.stats()
+
+    def stats(self):
+        """
+        Fork rate and stale blocks as seen by node 0, propagation delay over all blocks
+        :return: dict of stats
+        """
+        chain = self.nodes[0].block_chain.stats()
+        total_blocks = chain['total_blocks']
+        forks = sum(1 for blocks in self.nodes[0].block_chain.block_chain if len(blocks) > 1)
+        n_nodes = len(self.nodes)
+        delays = [delays for _, _, delays in self.blocks.values()]
+        all_delays = numpy.concatenate(delays) if delays else numpy.zeros(0)
+        full = [max(d) for d in delays if len(d) == n_nodes]
+        blocks_mined = len(self.blocks)
+        stats = {
+            'nodes': n_nodes,
+            'dissemination': self.nodes[0].dissemination.strategy,
+            'virtual_time': self.now,
+            'blocks_mined': len(self.blocks),
+            'total_blocks': total_blocks,
+            'longest_chain': chain['main_chain_length'],
+            'stale_blocks': chain['stale_blocks'],
+            'orphaned_branches': chain['orphaned_branches'],
+            'fork_heights': forks,
+            'fork_rate': chain['stale_blocks'] / total_blocks if total_blocks else 0.0,
+            'messages_delivered': self.delivered,
+            'control_messages': self.control,
+            # share of (block, node) pairs that arrived, against block messages sent per block
+            'coverage': sum(map(len, delays)) / (blocks_mined * n_nodes) if blocks_mined else None,
+            'messages_per_block': self.delivered / blocks_mined if blocks_mined else None,
+            'blocks_rejected': self.rejected,
+            'orphans_received': self.orphans,
+            'fully_propagated': len(full),
+        }
+        if len(all_delays):
+            stats.update({
+                'delay_mean': float(all_delays.mean()),
+                'delay_p50': float(numpy.percentile(all_delays, 50)),
+                'delay_p90': float(numpy.percentile(all_delays, 90)),
+                'delay_p99': float(numpy.percentile(all_delays, 99)),
+                'full_propagation_mean': float(numpy.mean(full)) if full else None,
+            })
+        return stats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Simulate a gossip network on a virtual clock")
+    parser.add_argument('--nodes', type=int, default=100)
+    parser.add_argument('--duration', type=float, default=3600, help="virtual seconds of mining")
+    parser.add_argument('--inter-arrival-time', type=float, default=600)
+    parser.add_argument('--latency', type=float, nargs='+', default=[0.05, 0.5], help="seconds, or low high range")
+    parser.add_argument('--peers', type=int, default=2, help="peers dialed per node")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--dissemination', choices=STRATEGIES, default='flood')
+    parser.add_argument('--fanout', type=int, default=3)
+    parser.add_argument('--stop-probability', type=float, default=0.25)
+    parser.add_argument('--gossip-interval', type=float, default=1.0, help="virtual seconds between rounds")
+    parser.add_argument('--active-rounds', type=int, default=10, help="push-pull rounds after a node's last new block")
+    args = parser.parse_args()
+    latency = args.latency[0] if len(args.latency) == 1 else tuple(args.latency[:2])
+    started = time.time()
+    simulator = Simulator(args.nodes, inter_arrival_time=args.inter_arrival_time, latency=latency,
+                          peers_per_node=args.peers, seed=args.seed, dissemination=args.dissemination,
+                          fanout=args.fanout, stop_probability=args.stop_probability,
+                          gossip_interval=args.gossip_interval, active_rounds=args.active_rounds)
+    stats = simulator.run(args.duration)
+    stats['wall_time'] = time.time() - started
+    print(json.dumps(stats, indent=2))
@@ -0,0 +1,132 @@
+import hashlib
+import struct
+
+from .blockchain import BLOCK_SIZE
+
+# cell: signed count, xor of keys, xor of key checksums
+CELL = struct.Struct('!i%dsI' % BLOCK_SIZE)
+SKETCH_HASHES = 3
+
+
+def key_of(block):
+    return int.from_bytes(block, 'big')
+
+
+def block_of(key):
+    return key.to_bytes(BLOCK_SIZE, 'big')
+
+
+def digest(blocks):
+    """
+    Order independent digest of a set of blocks, equal sets give equal digests
+    :param blocks: iterable of blocks
+    :return: 64 bit int
+    """
+    value = 0
+    for block in blocks:
+        value ^= key_of(block)
+    # fold the xor of keys into 64 bits
+    folded = 0
+    while value:
+        folded ^= value & 0xffffffffffffffff
+        value >>= 64
+    return folded
+
+
+class Sketch:
+    def __init__(self, cells):
+        """
+        Invertible Bloom lookup table of blocks, a block is its own key. Subtracting a peer's sketch of the same size
+        cancels the blocks both have, decoding the rest yields the blocks only one side has, as long as there are not
+        many more than cells / 2 of them.
+        :param cells: number of cells, rounded up to a multiple of SKETCH_HASHES
+        """
+        cells = max(SKETCH_HASHES, -(-cells // SKETCH_HASHES) * SKETCH_HASHES)
+        self.counts = [0] * cells
+        self.keys = [0] * cells
+        self.checks = [0] * cells
+
+    @classmethod
+    def of(cls, blocks, cells):
+        sketch = cls(cells)
+        for block in blocks:
+            sketch.add(block)
+        return sketch
+
+    @classmethod
+    def decode(cls, payload):
+        """
+        :param payload: bytes like, cells back to back as written by encode
+        :return: Sketch
+        :raise ValueError: if payload is not a whole number of cells that encode could have written
+        """
+        cells = len(payload) // CELL.size
+        if not cells or cells % SKETCH_HASHES or len(payload) % CELL.size:
+            raise ValueError("Sketch of %d bytes is not a multiple of %d cells of %d bytes"
+                             % (len(payload), SKETCH_HASHES, CELL.size))
+        sketch = cls(cells)
+        for i, (count, key, check) in enumerate(CELL.iter_unpack(payload)):
+            sketch.counts[i], sketch.keys[i], sketch.checks[i] = count, key_of(key), check
+        return sketch
+
+    def encode(self):
+        return b''.join(CELL.pack(count, block_of(key), check)
+                        for count, key, check in zip(self.counts, self.keys, self.checks))
+
+    def positions(self, key):
+        """
+        One cell in each of SKETCH_HASHES equal parts of the table, and the key's checksum
+        """
+        digest = hashlib.blake2b(block_of(key), digest_size=16).digest()
+        part = len(self.counts) // SKETCH_HASHES
+        cells = [i * part + int.from_bytes(digest[4 * i:4 * i + 4], 'big') % part for i in range(SKETCH_HASHES)]
+        return cells, int.from_bytes(digest[12:], 'big')
+
+    def toggle(self, key, count):
+        cells, check = self.positions(key)
+        for cell in cells:
+            self.counts[cell] += count
+            self.keys[cell] ^= key
+            self.checks[cell] ^= check
+
+    def add(self, block):
+        self.toggle(key_of(block), 1)
+
+    def subtract(self, other):
+        """
+        :param other: Sketch of the same size
+        :return: new Sketch holding blocks of self minus blocks of other
+        """
+        if len(other.counts) != len(self.counts):
+            raise ValueError("Can't subtract a sketch of %d cells from one of %d"
+                             % (len(other.counts), len(self.counts)))
+        difference = Sketch(len(self.counts))
+        difference.counts = [a - b for a, b in zip(self.counts, other.counts)]
+        difference.keys = [a ^ b for a, b in zip(self.keys, other.keys)]
+        difference.checks = [a ^ b for a, b in zip(self.checks, other.checks)]
+        return difference
+
+    def pure(self, cell):
+        if self.counts[cell] not in (1, -1):
+            return False
+        cells, check = self.positions(self.keys[cell])
+        return check == self.checks[cell] and cell in cells
+
+    def peel(self):
+        """
+        Decode a difference of sketches, emptying it
+        :return: (blocks only in the minuend, blocks only in the subtrahend), or None if too many blocks differ
+        """
+        ours, theirs = [], []
+        queue = [cell for cell in range(len(self.counts)) if self.pure(cell)]
+        while queue:
+            cell = queue.pop()
+            if not self.pure(cell):
+                continue
+            key, count = self.keys[cell], self.counts[cell]
+            (ours if count == 1 else theirs).append(block_of(key))
+            self.toggle(key, -count)
+            queue.extend(self.positions(key)[0])
+        if any(self.counts) or any(self.keys):
+            return None
+        return ours, theirs
@@ -0,0 +1,441 @@
+import glob
+import logging
+import mmap
+import os
+import struct
+from threading import Event, Lock, Thread
+
+import numpy
+
+from .blockchain import BLOCK_FORMAT, BLOCK_SIZE
+
+# snapshot header: magic, version, block size, first wal segment not covered by the snapshot, block count, branch
+# count
+SNAPSHOT_HEADER = struct.Struct('<8sHHIQQ')
+SNAPSHOT_MAGIC = b'GOSSIPCS'
+SNAPSHOT_VERSION = 2
+# snapshot arrays after the header, widest first so each is aligned, all but index hold one item per block in height
+# order: position of the parent (NO_PARENT after genesis), positions sorted by block bytes, position of the block
+# indexed for each 16 bit hash (NO_PARENT if none), height, hash, 1 if the block has a child, block
+SNAPSHOT_ARRAYS = (('parents', '<i8'), ('order', '<i8'), ('index', '<i8'), ('heights', '<u4'), ('hashes', '<u2'),
+                   ('children', 'u1'), ('blocks', 'V%d' % BLOCK_SIZE))
+INDEX_SIZE = 1 << 16
+NO_PARENT = -1
+# wal segment header: magic, version, block size, then wal records: height, block
+WAL_HEADER = struct.Struct('<8sHH')
+WAL_MAGIC = b'GOSSIPWL'
+WAL_VERSION = 1
+WAL_RECORD = struct.Struct('<I%ds' % BLOCK_SIZE)
+
+
+class Snapshot:
+    def __init__(self, data, path):
+        """
+        Arrays of a snapshot, read in place from a memory map
+        :param data: snapshot file contents
+        :param path: snapshot file, for errors
+        """
+        magic, version, block_size, self.segment, count, self.forks = SNAPSHOT_HEADER.unpack_from(data)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION or block_size != BLOCK_SIZE:
+            raise ValueError("Unsupported snapshot %s" % path)
+        offset = SNAPSHOT_HEADER.size
+        for name, dtype in SNAPSHOT_ARRAYS:
+            array = numpy.frombuffer(data, dtype=dtype, count=INDEX_SIZE if name == 'index' else count, offset=offset)
+            setattr(self, name, array)
+            offset += array.nbytes
+        self.levels = int(self.heights[-1]) + 1 if count else 0
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def position(self, block):
+        """
+        :param block: bytes
+        :return: position of block, None if it is not in the snapshot
+        """
+        if not len(self.blocks) or len(block) != BLOCK_SIZE:
+            return None
+        i = int(numpy.searchsorted(self.blocks, numpy.void(bytes(block)), sorter=self.order))
+        if i < len(self.order):
+            position = int(self.order[i])
+            if self.blocks[position].tobytes() == block:
+                return position
+        return None
+
+    def entry(self, position):
+        """
+        :return: (hash, height, parent block or None) of the block at position, as in Blockhain.blocks
+        """
+        parent = int(self.parents[position])
+        return (int(self.hashes[position]), int(self.heights[position]),
+                None if parent == NO_PARENT else self.blocks[parent].tobytes())
+
+    def level(self, height):
+        """
+        :return: list of blocks stored at height
+        """
+        start, stop = numpy.searchsorted(self.heights, [height, height + 1])
+        return self.blocks[start:stop].tolist()
+
+    def iter_levels(self):
+        block_list = self.blocks.tolist()
+        starts = (numpy.flatnonzero(numpy.diff(self.heights)) + 1).tolist()
+        for start, stop in zip([0] + starts, starts + [len(block_list)]):
+            yield block_list[start:stop]
+
+    def block_index(self):
+        """
+        :return: dict of hash -> indexed block, as in Blockhain.block_index
+        """
+        hashes = numpy.flatnonzero(self.index != NO_PARENT)
+        return dict(zip(hashes.tolist(), self.blocks[self.index[hashes]].tolist()))
+
+
+class StoredBlocks:
+    def __init__(self, snapshot):
+        """
+        Blockhain.blocks of a restored chain: blocks added after the snapshot are kept in a dict, the snapshot's are
+        looked up in it on access
+        :param snapshot: Snapshot
+        """
+        self.snapshot = snapshot
+        self.added = {}
+
+    def get(self, block, default=None):
+        entry = self.added.get(block)
+        if entry is not None:
+            return entry
+        position = self.snapshot.position(block)
+        return default if position is None else self.snapshot.entry(position)
+
+    def __getitem__(self, block):
+        entry = self.get(block)
+        if entry is None:
+            raise KeyError(block)
+        return entry
+
+    def __setitem__(self, block, entry):
+        self.added[block] = entry
+
+    def __contains__(self, block):
+        return self.get(block) is not None
+
+    def __len__(self):
+        return len(self.snapshot) + len(self.added)
+
+    def items(self):
+        """
+        Blocks added after the snapshot, in insertion order
+        """
+        return self.added.items()
+
+
+class StoredLevels:
+    def __init__(self, snapshot):
+        """
+        Blockhain.block_chain of a restored chain: a level of the snapshot becomes a list once it is accessed, so
+        blocks can be appended to it
+        :param snapshot: Snapshot
+        """
+        self.snapshot = snapshot
+        # height -> list, snapshot levels accessed so far
+        self.loaded = {}
+        # levels above the snapshot
+        self.above = []
+
+    def __len__(self):
+        return self.snapshot.levels + len(self.above)
+
+    def __getitem__(self, height):
+        if isinstance(height, slice):
+            return [self[height] for height in range(*height.indices(len(self)))]
+        if height < 0:
+            height += len(self)
+        if not 0 <= height < len(self):
+            raise IndexError(height)
+        if height >= self.snapshot.levels:
+            return self.above[height - self.snapshot.levels]
+        level = self.loaded.get(height)
+        if level is None:
+            level = self.loaded[height] = self.snapshot.level(height)
+        return level
+
+    def __iter__(self):
+        # read once, levels walked over are not kept
+        for height, level in enumerate(self.snapshot.iter_levels()):
+            yield self.loaded.get(height, level)
+        for level in self.above:
+            yield level
+
+    def append(self, level):
+        self.above.append(level)
+
+
+class StoredExtended:
+    def __init__(self, snapshot):
+        """
+        Blockhain.extended of a restored chain
+        :param snapshot: Snapshot
+        """
+        self.snapshot = snapshot
+        self.added = set()
+
+    def __contains__(self, parent):
+        if parent in self.added:
+            return True
+        if parent is None:
+            # blocks at height 0 extend genesis
+            return bool(len(self.snapshot))
+        position = self.snapshot.position(parent)
+        return position is not None and bool(self.snapshot.children[position])
+
+    def add(self, parent):
+        self.added.add(parent)
+
+
+def snapshot_arrays(base, added, block_index):
+    """
+    Arrays of a new snapshot: the blocks of base followed by blocks added after it, sorted by height
+    :param base: Snapshot the chain was restored from, None if none
+    :param added: list of (block, (hash, height, parent)) in insertion order
+    :param block_index: dict of hash -> indexed block
+    :return: dict of SNAPSHOT_ARRAYS name -> array
+    """
+    offset = len(base) if base is not None else 0
+    count = offset + len(added)
+    positions = {block: offset + i for i, (block, _) in enumerate(added)}
+
+    def position(block):
+        found = positions.get(block)
+        return found if found is not None else base.position(block)
+
+    arrays = {
+        'blocks': numpy.frombuffer(b''.join(block for block, _ in added), dtype='V%d' % BLOCK_SIZE),
+        'hashes': numpy.fromiter((entry[0] for _, entry in added), dtype='<u2', count=len(added)),
+        'heights': numpy.fromiter((entry[1] for _, entry in added), dtype='<u4', count=len(added)),
+        'parents': numpy.fromiter((NO_PARENT if entry[2] is None else position(entry[2]) for _, entry in added),
+                                  dtype='<i8', count=len(added)),
+    }
+    if base is not None:
+        arrays = {name: numpy.concatenate([getattr(base, name), array]) for name, array in arrays.items()}
+    # stable, so a height keeps the snapshot's blocks first and added ones in insertion order, as its level does
+    by_height = numpy.argsort(arrays['heights'], kind='stable')
+    rank = numpy.empty(count, dtype='<i8')
+    rank[by_height] = numpy.arange(count)
+    arrays = {name: array[by_height] for name, array in arrays.items()}
+    parents = arrays['parents']
+    arrays['parents'] = numpy.where(parents == NO_PARENT, NO_PARENT, rank[parents])
+    arrays['children'] = numpy.zeros(count, dtype='u1')
+    arrays['children'][arrays['parents'][arrays['parents'] != NO_PARENT]] = 1
+    arrays['order'] = numpy.argsort(arrays['blocks'], kind='stable').astype('<i8')
+    arrays['index'] = numpy.full(INDEX_SIZE, NO_PARENT, dtype='<i8')
+    for block_hash, block in block_index.items():
+        arrays['index'][block_hash] = rank[position(block)]
+    return arrays
+
+
+class ChainStore:
+    def __init__(self, directory, snapshot_interval=10000, sync=False):
+        """
+        On disk block-chain: an append only write-ahead log of added blocks and a periodic snapshot of every block
+        in height order with the chain's indexes. On restart the snapshot is memory mapped and its blocks are looked
+        up in place, then only the log written since the last snapshot is replayed, so startup time is bounded by
+        the snapshot interval rather than chain length.
+        :param directory: directory of snapshot and wal.<segment> files, created if missing
+        :param snapshot_interval: blocks appended to the log before a new snapshot is written in the background
+        :param sync: fsync the log after every flush, else it is only flushed to the OS
+        """
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.snapshot_path = os.path.join(directory, 'snapshot')
+        self.snapshot_interval = snapshot_interval
+        self.sync = sync
+        self.segment = None
+        self.wal = None
+        # records logged under the chain lock, written by flush once it is released
+        self.pending = []
+        self.appended = 0
+        self.lock = Lock()
+        self.block_chain = None
+        self.snapshot_wanted = Event()
+        self.snapshots = 0
+
+    def wal_path(self, segment):
+        return os.path.join(self.directory, 'wal.%d' % segment)
+
+    def open_segment(self, segment):
+        """
+        Create a wal segment and write its header
+        :return: file open for appending
+        """
+        wal = open(self.wal_path(segment), 'ab')
+        if wal.tell() == 0:
+            wal.write(WAL_HEADER.pack(WAL_MAGIC, WAL_VERSION, BLOCK_SIZE))
+            wal.flush()
+        return wal
+
+    def wal_segments(self):
+        segments = []
+        for path in glob.glob(os.path.join(self.directory, 'wal.*')):
+            suffix = path.rsplit('.', 1)[1]
+            if suffix.isdigit():
+                segments.append(int(suffix))
+        return sorted(segments)
+
+    def open(self, block_chain):
+        """
+        Load the stored chain into block_chain and start logging its new blocks
+        :param block_chain: empty Blockhain
+        :return: number of blocks loaded
+        """
+        last_segment = self.load(block_chain)
+        loaded = len(block_chain.blocks)
+        # never append after a possibly torn record, start a fresh segment
+        self.segment = last_segment + 1
+        self.wal = self.open_segment(self.segment)
+        self.block_chain = block_chain
+        block_chain.store = self
+        writer = Thread(target=self.write_snapshots)
+        writer.daemon = True
+        writer.start()
+        logging.info("Loaded %d blocks from %s" % (loaded, self.directory))
+        return loaded
+
+    def load(self, block_chain):
+        """
+        Load the stored chain into block_chain without logging, e.g. to inspect a node's data directory
+        :param block_chain: empty Blockhain
+        :return: last wal segment replayed, one less than the first segment after the snapshot if none
+        """
+        first_segment = self.load_snapshot(block_chain)
+        segments = [segment for segment in self.wal_segments() if segment >= first_segment]
+        for segment in segments:
+            self.replay(block_chain, segment)
+        return max(segments + [first_segment - 1])
+
+    def load_snapshot(self, block_chain):
+        """
+        Memory map the snapshot and restore block_chain from it, only its hash index is loaded
+        :return: first wal segment written after the snapshot
+        """
+        if not os.path.exists(self.snapshot_path):
+            return 0
+        with open(self.snapshot_path, 'rb') as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        snapshot = Snapshot(data, self.snapshot_path)
+        block_chain.restore(StoredBlocks(snapshot), StoredLevels(snapshot), StoredExtended(snapshot),
+                            snapshot.block_index(), snapshot.forks)
+        return snapshot.segment
+
+    def replay(self, block_chain, segment):
+        """
+        Add the blocks of a wal segment missing from block_chain, a torn last record is ignored
+        """
+        with open(self.wal_path(segment), 'rb') as f:
+            data = f.read()
+        if len(data) < WAL_HEADER.size:
+            # created just before a crash, no header means no records either
+            return
+        magic, version, block_size = WAL_HEADER.unpack_from(data)
+        if magic != WAL_MAGIC or version != WAL_VERSION or block_size != BLOCK_SIZE:
+            raise ValueError("Unsupported wal segment %s" % self.wal_path(segment))
+        data = data[WAL_HEADER.size:]
+        for height, block in WAL_RECORD.iter_unpack(data[:len(data) - len(data) % WAL_RECORD.size]):
+            if block in block_chain.blocks:
+                continue
+            if height > len(block_chain.block_chain):
+                logging.warning("Skipping block at height %d past chain of %d in %s"
+                                % (height, len(block_chain.block_chain), self.wal_path(segment)))
+                continue
+            # replayed in insertion order, so the index finds the same parent it did when the block was added
+            parent = block_chain.block_index.get(struct.unpack(BLOCK_FORMAT, block)[0]) if height else None
+            block_chain.add_block(block, parent, height)
+
+    def append(self, block, height):
+        """
+        Log a block, called by Blockhain.add_block with its lock held so the log keeps insertion order. The record is
+        only buffered, Blockhain calls flush after releasing its lock.
+        :param block: block bytes
+        :param height: height of block
+        :return:
+        """
+        with self.lock:
+            if self.wal is None:
+                return
+            self.pending.append(WAL_RECORD.pack(height, block))
+            self.appended += 1
+            if self.appended >= self.snapshot_interval:
+                self.appended = 0
+                self.snapshot_wanted.set()
+
+    def flush(self):
+        """
+        Write the buffered records to the log with one write, and fsync it if sync is set
+        :return:
+        """
+        with self.lock:
+            self.write_pending()
+
+    def write_pending(self):
+        """
+        Write the buffered records, caller holds lock
+        """
+        if self.wal is None or not self.pending:
+            return
+        self.wal.write(b''.join(self.pending))
+        self.pending = []
+        self.wal.flush()
+        if self.sync:
+            os.fsync(self.wal.fileno())
+
+    def write_snapshots(self):
+        while True:
+            self.snapshot_wanted.wait()
+            self.snapshot_wanted.clear()
+            try:
+                self.snapshot()
+            except OSError as e:
+                logging.warning("Failed to write snapshot to %s: %s" % (self.snapshot_path, e))
+
+    def snapshot(self):
+        """
+        Write a snapshot of the chain and drop the log segments it covers. The chain lock is held only to copy the
+        blocks added since the chain was restored, the hash index, and to switch to a new log segment.
+        :return: number of blocks in snapshot
+        """
+        block_chain = self.block_chain
+        with block_chain.lock:
+            blocks = block_chain.blocks
+            base = blocks.snapshot if isinstance(blocks, StoredBlocks) else None
+            added = list(blocks.items())
+            block_index = dict(block_chain.block_index)
+            forks = block_chain.forks
+            with self.lock:
+                # records of blocks in the snapshot stay in the segment it covers
+                self.write_pending()
+                self.wal.close()
+                self.segment += 1
+                segment = self.segment
+                self.wal = self.open_segment(segment)
+        arrays = snapshot_arrays(base, added, block_index)
+        count = len(arrays['blocks'])
+        temporary = "%s.tmp" % self.snapshot_path
+        with open(temporary, 'wb') as f:
+            f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, BLOCK_SIZE, segment, count, forks))
+            for name, dtype in SNAPSHOT_ARRAYS:
+                f.write(arrays[name].astype(dtype, copy=False).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.snapshot_path)
+        for old in self.wal_segments():
+            if old < segment:
+                os.remove(self.wal_path(old))
+        self.snapshots += 1
+        return count
+
+    def close(self):
+        with self.lock:
+            if self.wal is not None:
+                self.write_pending()
+                self.wal.close()
+                self.wal = None
@@ -0,0 +1,244 @@
+import logging
+import queue
+import struct
+import time
+from collections import deque
+from threading import Event, Thread
+
+from .blockchain import BLOCK_SIZE
+from .framing import FRAME_GET_RANGE, FRAME_GET_STATUS, FRAME_RANGE, FRAME_STATUS
+
+# status: height of tip (-1 for an empty chain), tip hash, 1 if the node is mining
+STATUS = struct.Struct('!iHB')
+# range request and reply header: lowest and highest height, a reply is followed by records
+RANGE = struct.Struct('!ii')
+# range record: height and block
+RANGE_RECORD = struct.Struct('!I%ds' % BLOCK_SIZE)
+
+
+def encode_range(block_chain, low, high, max_blocks):
+    """
+    Records of the blocks stored at heights low to high, cut at a whole height once max_blocks is reached
+    :return: RANGE payload: header with the heights actually served, then records
+    """
+    records = []
+    with block_chain.lock:
+        high = min(high, len(block_chain.block_chain) - 1)
+        served = low - 1
+        for height in range(max(0, low), high + 1):
+            level = block_chain.block_chain[height]
+            if records and len(records) + len(level) > max_blocks:
+                break
+            records.extend(RANGE_RECORD.pack(height, block) for block in level)
+            served = height
+    return RANGE.pack(low, served) + b''.join(records)
+
+
+def decode_range(payload):
+    """
+    :return: (low, high, list of (height, block) in height order)
+    """
+    low, high = RANGE.unpack_from(payload)
+    records = [(height, block) for height, block in RANGE_RECORD.iter_unpack(payload[RANGE.size:])]
+    return low, high, records
+
+
+class ChainSync:
+    def __init__(self, client, batch=500, pipeline=4, status_timeout=2.0, request_timeout=5.0, max_timeouts=3,
+                 rewind=64):
+        """
+        Catch a joining client up with its neighbors before it mines: ask every neighbor for its tip, then pull the
+        missing heights in ranges of batch heights, up to pipeline requests in flight per neighbor ahead of this
+        node, and add each range to the chain in one lock hold as soon as all heights below it are in
+        :param client: Client
+        :param batch: heights per range request
+        :param pipeline: range requests in flight per neighbor
+        :param status_timeout: seconds to wait for neighbors' tips
+        :param request_timeout: seconds before a range is asked from another neighbor
+        :param max_timeouts: times a neighbor may let its ranges time out before it is no longer asked, also when it
+            is the only one left, so a neighbor that stays connected but never answers doesn't stall the sync
+        :param rewind: heights below its own tip a node fetches again, so a restarted node whose tip is on a stale
+            fork gets the neighbors' branch from below the fork; a deeper fork is retried with 4 times the rewind
+        """
+        self.client = client
+        self.batch = batch
+        self.rewind = rewind
+        self.pipeline = pipeline
+        self.status_timeout = status_timeout
+        self.request_timeout = request_timeout
+        self.max_timeouts = max_timeouts
+        # replies handed over by receivers: ('status', connection, payload) or ('range', connection, payload)
+        self.replies = queue.Queue()
+        # set once caught up, the miner waits for it
+        self.synced = Event()
+        self.target = -1
+        self.ranges = 0
+        self.retries = 0
+        self.rewinds = 0
+        self.blocks_added = 0
+        self.blocks_rejected = 0
+        self.started = None
+        self.duration = None
+
+    def start(self):
+        thread = Thread(target=self.run)
+        thread.daemon = True
+        thread.start()
+
+    def on_get_status(self, origin):
+        client = self.client
+        with client.block_chain.lock:
+            height = len(client.block_chain.block_chain) - 1
+            tip_hash = client.block_chain.tip_hash
+        client.transport.send_to(origin, FRAME_STATUS, [STATUS.pack(height, tip_hash, int(client.mining))])
+
+    def on_get_range(self, payload, origin):
+        low, high = RANGE.unpack_from(payload)
+        self.client.transport.send_to(origin, FRAME_RANGE, [encode_range(self.client.block_chain, low, high,
+                                                                         self.batch * 4)])
+
+    def on_status(self, payload, origin):
+        self.replies.put(('status', origin, bytes(payload)))
+
+    def on_range(self, payload, origin):
+        self.replies.put(('range', origin, bytes(payload)))
+
+    def run(self):
+        """
+        Sync thread: fetch the history, then let the miner start if the network is mining
+        :return:
+        """
+        client = self.client
+        self.started = time.time()
+        try:
+            self.sync()
+        except Exception as e:
+            logging.warning("%s: sync failed: %r" % (client, e))
+        self.duration = time.time() - self.started
+        logging.info("%s: synced to height %d in %.2f s" % (client, len(client.block_chain.block_chain) - 1,
+                                                           self.duration))
+        self.synced.set()
+        client.start_miner()
+
+    def statuses(self, neighbors):
+        """
+        Ask neighbors for their tip and wait until all answered or status_timeout passed
+        :return: dict of connection -> height
+        """
+        client = self.client
+        client.transport.send(FRAME_GET_STATUS, [], None, neighbors)
+        heights = {}
+        deadline = time.time() + self.status_timeout
+        while len(heights) < len(neighbors):
+            try:
+                kind, connection, payload = self.replies.get(timeout=max(0.0, deadline - time.time()))
+            except queue.Empty:
+                break
+            if kind != 'status':
+                continue
+            height, _, mining = STATUS.unpack(payload)
+            heights[connection] = height
+            if mining:
+                # START-MN went out before this node joined
+                client.mining = True
+        return heights
+
+    def sync(self):
+        client = self.client
+        neighbors = [connection for connection in list(client.connections) if not connection.closed]
+        if not neighbors:
+            return
+        heights = self.statuses(neighbors)
+        height = len(client.block_chain.block_chain) - 1
+        self.target = max(list(heights.values()) + [height])
+        sources = [connection for connection, peer_height in heights.items() if peer_height > height]
+        rewind = self.rewind
+        while sources:
+            low = max(0, height + 1 - rewind)
+            rejected = self.blocks_rejected
+            self.fetch(low, sources)
+            # blocks above a fork deeper than the rewind have no parent here
+            if len(client.block_chain.block_chain) - 1 >= self.target or self.blocks_rejected == rejected or low == 0:
+                return
+            self.rewinds += 1
+            rewind *= 4
+            logging.info("%s: fork below height %d, fetching again from height %d" % (
+                client, low, max(0, height + 1 - rewind)))
+
+    def fetch(self, next_height, sources):
+        """
+        Pull heights next_height to target from sources, pipelined
+        :param next_height: lowest height fetched
+        :param sources: list of connections ahead of this node, the ones that fail are removed
+        :return:
+        """
+        # connection -> times its ranges timed out
+        timeouts = {}
+        client = self.client
+        # ranges still to ask for, lowest first, and ranges asked: low -> (high, connection, time asked)
+        todo = deque((low, min(low + self.batch - 1, self.target)) for low in range(next_height, self.target + 1,
+                                                                                    self.batch))
+        asked = {}
+        # ranges received above the next height to add: low -> (high, records)
+        received = {}
+        while next_height <= self.target and sources:
+            for connection in list(sources):
+                in_flight = sum(1 for _, asker, _ in asked.values() if asker is connection)
+                while in_flight < self.pipeline and todo:
+                    low, high = todo.popleft()
+                    asked[low] = (high, connection, time.time())
+                    client.transport.send(FRAME_GET_RANGE, [RANGE.pack(low, high)], None, [connection])
+                    in_flight += 1
+            try:
+                kind, connection, payload = self.replies.get(timeout=self.request_timeout)
+            except queue.Empty:
+                kind = None
+            now = time.time()
+            if kind == 'range':
+                low, served, records = decode_range(payload)
+                if low in asked and asked[low][1] is connection:
+                    high = asked.pop(low)[0]
+                    self.ranges += 1
+                    if served < high:
+                        # neighbor has less than it said, or cut the reply short
+                        todo.appendleft((served + 1, high))
+                    if served >= low:
+                        received[low] = (served, records)
+                    elif connection in sources:
+                        # doesn't have the heights it claimed
+                        sources.remove(connection)
+            # take ranges of slow or gone neighbors away from them
+            slow = set()
+            for low, (high, asker, at) in list(asked.items()):
+                if asker.closed or now - at > self.request_timeout:
+                    del asked[low]
+                    todo.appendleft((low, high))
+                    self.retries += 1
+                    slow.add(asker)
+            for asker in slow:
+                timeouts[asker] = timeouts.get(asker, 0) + 1
+                if asker in sources and (len(sources) > 1 or timeouts[asker] >= self.max_timeouts):
+                    sources.remove(asker)
+                    logging.info("%s: no longer syncing from %s" % (client, asker))
+            sources[:] = [connection for connection in sources if not connection.closed]
+            while next_height in received:
+                high, records = received.pop(next_height)
+                added, rejected = client.block_chain.add_range(records)
+                self.blocks_added += added
+                self.blocks_rejected += rejected
+                next_height = high + 1
+
+    def stats(self):
+        """
+        :return: dict of sync counters
+        """
+        return {
+            'synced': self.synced.is_set(),
+            'target_height': self.target,
+            'ranges': self.ranges,
+            'retries': self.retries,
+            'rewinds': self.rewinds,
+            'blocks_added': self.blocks_added,
+            'blocks_rejected': self.blocks_rejected,
+            'duration': self.duration,
+        }
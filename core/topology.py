@@ -0,0 +1,221 @@
+import hashlib
+import logging
+import random
+import time
+from threading import Lock, Thread
+
+# how peers to dial are ordered: uniformly at random; at random with both in-degree and out-degree capped at
+# out_degree so every node ends up with about 2 * out_degree links; or the nearest peers on a hash ring plus some
+# random long links
+STRATEGIES = ('random', 'random-regular', 'small-world')
+
+
+def ring_position(peer_id):
+    """
+    Position of a peer on the small-world ring, the same on every node
+    :param peer_id: "ip:port" of peer
+    :return: 64 bit int
+    """
+    return int.from_bytes(hashlib.blake2b(peer_id.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+class Topology:
+    def __init__(self, client, strategy='random', out_degree=2, max_in_degree=None, rewire=0.2,
+                 maintain_interval=5.0, retry_interval=30.0, rotate_interval=60.0, min_deliveries=10):
+        """
+        Keep a client's neighbor set at its target degree: dial peers picked by strategy, re-dial when connections
+        drop and rotate out the outbound peer that is slowest to deliver new blocks
+        :param client: Client whose connections are managed
+        :param strategy: one of STRATEGIES
+        :param out_degree: outbound connections to keep
+        :param max_in_degree: inbound connections accepted, out_degree for 'random-regular' and unlimited otherwise
+            if None
+        :param rewire: 'small-world' only, chance that a link goes to a random peer instead of a ring neighbor
+        :param maintain_interval: seconds between checks of the neighbor set
+        :param retry_interval: seconds before a peer that failed or dropped is dialed again
+        :param rotate_interval: seconds between rotations of the worst outbound peer, None to never rotate
+        :param min_deliveries: new blocks that must arrive over outbound peers in a rotation interval before their
+            first-delivery counts are trusted
+        """
+        if strategy not in STRATEGIES:
+            raise ValueError("Unknown topology %r, expected one of %s" % (strategy, ", ".join(STRATEGIES)))
+        if max_in_degree is None and strategy == 'random-regular':
+            max_in_degree = out_degree
+        self.client = client
+        self.strategy = strategy
+        self.out_degree = out_degree
+        self.max_in_degree = max_in_degree
+        self.rewire = rewire
+        self.maintain_interval = maintain_interval
+        self.retry_interval = retry_interval
+        self.rotate_interval = rotate_interval
+        self.min_deliveries = min_deliveries
+        # peer_id -> (ip, port) of every peer learnt from the seed
+        self.candidates = {}
+        # peer_id -> time it failed to connect or was dropped
+        self.failed = {}
+        self.position = ring_position(client.peer_id)
+        # fill runs on start and on the maintenance thread
+        self.lock = Lock()
+        self.last_rotation = time.time()
+        # connections dropped by rotate, replaced once the transport has removed them
+        self.rotated = set()
+        self.dials = 0
+        self.dial_failures = 0
+        self.refused = 0
+        self.rotations = 0
+        self.refreshes = 0
+
+    def update(self, peers):
+        """
+        Add peers fetched from the seed to the candidates
+        :param peers: dict of peer_id -> (ip, port)
+        :return:
+        """
+        for peer_id, peer in peers.items():
+            # the seed may list a restarted client itself
+            if peer_id != self.client.peer_id:
+                self.candidates[peer_id] = peer
+
+    def neighbors(self, outbound=None):
+        """
+        :param outbound: True or False to count only outbound or inbound connections, None for both
+        :return: list of open connections
+        """
+        return [connection for connection in list(self.client.connections)
+                if not connection.closed and (outbound is None or connection.outbound == outbound)]
+
+    def rank(self):
+        """
+        Candidates to dial next, in the strategy's order, without connected and recently failed peers
+        :return: list of (peer_id, (ip, port))
+        """
+        connected = set(connection.peer_id for connection in self.neighbors())
+        now = time.time()
+        available = [(peer_id, peer) for peer_id, peer in self.candidates.items()
+                     if peer_id not in connected and now - self.failed.get(peer_id, -self.retry_interval)
+                     >= self.retry_interval]
+        if self.strategy != 'small-world':
+            random.shuffle(available)
+            return available
+        # walk the ring clockwise from this node, each link may be rewired to a random peer
+        available.sort(key=lambda candidate: (ring_position(candidate[0]) - self.position) % (1 << 64))
+        ranked = []
+        while available:
+            index = random.randrange(len(available)) if random.random() < self.rewire else 0
+            ranked.append(available.pop(index))
+        return ranked
+
+    def fill(self):
+        """
+        Dial ranked candidates until out_degree outbound connections are open or candidates run out. With
+        'random-regular', outbound connections beyond out_degree are closed, newest first.
+        :return: number of connections opened
+        """
+        with self.lock:
+            outbound = self.neighbors(outbound=True)
+            missing = self.out_degree - len(outbound)
+            if missing < 0 and self.strategy == 'random-regular':
+                for connection in outbound[missing:]:
+                    logging.info("%s: dropping %s above out-degree %d" % (self.client, connection, self.out_degree))
+                    self.client.transport.disconnect(connection)
+            dialed = 0
+            for peer_id, peer in self.rank():
+                if dialed >= missing:
+                    break
+                self.dials += 1
+                if self.client.transport.dial(peer_id, peer) is None:
+                    self.dial_failures += 1
+                    self.failed[peer_id] = time.time()
+                else:
+                    dialed += 1
+            return dialed
+
+    def accept_inbound(self):
+        """
+        :return: false if an incoming connection would exceed max_in_degree
+        """
+        if self.max_in_degree is not None and len(self.neighbors(outbound=False)) >= self.max_in_degree:
+            self.refused += 1
+            return False
+        return True
+
+    def disconnected(self, connection):
+        """
+        Called by the transport once a connection ended and was removed, a dropped outbound peer is not dialed again
+        right away. A peer dropped by rotate is replaced now, in a thread as the transport's receive loop must not
+        block on a dial.
+        :param connection: Peer
+        :return:
+        """
+        if connection.outbound and connection.peer_id is not None:
+            self.failed[connection.peer_id] = time.time()
+        if connection in self.rotated:
+            self.rotated.discard(connection)
+            thread = Thread(target=self.fill)
+            thread.daemon = True
+            thread.start()
+
+    def start(self):
+        thread = Thread(target=self.maintain)
+        thread.daemon = True
+        thread.start()
+
+    def maintain(self):
+        """
+        Maintenance thread: re-dial dropped peers, fetch fresh candidates from the seed when they run out and
+        rotate the worst outbound peer
+        :return:
+        """
+        client = self.client
+        while True:
+            time.sleep(self.maintain_interval)
+            try:
+                self.fill()
+                if len(self.neighbors(outbound=True)) < self.out_degree:
+                    self.refreshes += 1
+                    self.update(client.transport.fetch_peers())
+                    self.fill()
+                if self.rotate_interval is not None and time.time() - self.last_rotation >= self.rotate_interval:
+                    self.rotate()
+            except Exception as e:
+                logging.info("%s: topology maintenance failed: %r" % (client, e))
+
+    def rotate(self):
+        """
+        Drop the outbound peer that was first to deliver the fewest new blocks since the last rotation, disconnected
+        dials a new one once the transport has removed it. A peer that is often first is fewer hops from the miners,
+        keeping such peers shortens the paths blocks take to this node.
+        :return: dropped connection or None
+        """
+        self.last_rotation = time.time()
+        outbound = self.neighbors(outbound=True)
+        deliveries = [connection.deliveries for connection in outbound]
+        for connection in outbound:
+            connection.deliveries = 0
+        if len(outbound) < self.out_degree or sum(deliveries) < self.min_deliveries:
+            return None
+        worst = outbound[deliveries.index(min(deliveries))]
+        logging.info("%s: rotating out %s, first for %d of %d blocks" % (self.client, worst, min(deliveries),
+                                                                        sum(deliveries)))
+        self.rotations += 1
+        self.failed[worst.peer_id] = time.time()
+        self.rotated.add(worst)
+        self.client.transport.disconnect(worst)
+        return worst
+
+    def stats(self):
+        """
+        :return: dict of degree and dial counters
+        """
+        return {
+            'strategy': self.strategy,
+            'out_degree': len(self.neighbors(outbound=True)),
+            'in_degree': len(self.neighbors(outbound=False)),
+            'candidates': len(self.candidates),
+            'dials': self.dials,
+            'dial_failures': self.dial_failures,
+            'refused': self.refused,
+            'rotations': self.rotations,
+            'refreshes': self.refreshes,
+        }
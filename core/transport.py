@@ -0,0 +1,395 @@
+import asyncio
+import logging
+import socket
+import struct
+import time
+from threading import Thread, get_ident
+
+from .framing import (FRAME_HEARTBEAT, FRAME_HELLO, FRAME_PEERS, FRAME_REGISTER, HEADER, FrameReader, decode_header,
+                      decode_peers, encode_frame, encode_peer, sendmsg_all)
+from .peer import AsyncPeer, Peer
+
+
+class ThreadTransport:
+    def __init__(self, client):
+        """
+        Peer networking with one OS thread and a blocking socket per peer connection
+        :param client: client node using this transport
+        """
+        self.client = client
+        self.seed_socket = None
+
+    def start(self):
+        """
+        Register with seed, connect to peers and accept incoming peers, never returns
+        :return:
+        """
+        client = self.client
+        client.choose_peers(self.register())
+        self.spawn(self.renew)
+        client.topology.fill()
+        client.topology.start()
+        if client.sync is not None:
+            client.sync.start()
+
+        # listen for peers want to connect, they introduce themselves with a hello frame
+        client.listening_socket.listen(5)
+        client.ready.set()
+        while True:
+            peer_socket, address = client.listening_socket.accept()
+            if not client.topology.accept_inbound():
+                logging.info("%s: refusing %s:%d, in-degree is full" % ((client,) + address))
+                peer_socket.close()
+                continue
+            self.add_peer(peer_socket, None)
+
+    def dial(self, peer_id, peer):
+        """
+        Connect to a peer and introduce this node with a hello frame
+        :param peer_id: "ip:port" of peer
+        :param peer: (ip, port) of peer
+        :return: connection or None if peer can't be reached
+        """
+        client = self.client
+        try:
+            peer_socket = socket.create_connection(peer, timeout=client.connect_timeout)
+        except OSError as e:
+            logging.info("%s: can't connect to %s: %s" % (client, peer_id, e))
+            return None
+        peer_socket.settimeout(None)
+        connection = self.add_peer(peer_socket, peer_id, outbound=True)
+        connection.send(FRAME_HELLO, [bytes(client.peer_id, 'utf-8')])
+        logging.info("%s -> %s" % (client, peer_id))
+        return connection
+
+    def disconnect(self, connection):
+        connection.close()
+
+    def fetch_peers(self):
+        """
+        Register again for a fresh sample of the client-list, replacing the heartbeat connection
+        :return: dict of peer_id -> (ip, port)
+        """
+        old = self.seed_socket
+        peers = self.register()
+        if old is not None:
+            old.close()
+        return peers
+
+    def register(self):
+        """
+        Register with seed and fetch a sample of the client-list, the connection is kept for heartbeats
+        :return: dict of peer_id -> (ip, port)
+        """
+        client = self.client
+        seed_socket = socket.create_connection((client.seed_ip, client.seed_port), timeout=client.connect_timeout)
+        try:
+            sendmsg_all(seed_socket, encode_frame(FRAME_REGISTER, [encode_peer(client.ip, client.port)]))
+            reader = FrameReader()
+            while reader.recv_into(seed_socket):
+                for frame_type, payload in reader.frames():
+                    if frame_type == FRAME_PEERS:
+                        self.seed_socket = seed_socket
+                        return decode_peers(payload)
+        except OSError:
+            seed_socket.close()
+            raise
+        seed_socket.close()
+        raise ConnectionError("Seed %s:%d closed the connection before sending peers"
+                              % (client.seed_ip, client.seed_port))
+
+    def renew(self):
+        """
+        Heartbeat thread: renew the client's lease at the seed, registering again if the connection was lost
+        :return:
+        """
+        client = self.client
+        heartbeat = encode_frame(FRAME_HEARTBEAT, [encode_peer(client.ip, client.port)])
+        while True:
+            time.sleep(client.heartbeat_interval)
+            seed_socket = self.seed_socket
+            try:
+                if seed_socket is None:
+                    self.register()
+                else:
+                    sendmsg_all(seed_socket, heartbeat)
+            except OSError as e:
+                logging.info("%s: lease renewal failed: %s" % (client, e))
+                if seed_socket is not None:
+                    seed_socket.close()
+                    # the topology may have registered again meanwhile
+                    if self.seed_socket is seed_socket:
+                        self.seed_socket = None
+
+    def add_peer(self, peer_socket, peer_id, outbound=False):
+        connection = Peer(peer_socket, peer_id, self.client.peer_queue, self.client.overflow)
+        connection.outbound = outbound
+        connection.start()
+        self.spawn(self.receive, connection)
+        self.client.connections.append(connection)
+        return connection
+
+    def spawn(self, target, *args):
+        thread = Thread(target=target, args=args)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def receive(self, connection):
+        """
+        Receive frames from peer node and hand them to the client until it disconnects
+        :param connection: Peer
+        :return:
+        """
+        reader = FrameReader()
+        try:
+            while reader.recv_into(connection.sock):
+                for frame_type, payload in reader.frames():
+                    if frame_type == FRAME_HELLO:
+                        connection.peer_id = str(payload, 'utf-8')
+                    else:
+                        self.client.handle_frame(connection.peer_id, frame_type, payload, connection)
+        except OSError as e:
+            logging.info("%s: connection to %s failed: %s" % (self.client, connection, e))
+        except (struct.error, ValueError) as e:
+            # a malformed payload, the peer can't be trusted to send anything sensible next
+            logging.info("%s: bad frame from %s: %r" % (self.client, connection, e))
+        logging.info("%s disconnected from %s" % (connection, self.client))
+        if connection in self.client.connections:
+            self.client.connections.remove(connection)
+        connection.close()
+        self.client.topology.disconnected(connection)
+
+    def send(self, frame_type, payloads, origin, targets=None):
+        for connection in list(self.client.connections) if targets is None else targets:
+            # send if peer is not same as where it came from
+            if connection is not origin:
+                self.send_to(connection, frame_type, payloads)
+
+    def send_to(self, connection, frame_type, payloads):
+        connection.send(frame_type, payloads)
+
+    def start_miner(self):
+        self.spawn(self.client.mine)
+
+    def notify_new_block(self):
+        client = self.client
+        with client.new_block_received_cond:
+            client.new_block_received = True
+            client.new_block_received_cond.notify()
+
+
+class AsyncioTransport:
+    def __init__(self, client, backlog=1024):
+        """
+        Peer networking with one event loop per node and a stream reader/writer per peer connection
+        :param client: client node using this transport
+        :param backlog: listen backlog for incoming peers
+        """
+        self.client = client
+        self.backlog = backlog
+        self.loop = None
+        self.loop_thread = None
+        self.new_block_received = None
+        self.seed_writer = None
+
+    def start(self):
+        """
+        Run the node's event loop, never returns
+        :return:
+        """
+        asyncio.run(self.run())
+
+    async def run(self):
+        client = self.client
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread = get_ident()
+        self.new_block_received = asyncio.Event()
+        client.choose_peers(await self.register())
+        self.loop.create_task(self.renew())
+        # the topology dials from another thread, connect runs on this loop meanwhile
+        await self.loop.run_in_executor(None, client.topology.fill)
+
+        # listen for peers want to connect
+        server = await asyncio.start_server(self.accept, sock=client.listening_socket, backlog=self.backlog)
+        client.ready.set()
+        client.topology.start()
+        if client.sync is not None:
+            client.sync.start()
+        async with server:
+            await server.serve_forever()
+
+    async def connect(self, peer_id, peer):
+        """
+        Connect to a peer and introduce this node with a hello frame
+        :param peer_id: "ip:port" of peer
+        :param peer: (ip, port) of peer
+        :return: connection or None if peer can't be reached
+        """
+        client = self.client
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(*peer), client.connect_timeout)
+        except (OSError, asyncio.TimeoutError) as e:
+            logging.info("%s: can't connect to %s: %r" % (client, peer_id, e))
+            return None
+        connection = self.add_peer(writer, peer_id, outbound=True)
+        connection.send(FRAME_HELLO, [bytes(client.peer_id, 'utf-8')])
+        self.loop.create_task(self.receive(reader, connection))
+        logging.info("%s -> %s" % (client, peer_id))
+        return connection
+
+    def dial(self, peer_id, peer):
+        """
+        connect, for callers outside the event loop
+        """
+        return asyncio.run_coroutine_threadsafe(self.connect(peer_id, peer), self.loop).result()
+
+    def disconnect(self, connection):
+        self.loop.call_soon_threadsafe(connection.close)
+
+    def fetch_peers(self):
+        """
+        Register again for a fresh sample of the client-list, for callers outside the event loop
+        :return: dict of peer_id -> (ip, port)
+        """
+        return asyncio.run_coroutine_threadsafe(self.refresh(), self.loop).result()
+
+    async def refresh(self):
+        old = self.seed_writer
+        peers = await self.register()
+        if old is not None:
+            old.close()
+        return peers
+
+    async def register(self):
+        """
+        Register with seed and fetch a sample of the client-list, the connection is kept for heartbeats
+        :return: dict of peer_id -> (ip, port)
+        """
+        client = self.client
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(client.seed_ip, client.seed_port),
+                                                client.connect_timeout)
+        try:
+            writer.writelines(encode_frame(FRAME_REGISTER, [encode_peer(client.ip, client.port)]))
+            while True:
+                frame_type, length = decode_header(await reader.readexactly(HEADER.size))
+                payload = await reader.readexactly(length)
+                if frame_type == FRAME_PEERS:
+                    self.seed_writer = writer
+                    return decode_peers(payload)
+        except BaseException:
+            writer.close()
+            raise
+
+    async def renew(self):
+        """
+        Heartbeat task: renew the client's lease at the seed, registering again if the connection was lost
+        :return:
+        """
+        client = self.client
+        heartbeat = encode_frame(FRAME_HEARTBEAT, [encode_peer(client.ip, client.port)])
+        while True:
+            await asyncio.sleep(client.heartbeat_interval)
+            seed_writer = self.seed_writer
+            try:
+                if seed_writer is None:
+                    await self.register()
+                else:
+                    seed_writer.writelines(heartbeat)
+                    await seed_writer.drain()
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+                logging.info("%s: lease renewal failed: %r" % (client, e))
+                if seed_writer is not None:
+                    seed_writer.close()
+                    # the topology may have registered again meanwhile
+                    if self.seed_writer is seed_writer:
+                        self.seed_writer = None
+
+    def add_peer(self, writer, peer_id, outbound=False):
+        connection = AsyncPeer(writer, peer_id, self.client.peer_queue, self.client.overflow)
+        connection.outbound = outbound
+        connection.start()
+        self.client.connections.append(connection)
+        return connection
+
+    async def accept(self, reader, writer):
+        if not self.client.topology.accept_inbound():
+            logging.info("%s: refusing %s, in-degree is full" % (self.client, writer.get_extra_info('peername')))
+            writer.close()
+            return
+        await self.receive(reader, self.add_peer(writer, None))
+
+    async def receive(self, reader, connection):
+        """
+        Receive frames from peer node and hand them to the client until it disconnects
+        :param reader: stream reader of peer
+        :param connection: AsyncPeer
+        :return:
+        """
+        try:
+            while True:
+                frame_type, length = decode_header(await reader.readexactly(HEADER.size))
+                payload = await reader.readexactly(length)
+                if frame_type == FRAME_HELLO:
+                    connection.peer_id = payload.decode('utf-8')
+                else:
+                    self.client.handle_frame(connection.peer_id, frame_type, memoryview(payload), connection)
+                # readexactly doesn't yield while data is buffered, let writer tasks drain queues between frames
+                await asyncio.sleep(0)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            logging.info("%s disconnected from %s" % (connection, self.client))
+        except (struct.error, ValueError) as e:
+            logging.info("%s: bad frame from %s: %r" % (self.client, connection, e))
+        finally:
+            if connection in self.client.connections:
+                self.client.connections.remove(connection)
+            connection.close()
+            self.client.topology.disconnected(connection)
+
+    def send(self, frame_type, payloads, origin, targets=None):
+        if self.loop is None:
+            return
+        if get_ident() != self.loop_thread:
+            # called from outside the node, e.g. start_mining
+            self.loop.call_soon_threadsafe(self.send, frame_type, payloads, origin, targets)
+            return
+        for connection in self.client.connections if targets is None else targets:
+            # send if peer is not same as where it came from
+            if connection is not origin:
+                connection.send(frame_type, payloads)
+
+    def send_to(self, connection, frame_type, payloads):
+        connection.send(frame_type, payloads)
+
+    def start_miner(self):
+        if get_ident() != self.loop_thread:
+            # called from outside the node, e.g. by the sync thread once caught up
+            self.loop.call_soon_threadsafe(self.start_miner)
+            return
+        self.loop.create_task(self.mine())
+
+    def notify_new_block(self):
+        if self.loop is None:
+            return
+        if get_ident() != self.loop_thread:
+            # called from outside the node, e.g. a block added by the sync thread
+            self.loop.call_soon_threadsafe(self.new_block_received.set)
+            return
+        self.new_block_received.set()
+
+    async def mine(self):
+        """
+        Mining timer of Client.mine on the event loop
+        :return:
+        """
+        client = self.client
+        while True:
+            # wait till time-out or a new block in longest chain received
+            try:
+                await asyncio.wait_for(self.new_block_received.wait(), timeout=client.mining_timer())
+            except asyncio.TimeoutError:
+                # mine a new block and broadcast it
+                client.mine_block()
+            else:
+                # if new block received reset miner
+                self.new_block_received.clear()
@@ -0,0 +1,64 @@
+import struct
+import time
+
+import pytest
+
+from core.blockchain import BLOCK_FORMAT, Blockhain
+
+
+def chain(count, parent=0x9e1c, tag=0):
+    blocks = []
+    for i in range(count):
+        block = struct.pack(BLOCK_FORMAT, parent, tag, int(time.time()), i)
+        parent = Blockhain.sha256(block)
+        blocks.append(block)
+    return blocks
+
+
+def test_add_range_links_blocks_by_height():
+    blocks = chain(10)
+    block_chain = Blockhain()
+    assert block_chain.add_range(list(enumerate(blocks))) == (10, 0)
+    assert block_chain.export()[0] == blocks
+    assert block_chain.tip == blocks[-1]
+    # served again, nothing changes
+    assert block_chain.add_range(list(enumerate(blocks))) == (0, 0)
+    assert len(block_chain.blocks) == 10
+
+
+def test_add_range_skips_a_block_stored_at_another_height():
+    a, b = chain(2)
+    # another branch whose block at height 1 has the 16 bit hash of a, so b also links at height 2
+    x = chain(1, tag=1)[0]
+    candidates = (struct.pack(BLOCK_FORMAT, Blockhain.sha256(x), 2, 0, nonce) for nonce in range(1 << 20))
+    c = next(block for block in candidates if Blockhain.sha256(block) == Blockhain.sha256(a))
+    block_chain = Blockhain()
+    assert block_chain.add_range([(0, a), (0, x), (1, b), (1, c)]) == (4, 0)
+    before = block_chain.export(), block_chain.stats(), dict(block_chain.block_index)
+    assert block_chain.add_range([(2, b)]) == (0, 0)
+    assert (block_chain.export(), block_chain.stats(), dict(block_chain.block_index)) == before
+    assert block_chain.blocks[b] == (Blockhain.sha256(b), 1, a)
+
+
+def test_add_range_rejects_unlinked_blocks():
+    block_chain = Blockhain()
+    block_chain.add_range(list(enumerate(chain(3))))
+    stray = chain(2, parent=0x1234, tag=1)
+    assert block_chain.add_range([(3, stray[0]), (4, stray[1])]) == (0, 2)
+    assert len(block_chain.blocks) == 3
+
+
+def test_tree_links_each_block_to_its_parent(monkeypatch):
+    pytest.importorskip('matplotlib').use('Agg')
+    plt = pytest.importorskip('matplotlib.pyplot')
+    networkx = pytest.importorskip('networkx')
+    main = chain(3)
+    fork = chain(2, parent=Blockhain.sha256(main[0]), tag=1)
+    block_chain = Blockhain()
+    block_chain.add_range(list(enumerate(main)) + [(height + 1, block) for height, block in enumerate(fork)])
+    drawn = []
+    monkeypatch.setattr(networkx, 'draw', lambda graph, **kwargs: drawn.append(graph))
+    monkeypatch.setattr(plt, 'show', lambda: None)
+    block_chain.tree()
+    edges = {tuple(sorted(edge)) for edge in drawn[0].edges}
+    assert edges == {('1_0', 'genesis'), ('1_0', '2_0'), ('1_0', '2_1'), ('2_0', '3_0'), ('2_1', '3_1')}
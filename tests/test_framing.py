@@ -0,0 +1,106 @@
+import socket
+
+import pytest
+
+from core.framing import (FRAME_BLOCKS, FRAME_HELLO, FRAME_INV, FRAME_START_MN, HEADER, MAX_FRAME, FrameReader,
+                          decode_header, encode_frame, encode_frames, encode_header, sendmsg_all)
+
+
+@pytest.fixture
+def sockets():
+    a, b = socket.socketpair()
+    yield a, b
+    a.close()
+    b.close()
+
+
+def receive(reader, sock, count):
+    """
+    Read from sock until count frames were parsed, copying payloads as their views don't outlive recv_into
+    """
+    frames = []
+    while len(frames) < count:
+        assert reader.recv_into(sock)
+        frames.extend((frame_type, bytes(payload)) for frame_type, payload in reader.frames())
+    return frames
+
+
+def feed(reader, data):
+    reader.view[reader.end:reader.end + len(data)] = data
+    reader.end += len(data)
+
+
+def parse(reader):
+    return [(frame_type, bytes(payload)) for frame_type, payload in reader.frames()]
+
+
+def test_frame_split_across_receives(sockets):
+    a, b = sockets
+    reader = FrameReader()
+    data = b''.join(encode_frame(FRAME_BLOCKS, [b'x' * 12, b'y' * 12]))
+    a.sendall(data[:3])
+    reader.recv_into(b)
+    assert parse(reader) == []
+    a.sendall(data[3:10])
+    reader.recv_into(b)
+    assert parse(reader) == []
+    a.sendall(data[10:])
+    assert receive(reader, b, 1) == [(FRAME_BLOCKS, b'x' * 12 + b'y' * 12)]
+    # fully parsed, the buffer starts over
+    assert reader.start == reader.end == 0
+
+
+def test_several_frames_in_one_receive(sockets):
+    a, b = sockets
+    reader = FrameReader()
+    sendmsg_all(a, encode_frame(FRAME_HELLO, [b'127.0.0.1:9000']) + encode_frame(FRAME_START_MN))
+    assert receive(reader, b, 2) == [(FRAME_HELLO, b'127.0.0.1:9000'), (FRAME_START_MN, b'')]
+
+
+def test_buffer_grows_past_initial_size(sockets):
+    a, b = sockets
+    reader = FrameReader(size=16)
+    payload = bytes(range(256)) * 4
+    sendmsg_all(a, encode_frame(FRAME_BLOCKS, [payload]) + encode_frame(FRAME_INV, [b'abcdefgh']))
+    assert receive(reader, b, 2) == [(FRAME_BLOCKS, payload), (FRAME_INV, b'abcdefgh')]
+    assert len(reader.buffer) >= HEADER.size + len(payload)
+
+
+def test_compact_keeps_pending_data():
+    reader = FrameReader(size=32)
+    feed(reader, encode_header(FRAME_INV, 8) + b'abcdefgh' + encode_header(FRAME_INV, 8))
+    assert parse(reader) == [(FRAME_INV, b'abcdefgh')]
+    reader.compact()
+    assert (reader.start, reader.end) == (0, HEADER.size)
+    assert bytes(reader.buffer[:HEADER.size]) == encode_header(FRAME_INV, 8)
+
+
+def test_frame_above_max_frame_is_rejected():
+    assert decode_header(encode_header(FRAME_BLOCKS, MAX_FRAME)) == (FRAME_BLOCKS, MAX_FRAME)
+    with pytest.raises(ConnectionError):
+        decode_header(encode_header(FRAME_BLOCKS, MAX_FRAME + 1))
+    reader = FrameReader(size=16)
+    feed(reader, encode_header(FRAME_BLOCKS, 0xffffffff))
+    with pytest.raises(ConnectionError):
+        list(reader.frames())
+    # nothing was allocated for the announced payload
+    assert len(reader.buffer) == 16
+
+
+def test_encode_frames_merges_coalesced_frames():
+    buffers = encode_frames([(FRAME_BLOCKS, [b'a' * 12]), (FRAME_BLOCKS, [b'b' * 12]), (FRAME_INV, [b'i' * 8]),
+                             (FRAME_HELLO, [b'x']), (FRAME_HELLO, [b'y']), (FRAME_BLOCKS, [b'c' * 12])])
+    reader = FrameReader()
+    feed(reader, b''.join(buffers))
+    assert parse(reader) == [
+        (FRAME_BLOCKS, b'a' * 12 + b'b' * 12),
+        (FRAME_INV, b'i' * 8),
+        # hello frames are not coalesced
+        (FRAME_HELLO, b'x'),
+        (FRAME_HELLO, b'y'),
+        (FRAME_BLOCKS, b'c' * 12),
+    ]
+
+
+def test_encode_frames_empty():
+    assert encode_frames([]) == []
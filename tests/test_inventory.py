@@ -0,0 +1,76 @@
+import hashlib
+import struct
+import time
+
+import core.blockchain
+import core.inventory
+from core.blockchain import BLOCK_FORMAT, Blockhain
+from core.inventory import INV_ID_SIZE, Inventory, inv_ids
+
+
+class CountingSha256:
+    def __init__(self):
+        self.calls = 0
+        self.sha256 = hashlib.sha256
+
+    def __call__(self, *args):
+        self.calls += 1
+        return self.sha256(*args)
+
+
+def block(i):
+    return struct.pack(BLOCK_FORMAT, 0x9e1c, 0, int(time.time()), i)
+
+
+def test_inventory_id_is_digest_prefix():
+    inventory = Inventory()
+    digest = hashlib.sha256(block(1)).digest()
+    assert inventory.add(block(1), digest=digest) == digest[:INV_ID_SIZE] == inventory.inv_id(block(1))
+    assert inventory.get(digest[:INV_ID_SIZE]) == block(1)
+    assert Inventory().add(block(1)) == digest[:INV_ID_SIZE]
+
+
+def test_known_block_is_not_hashed_again(monkeypatch):
+    sha256 = CountingSha256()
+    monkeypatch.setattr(core.inventory.hashlib, 'sha256', sha256)
+    inventory = Inventory()
+    inv_id = inventory.add(block(1), digest=sha256.sha256(block(1)).digest())
+    # relaying it in inv mode adds it again
+    assert inventory.add(block(1)) == inv_id
+    assert inventory.inv_id(block(1)) == inv_id
+    assert sha256.calls == 0
+
+
+def test_verify_with_digest_doesnt_hash(monkeypatch):
+    block_chain = Blockhain(difficulty=1)
+    # a nonce whose digest meets one bit of difficulty
+    message = next(block for block in map(block, range(100))
+                   if hashlib.sha256(block).digest() < block_chain.target)
+    digest = hashlib.sha256(message).digest()
+    sha256 = CountingSha256()
+    monkeypatch.setattr(core.blockchain.hashlib, 'sha256', sha256)
+    assert block_chain.verify_and_add_block(message, digest=digest) == (True, True)
+    assert sha256.calls == 0
+    assert block_chain.blocks[message][0] == int.from_bytes(digest[-2:], 'big')
+
+
+def test_rejected_blocks_are_not_served_or_wanted():
+    inventory = Inventory()
+    inv_id = inventory.add(block(1), valid=False)
+    assert inventory.get(inv_id) is None
+    assert inventory.want([inv_id]) == []
+    assert inventory.recent(10) == []
+
+
+def test_capacity_and_request_timeout():
+    now = [0.0]
+    inventory = Inventory(capacity=2, request_timeout=1.0, clock=lambda: now[0])
+    ids = [inventory.add(block(i)) for i in range(3)]
+    assert inventory.get(ids[0]) is None
+    assert inventory.recent(5) == [ids[2], ids[1]]
+    assert len(inventory.ids) == 2
+    wanted = b'w' * INV_ID_SIZE
+    assert inventory.want(inv_ids(wanted + ids[2])) == [wanted]
+    assert inventory.want([wanted]) == []
+    now[0] = 1.5
+    assert inventory.want([wanted]) == [wanted]
@@ -0,0 +1,66 @@
+from core.orphans import OrphanPool
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def block(i):
+    return i.to_bytes(12, 'big')
+
+
+def test_children_are_returned_oldest_first():
+    pool = OrphanPool(clock=Clock())
+    pool.add(block(1), 7)
+    pool.add(block(2), 7)
+    pool.add(block(3), 8)
+    assert not pool.add(block(1), 7)
+    assert pool.pop_children(7) == [block(1), block(2)]
+    assert block(1) not in pool
+    assert len(pool) == 1
+    assert pool.stats()['connected'] == 2
+
+
+def test_old_orphans_expire_without_new_arrivals():
+    clock = Clock()
+    dropped = []
+    pool = OrphanPool(max_age=10, clock=clock, on_evict=dropped.append)
+    pool.add(block(1), 7)
+    pool.add(block(2), 8)
+    clock.now = 11
+    # no add() happens; reading the stats is enough to drop them
+    stats = pool.stats()
+    assert stats['size'] == 0
+    assert stats['missing_parents'] == 0
+    assert stats['evicted'] == 2
+    assert dropped == [block(1), block(2)]
+
+
+def test_pop_children_drops_expired_orphans():
+    clock = Clock()
+    pool = OrphanPool(max_age=10, clock=clock)
+    pool.add(block(1), 7)
+    clock.now = 5
+    pool.add(block(2), 8)
+    clock.now = 12
+    assert pool.pop_children(8) == [block(2)]
+    assert block(1) not in pool
+    assert pool.by_parent == {}
+    assert pool.evicted == 1
+
+
+def test_size_limits():
+    pool = OrphanPool(max_orphans=2, max_bytes=100, clock=Clock())
+    for i in range(3):
+        pool.add(block(i), i)
+    assert block(0) not in pool
+    assert len(pool) == 2
+    pool = OrphanPool(max_orphans=10, max_bytes=24, clock=Clock())
+    for i in range(3):
+        pool.add(block(i), i)
+    assert block(0) not in pool
+    assert pool.bytes == 24
@@ -0,0 +1,59 @@
+import asyncio
+from threading import Thread, get_ident
+
+from core.framing import FRAME_BLOCKS, HEADER, decode_header
+from core.peer import AsyncPeer
+
+
+async def connected_peer():
+    """
+    An AsyncPeer writing to a loopback connection, and the reader of its other end
+    """
+    accepted = asyncio.get_running_loop().create_future()
+    server = await asyncio.start_server(lambda reader, writer: accepted.set_result(reader), '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+    _, writer = await asyncio.open_connection('127.0.0.1', port)
+    reader = await accepted
+    server.close()
+    peer = AsyncPeer(writer, 'peer')
+    peer.start()
+    return peer, reader
+
+
+async def read_frame(reader):
+    frame_type, length = decode_header(await reader.readexactly(HEADER.size))
+    return frame_type, await reader.readexactly(length)
+
+
+def test_send_from_another_thread():
+    async def main():
+        peer, reader = await connected_peer()
+        results = []
+        put, threads = peer.put, []
+        # the queue must only be touched on the loop's thread
+        peer.put = lambda *args: threads.append(get_ident()) or put(*args)
+        # as the sync thread answering a peer does
+        thread = Thread(target=lambda: results.append(peer.send(FRAME_BLOCKS, [b'x' * 12])))
+        thread.start()
+        thread.join()
+        frame = await asyncio.wait_for(read_frame(reader), 5)
+        peer.close()
+        assert threads == [get_ident()]
+        return results, frame
+
+    results, frame = asyncio.run(main())
+    assert results == [True]
+    assert frame == (FRAME_BLOCKS, b'x' * 12)
+
+
+def test_close_from_another_thread():
+    async def main():
+        peer, reader = await connected_peer()
+        thread = Thread(target=peer.close)
+        thread.start()
+        thread.join()
+        assert peer.closed
+        assert not peer.send(FRAME_BLOCKS, [b'x' * 12])
+        return await asyncio.wait_for(reader.read(), 5)
+
+    assert asyncio.run(main()) == b''
@@ -0,0 +1,27 @@
+import hashlib
+import struct
+from threading import Condition
+
+from core.pow import NONCE, ProofOfWork
+
+
+HEADER = struct.pack('HHI', 1, 2, 3)
+
+
+def test_search_finds_nonce_below_target():
+    proof_of_work = ProofOfWork(8, workers=1, batch=1 << 10)
+    try:
+        nonce = proof_of_work.search(HEADER, Condition(), lambda: False)
+    finally:
+        proof_of_work.close()
+    assert nonce is not None
+    assert hashlib.sha256(HEADER + NONCE.pack(nonce)).digest() < proof_of_work.target
+    assert proof_of_work.stats()['found'] == 1
+
+
+def test_search_after_pool_shutdown_without_close():
+    proof_of_work = ProofOfWork(8, workers=1)
+    # what interpreter exit does to the executor of a node that never closed it
+    proof_of_work.start().shutdown(wait=True)
+    assert proof_of_work.search(HEADER, Condition(), lambda: False) is None
+    assert proof_of_work.closed
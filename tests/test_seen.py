@@ -0,0 +1,106 @@
+from core.seen import BloomFilter, SeenCache, StripedSeenCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def message(i):
+    return i.to_bytes(12, 'big')
+
+
+def test_add_reports_new_once():
+    cache = SeenCache(capacity=10, ttl=None)
+    assert cache.add(message(1))
+    assert not cache.add(message(1))
+    assert message(1) in cache
+    assert message(2) not in cache
+
+
+def test_lru_eviction_keeps_recently_seen():
+    cache = SeenCache(capacity=2, ttl=None)
+    cache.add(message(1))
+    cache.add(message(2))
+    # seeing 1 again makes 2 the least recently seen
+    cache.add(message(1))
+    cache.add(message(3))
+    assert message(1) in cache
+    assert message(2) not in cache
+    assert message(3) in cache
+    assert cache.stats()['evictions'] == 1
+
+
+def test_ttl_expiry():
+    clock = Clock()
+    cache = SeenCache(capacity=10, ttl=5, clock=clock)
+    cache.add(message(1))
+    clock.now = 5
+    assert message(1) in cache
+    clock.now = 5.5
+    assert message(1) not in cache
+    assert cache.add(message(1))
+
+
+def test_discard_accepts_message_again():
+    cache = SeenCache(capacity=10, ttl=None)
+    cache.add(message(1))
+    cache.discard(message(1))
+    assert message(1) not in cache
+    assert cache.add(message(1))
+
+
+def test_bloom_remembers_capacity_evictions():
+    cache = SeenCache(capacity=2, ttl=None, bloom_capacity=100)
+    for i in range(5):
+        cache.add(message(i))
+    assert len(cache) == 2
+    assert message(0) in cache
+    assert cache.stats()['bloom_hits'] == 1
+
+
+def test_bloom_forgets_expired_messages():
+    clock = Clock()
+    cache = SeenCache(capacity=10, ttl=5, bloom_capacity=100, clock=clock)
+    cache.add(message(1))
+    clock.now = 10
+    # evicts the expired message
+    cache.add(message(2))
+    assert len(cache) == 1
+    assert message(1) not in cache
+    assert cache.add(message(1))
+    assert message(1) in cache
+
+
+def test_bloom_forgets_discarded_messages():
+    cache = SeenCache(capacity=2, ttl=None, bloom_capacity=100)
+    cache.add(message(1))
+    cache.discard(message(1))
+    assert message(1) not in cache
+    assert cache.add(message(1))
+    assert not cache.add(message(1))
+
+
+def test_bloom_filter_rotation_drops_old_generation():
+    bloom = BloomFilter(capacity=4)
+    for i in range(4):
+        bloom.add(message(i))
+    # fills the second generation, the first one is dropped on the next rotation
+    for i in range(4, 9):
+        bloom.add(message(i))
+    assert bloom.rotations == 2
+    assert all(message(i) in bloom for i in range(4, 9))
+    assert not any(message(i) in bloom for i in range(4))
+
+
+def test_striped_cache():
+    cache = StripedSeenCache(stripes=4, capacity=100, ttl=None)
+    assert all(cache.add(message(i)) for i in range(50))
+    assert not any(cache.add(message(i)) for i in range(50))
+    cache.discard(message(7))
+    assert message(7) not in cache
+    assert len(cache) == 49
+    assert cache.stats()['size'] == 49
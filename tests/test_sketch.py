@@ -0,0 +1,71 @@
+import pytest
+
+from core.blockchain import BLOCK_SIZE
+from core.sketch import CELL, SKETCH_HASHES, Sketch, digest
+
+
+def blocks(count, seed=0):
+    return [(seed * 1000003 + i + 1).to_bytes(BLOCK_SIZE, 'big') for i in range(count)]
+
+
+def difference(ours, theirs, cells):
+    return Sketch.of(ours, cells).subtract(Sketch.of(theirs, cells)).peel()
+
+
+def test_digest_ignores_order():
+    shared = blocks(50)
+    assert digest(shared) == digest(reversed(shared))
+    assert digest(shared) != digest(shared[1:])
+
+
+def test_equal_sets_cancel():
+    shared = blocks(200)
+    assert difference(shared, list(reversed(shared)), 30) == ([], [])
+
+
+@pytest.mark.parametrize('differing', [1, 5, 12])
+def test_peel_symmetric_difference_within_capacity(differing):
+    shared = blocks(300)
+    ours, theirs = blocks(differing, seed=1), blocks(differing, seed=2)
+    found = difference(shared + ours, theirs + shared, 48)
+    assert found is not None
+    assert sorted(found[0]) == sorted(ours)
+    assert sorted(found[1]) == sorted(theirs)
+
+
+def test_peel_fails_beyond_capacity():
+    shared = blocks(300)
+    # 3 hashes per block, a table of 48 cells can't hold 80 distinct blocks
+    assert difference(shared + blocks(40, seed=1), shared + blocks(40, seed=2), 48) is None
+
+
+def test_peel_at_capacity_is_exact_or_fails():
+    # near capacity peeling may fail, but never returns a wrong difference
+    for seed in range(20):
+        ours, theirs = blocks(12, seed=3 * seed + 1), blocks(12, seed=3 * seed + 2)
+        found = difference(ours, theirs, 36)
+        if found is not None:
+            assert sorted(found[0]) == sorted(ours)
+            assert sorted(found[1]) == sorted(theirs)
+
+
+def test_encode_decode_round_trip():
+    sketch = Sketch.of(blocks(20), 30)
+    decoded = Sketch.decode(memoryview(sketch.encode()))
+    assert (decoded.counts, decoded.keys, decoded.checks) == (sketch.counts, sketch.keys, sketch.checks)
+
+
+def test_cells_round_up_to_hashes():
+    assert len(Sketch(10).counts) == 12
+    assert len(Sketch(0).counts) == SKETCH_HASHES
+
+
+@pytest.mark.parametrize('size', [0, 1, CELL.size - 1, CELL.size, 3 * CELL.size + 5, 4 * CELL.size])
+def test_decode_rejects_malformed_payload(size):
+    with pytest.raises(ValueError):
+        Sketch.decode(bytes(size))
+
+
+def test_subtract_rejects_other_size():
+    with pytest.raises(ValueError):
+        Sketch(24).subtract(Sketch(48))
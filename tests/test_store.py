@@ -0,0 +1,179 @@
+import os
+import struct
+import time
+
+import pytest
+
+from core.blockchain import BLOCK_FORMAT, Blockhain
+from core.store import WAL_HEADER, WAL_RECORD, ChainStore, StoredBlocks
+
+
+def make_chain(n_blocks, fork_every=7, first=0):
+    """
+    Blocks each child of the previous one, except that every fork_every-th block is a sibling of the previous one
+    """
+    now = int(time.time())
+    blocks = []
+    parent = 0x9e1c
+    for i in range(first, first + n_blocks):
+        block = struct.pack(BLOCK_FORMAT, parent, i & 0xffff, now, i)
+        blocks.append(block)
+        if i % fork_every:
+            parent = Blockhain.sha256(block)
+    return blocks
+
+
+def add(block_chain, blocks):
+    for block in blocks:
+        assert block_chain.verify_and_add_block(block)[0]
+
+
+def reopen(directory):
+    block_chain = Blockhain()
+    store = ChainStore(directory)
+    store.open(block_chain)
+    return block_chain, store
+
+
+def assert_same_chain(restored, original):
+    assert restored.export() == original.export()
+    assert restored.stats() == original.stats()
+    assert restored.tip == original.tip
+    assert dict(restored.block_index) == original.block_index
+    for level in original.block_chain:
+        for block in level:
+            assert restored.blocks[block] == original.blocks[block]
+
+
+def test_wal_replay(tmp_path):
+    block_chain = Blockhain()
+    store = ChainStore(str(tmp_path), snapshot_interval=10**6)
+    store.open(block_chain)
+    add(block_chain, make_chain(500))
+    store.close()
+    assert not os.path.exists(store.snapshot_path)
+    restored, reopened = reopen(str(tmp_path))
+    reopened.close()
+    assert_same_chain(restored, block_chain)
+
+
+def test_snapshot_and_wal_tail(tmp_path):
+    blocks = make_chain(1200)
+    block_chain = Blockhain()
+    store = ChainStore(str(tmp_path), snapshot_interval=10**6)
+    store.open(block_chain)
+    add(block_chain, blocks[:1000])
+    assert store.snapshot() == 1000
+    add(block_chain, blocks[1000:])
+    store.close()
+    restored, reopened = reopen(str(tmp_path))
+    # the snapshot's blocks are looked up in place, only the tail was added
+    assert isinstance(restored.blocks, StoredBlocks)
+    assert len(restored.blocks.added) == 200
+    assert_same_chain(restored, block_chain)
+    # blocks still extend the restored chain, on its tip and on forks inside the snapshot
+    fork = struct.pack(BLOCK_FORMAT, restored.blocks[restored.block_chain[500][0]][0], 1, int(time.time()), 1 << 31)
+    restored.generate_block()
+    add(restored, [fork])
+    assert restored.block_chain[501][-1] == fork
+    assert restored.stats()['orphaned_branches'] == block_chain.stats()['orphaned_branches'] + 1
+    reopened.close()
+
+
+def test_snapshot_of_restored_chain(tmp_path):
+    blocks = make_chain(900)
+    block_chain = Blockhain()
+    store = ChainStore(str(tmp_path), snapshot_interval=10**6)
+    store.open(block_chain)
+    add(block_chain, blocks[:600])
+    store.snapshot()
+    store.close()
+    restored, reopened = reopen(str(tmp_path))
+    add(block_chain, blocks[600:])
+    add(restored, blocks[600:])
+    # merges the mapped snapshot with the blocks added since
+    assert reopened.snapshot() == 900
+    reopened.close()
+    assert sorted(os.listdir(str(tmp_path))) == ['snapshot', 'wal.%d' % reopened.segment]
+    again, store = reopen(str(tmp_path))
+    store.close()
+    assert len(again.blocks.added) == 0
+    assert_same_chain(again, block_chain)
+
+
+def test_empty_store(tmp_path):
+    block_chain, store = reopen(str(tmp_path))
+    assert store.snapshot() == 0
+    store.close()
+    restored, store = reopen(str(tmp_path))
+    store.close()
+    assert len(restored.blocks) == 0
+    assert restored.tip is None and restored.tip_hash == restored.genesis_hash
+    add(restored, make_chain(3))
+
+
+def test_torn_wal_record_is_ignored(tmp_path):
+    block_chain = Blockhain()
+    store = ChainStore(str(tmp_path))
+    store.open(block_chain)
+    add(block_chain, make_chain(10))
+    store.close()
+    with open(store.wal_path(store.segment), 'ab') as f:
+        f.write(WAL_RECORD.pack(10, make_chain(11)[-1])[:-3])
+    restored, reopened = reopen(str(tmp_path))
+    reopened.close()
+    assert_same_chain(restored, block_chain)
+
+
+def test_bad_snapshot_magic(tmp_path):
+    block_chain = Blockhain()
+    store = ChainStore(str(tmp_path))
+    store.open(block_chain)
+    add(block_chain, make_chain(10))
+    store.snapshot()
+    store.close()
+    with open(store.snapshot_path, 'r+b') as f:
+        f.write(b'OLDMAGIC')
+    with pytest.raises(ValueError):
+        reopen(str(tmp_path))
+
+
+def test_bad_wal_header(tmp_path):
+    block_chain = Blockhain()
+    store = ChainStore(str(tmp_path))
+    store.open(block_chain)
+    add(block_chain, make_chain(10))
+    store.close()
+    with open(store.wal_path(store.segment), 'r+b') as f:
+        f.seek(8)
+        # another version
+        f.write(struct.pack('<H', 99))
+    with pytest.raises(ValueError):
+        reopen(str(tmp_path))
+    assert os.path.getsize(store.wal_path(store.segment)) == WAL_HEADER.size + 10 * WAL_RECORD.size
+
+
+def test_log_is_written_after_the_chain_lock_is_released(tmp_path):
+    block_chain = Blockhain()
+    store = ChainStore(str(tmp_path), snapshot_interval=10**6)
+    store.open(block_chain)
+    wal, writes = store.wal, []
+
+    class Recorder:
+        def write(self, data):
+            writes.append((len(data), block_chain.lock.lock.locked()))
+            return wal.write(data)
+
+        def __getattr__(self, name):
+            return getattr(wal, name)
+
+    store.wal = Recorder()
+    blocks = make_chain(20, fork_every=10**6, first=1)
+    add(block_chain, blocks[:2])
+    # a synced range is written with one write
+    assert block_chain.add_range(list(enumerate(blocks))[2:]) == (18, 0)
+    store.close()
+    assert writes == [(WAL_RECORD.size, False), (WAL_RECORD.size, False), (18 * WAL_RECORD.size, False)]
+    restored, reopened = reopen(str(tmp_path))
+    reopened.close()
+    assert_same_chain(restored, block_chain)
@@ -0,0 +1,67 @@
+import struct
+import time
+
+from core.blockchain import BLOCK_FORMAT, Blockhain
+from core.framing import FRAME_GET_RANGE, FRAME_GET_STATUS
+from core.sync import RANGE, STATUS, ChainSync, encode_range
+
+
+class Connection:
+    closed = False
+
+
+class Client:
+    """
+    The parts of a Client sync uses, with neighbors that answer status requests from a fixed height and, if a chain
+    is given, serve ranges of it
+    """
+    def __init__(self, heights, served=None):
+        self.block_chain = Blockhain()
+        self.connections = list(heights)
+        self.heights = heights
+        self.served = served
+        self.transport = self
+        self.mining = False
+        self.miner_started = False
+        self.sync = ChainSync(self, batch=10, request_timeout=0.05, status_timeout=0.5)
+        self.asked = []
+
+    def send(self, frame_type, payloads, origin, targets):
+        for connection in targets:
+            if frame_type == FRAME_GET_STATUS:
+                self.sync.on_status(STATUS.pack(self.heights[connection], 0, 1), connection)
+            elif frame_type == FRAME_GET_RANGE:
+                self.asked.append(connection)
+                if self.served is not None:
+                    low, high = RANGE.unpack(payloads[0])
+                    self.sync.on_range(encode_range(self.served, low, high, 40), connection)
+
+    def start_miner(self):
+        self.miner_started = True
+
+
+def test_sync_fetches_history():
+    served = Blockhain()
+    parent = served.genesis_hash
+    for i in range(95):
+        block = struct.pack(BLOCK_FORMAT, parent, 0, int(time.time()), i)
+        served.verify_and_add_block(block)
+        parent = Blockhain.sha256(block)
+    client = Client({Connection(): 94}, served)
+    client.sync.run()
+    assert client.sync.synced.is_set() and client.miner_started
+    assert client.block_chain.export() == served.export()
+    assert client.sync.stats()['retries'] == 0
+
+
+def test_silent_neighbor_doesnt_stall_sync():
+    silent = Connection()
+    client = Client({silent: 1000})
+    started = time.time()
+    client.sync.run()
+    assert time.time() - started < 5
+    assert client.sync.synced.is_set()
+    # the miner waits for the sync only
+    assert client.miner_started
+    assert client.sync.stats()['retries'] >= client.sync.max_timeouts
+    assert set(client.asked) == {silent}